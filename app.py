@@ -1,10 +1,26 @@
+import os
+import time
+import uuid
+import weakref
 import streamlit as st
 from streamlit_folium import st_folium
 import folium
+from folium.plugins import Draw
 from jaxa_api import JaxaDataProvider
+from fetch_jobs import FetchJobManager
+from shared_store import SharedResultStore
+from region_index import RegionIndex
+from raster_render import FrameCache
+from instrumentation import configure_logging, get_metrics, record_stage
+from session_memory import SessionMemoryManager
+from zones import ZoneMaskCache, fit_zone_forecasts, zonal_means, zones_from_geojson
 import numpy as np
 import pandas as pd
-from future_prefiction import create_future_prediction_graph, simulate_greening_effect
+from future_prefiction import (
+    create_future_prediction_graph, simulate_greening_effect, simulate_greening_grid, create_greening_heatmap,
+    fit_pixel_trends, fit_forecast, simulate_greening_map, forecast_intervals, greening_temperature_change,
+    DEFAULT_INTERVAL_LEVEL
+)
 
 # ページ設定
 st.set_page_config(
@@ -58,27 +74,153 @@ st.markdown('<div class="main-header">🌿 LeafCast：未来地表温度予測 
 st.markdown('<div class="sub-header">23年間の緑地指数と地表面温度から未来の数値を予測する</div>', unsafe_allow_html=True)
 
 START_YEAR = 2002
+NUM_YEARS = 23
+JOB_POLL_INTERVAL = 1.0
+FRAME_CACHE_MAX_BYTES = 32 * 1024 ** 2
+# 環境変数LEAFCAST_DIAGNOSTICS=1で処理時間・キャッシュの診断パネルを表示
+SHOW_DIAGNOSTICS = os.environ.get("LEAFCAST_DIAGNOSTICS") == "1"
+run_started = time.perf_counter()
+
+
+@st.cache_resource
+def setup_logging():
+    """構造化ログの出力先を1度だけ設定"""
+    configure_logging()
+
+
+setup_logging()
+
+
+@st.cache_resource
+def get_provider():
+    """プロセス全体で共有するデータ取得クラス"""
+    return JaxaDataProvider()
+
+
+@st.cache_resource
+def get_shared_store():
+    """全セッションで共有する取得ジョブと結果のストア（同じエリアの同時取得は1回にまとめる）"""
+    return SharedResultStore(get_provider(), progressive=True)
+
+
+def get_job_manager():
+    """セッションごとの取得ジョブ管理"""
+    if 'job_manager' not in st.session_state:
+        st.session_state.job_manager = FetchJobManager(get_shared_store())
+    return st.session_state.job_manager
+
+
+@st.cache_resource
+def get_region_index():
+    """事前集計した領域平均のインデックス（ファイルが無ければNone）"""
+    return RegionIndex.load()
+
+
+def lookup_region_index(bbox):
+    """
+    インデックスから全年の領域平均を求める
+
+    Returns:
+        tuple: (LST平均の配列, NDVI平均の配列)（インデックスで答えられないbboxはNone）
+    """
+    index = get_region_index()
+    if index is None:
+        return None
+    return index.lookup(bbox, np.arange(START_YEAR, START_YEAR + NUM_YEARS))
+
+
+@st.cache_resource
+def get_frame_cache():
+    """描画済み画像のLRUキャッシュ（表示中の年だけを必要なときに描画する）"""
+    return FrameCache(maxsize=64, max_bytes=FRAME_CACHE_MAX_BYTES)
+
+
+@st.cache_resource
+def get_zone_masks():
+    """ゾーンのピクセルマスクのキャッシュ（ゾーンの形と格子が同じなら全セッションで使い回す）"""
+    return ZoneMaskCache()
+
+
+@st.cache_resource
+def get_session_memory():
+    """セッションごとのデータを上限付きで保持するマネージャ（最後に使われたのが古いセッションから捨てる）"""
+    return SessionMemoryManager()
+
+
+def get_year_image(band, year, raster, value_range):
+    """選択年の画像をキャッシュから取得（無ければその場で描画）"""
+    bbox = st.session_state.last_bbox
+    key = (st.session_state.last_bbox_key, band, year, value_range, raster.shape)
+    return get_frame_cache().get_or_render(
+        key,
+        lambda: get_provider().render_image(raster, bbox, band, year, value_range)
+    )
+
+
+def map_range(values, symmetric=False):
+    """マップ表示用の色付け範囲（外れ値を避けるため2～98パーセンタイル）"""
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return 0.0, 1.0
+    low, high = np.percentile(finite, [2, 98])
+    if symmetric:
+        high = max(abs(low), abs(high))
+        low = -high
+    if high <= low:
+        high = low + 1e-6
+    return float(low), float(high)
+
+
+def get_pixel_trends(ndvi_cube, lst_cube):
+    """
+    ピクセル単位の回帰をキューブごとに1度だけ計算して保持（取得が進んでキューブが替わったら計算し直す）
+
+    結果はセッションのメモリ上限の対象になり、捨てられていたら計算し直す。
+    キューブは共有ジョブのものなので弱参照で比べるだけにし、エントリには結果の分だけを持たせる
+    （キューブを持つとメモリ上限で手放した共有キューブがこのセッションに残り続ける）。
+    """
+    memory = get_session_memory()
+    cached = memory.get(st.session_state.session_id, 'pixel_trends')
+    if cached is None or cached[0]() is not ndvi_cube or cached[1]() is not lst_cube:
+        pixel_trends = fit_pixel_trends(ndvi_cube, lst_cube)
+        memory.put(st.session_state.session_id, 'pixel_trends',
+                   (weakref.ref(ndvi_cube), weakref.ref(lst_cube), pixel_trends), nbytes=pixel_trends.nbytes)
+        return pixel_trends
+    return cached[2]
+
 
 # セッション状態の初期化
-if 'lst_images' not in st.session_state:
-    st.session_state.lst_images = None
-if 'lst_number_datas' not in st.session_state:
-    st.session_state.lst_number_datas = None
-if 'ndvi_images' not in st.session_state:
-    st.session_state.ndvi_images = None
-if 'ndvi_number_datas' not in st.session_state:
-    st.session_state.ndvi_number_datas = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 if 'last_bbox_key' not in st.session_state:
     st.session_state.last_bbox_key = ""
+if 'last_bbox' not in st.session_state:
+    st.session_state.last_bbox = None
+if 'index_means' not in st.session_state:
+    st.session_state.index_means = None
+
+# メモリ上限のためにこのセッションのデータと取得ジョブの参照が外されていたら、表示中の範囲を取り直す
+job_manager = get_job_manager()
+was_evicted = get_session_memory().touch(
+    st.session_state.session_id,
+    shared=lambda: job_manager.current,
+    on_evict=job_manager.cancel
+)
+if was_evicted and st.session_state.last_bbox is not None:
+    job_manager.submit(st.session_state.last_bbox_key, st.session_state.last_bbox, START_YEAR, NUM_YEARS)
 
 # step1: 地図表示
 st.markdown("---")
 st.markdown("### 📍 step1：調査エリアを選択")
-st.markdown("地図を操作して、調査エリアを表示してください。")
+st.markdown("地図を操作して、調査エリアを表示してください。左の描画ツールで多角形・四角形を描くと、step6でその範囲だけを集計します。")
 
 
 m_base = folium.Map(location=[33.66, 130.42], zoom_start=8)
-output = st_folium(m_base, width=700, height=525, key="base_map", returned_objects=["bounds"])
+Draw(
+    draw_options={"polyline": False, "circle": False, "marker": False, "circlemarker": False},
+    edit_options={"edit": False}
+).add_to(m_base)
+output = st_folium(m_base, width=700, height=525, key="base_map", returned_objects=["bounds", "all_drawings"])
 # データ取得
 if output and output.get('bounds'):
     b = output['bounds']
@@ -97,47 +239,43 @@ if output and output.get('bounds'):
             # 範囲が変わった時だけ取得
             if st.session_state.last_bbox_key != bbox_key:
                 st.session_state.last_bbox_key = bbox_key
-                st.session_state.lst_images = None
-                st.session_state.lst_number_datas = None
-                st.session_state.ndvi_images = None
-                st.session_state.ndvi_number_datas = None
-                
-                with st.spinner("🛰️ 衛星データを取得中... しばらくお待ちください"):
-                    provider = JaxaDataProvider()
-                    # LSTデータ取得
-                    st.session_state.lst_images, st.session_state.lst_number_datas = provider.get_land_cover_images(
-                        current_bbox,
-                        START_YEAR,
-                        num_years=23
-                    )
-                    # NDVIデータ取得
-                    st.session_state.ndvi_images, st.session_state.ndvi_number_datas = provider.get_ndvi_images(
-                        current_bbox,
-                        START_YEAR,
-                        num_years=23
-                    )
-                st.rerun()
+                st.session_state.last_bbox = current_bbox
+                # 事前集計済みのエリアはグラフ・表をインデックスから即座に表示（画像は引き続き取得）
+                st.session_state.index_means = lookup_region_index(current_bbox)
+                # バックグラウンドで取得（連続した地図操作は古いジョブを取り消して最後の範囲だけ取得）
+                get_job_manager().submit(bbox_key, current_bbox, START_YEAR, NUM_YEARS)
+
+# 取得ジョブの途中経過を反映（届いた年から順に以降の表示に使う。キューブは共有ジョブが持ち、セッションには保持しない）
+fetch_job = get_job_manager().current
+fetch_in_progress = False
+lst_cube = ndvi_cube = lst_range = None
+if fetch_job is not None and fetch_job.key == st.session_state.last_bbox_key:
+    fetch_in_progress = not fetch_job.finished
+    lst_cube, ndvi_cube = fetch_job.cubes()
+    lst_range = get_provider().display_range('LST', [lst_cube.data])
+    if fetch_in_progress:
+        note = "低解像度の速報を表示中、高解像度に順次更新します" if fetch_job.is_preview else "取得済みの年から順に表示します"
+        st.progress(
+            fetch_job.progress,
+            text=f"🛰️ 衛星データを取得中... ({fetch_job.done_count}/{fetch_job.total}) {note}"
+        )
 
 # 画像表示
-if st.session_state.lst_images and st.session_state.ndvi_images:
-    # 取得成功した画像のみ抽出（両方のデータが揃っている年のみ）
-    valid_data = []
-    for i in range(len(st.session_state.lst_images)):
-        lst_img = st.session_state.lst_images[i]
-        ndvi_img = st.session_state.ndvi_images[i]
-        lst_num = st.session_state.lst_number_datas[i]
-        ndvi_num = st.session_state.ndvi_number_datas[i]
-        
-        if lst_img is not None and ndvi_img is not None:
-            valid_data.append({
-                'year': START_YEAR + i,
-                'lst_image': lst_img,
-                'ndvi_image': ndvi_img,
-                'lst_data': lst_num,
-                'ndvi_data': ndvi_num
-            })
+if lst_cube is not None and ndvi_cube is not None:
+    # 全年の領域平均を一括で計算し（事前集計済みのエリアはインデックスの値を使う）、両方のデータが揃っている年のみ抽出
+    if st.session_state.index_means is not None:
+        lst_means, ndvi_means = st.session_state.index_means
+    else:
+        lst_means = lst_cube.spatial_mean()
+        ndvi_means = ndvi_cube.spatial_mean()
+    has_rasters = bool(lst_cube.time_mask.any() and ndvi_cube.time_mask.any())
+    valid = np.isfinite(lst_means) & np.isfinite(ndvi_means)
+    valid_idx = np.flatnonzero(valid)
+    years = lst_cube.years[valid]
+    lst_values = lst_means[valid]
+    ndvi_values = ndvi_means[valid]
     
-    if len(valid_data) > 0:
+    if len(valid_idx) > 0:
         # step2: 衛星データ表示
         st.markdown("---")
         st.markdown("### 🛰️ step2：衛星観測データの確認")
@@ -145,23 +283,27 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
         # スライダー
         selected_idx = st.select_slider(
             "📅 表示年を選択してください",
-            options=list(range(len(valid_data))),
-            format_func=lambda x: f"{valid_data[x]['year']}年"
+            options=list(range(len(valid_idx))),
+            format_func=lambda x: f"{years[x]}年"
         )
         
         # 選択されたデータ
-        selected_data = valid_data[selected_idx]
+        cube_idx = valid_idx[selected_idx]
+        selected_year = int(years[selected_idx])
         
         # 画像を左右に並べて表示
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown(f"#### 🌡️ 地表面温度（LST）")
-            st.image(
-                selected_data['lst_image'],
-                caption=f"{selected_data['year']}年4月のLSTデータ",
-                use_container_width=True
-            )
+            if lst_cube.time_mask[cube_idx]:
+                st.image(
+                    get_year_image('LST', selected_year, lst_cube.data[cube_idx], lst_range),
+                    caption=f"{selected_year}年4月のLSTデータ",
+                    use_container_width=True
+                )
+            else:
+                st.info(f"🛰️ {selected_year}年の画像を取得中です。" if fetch_in_progress else f"ℹ️ {selected_year}年の画像はありません。")
             st.markdown("""
             <div class="info-box">
             <b>LST (Land Surface Temperature)</b><br>
@@ -171,11 +313,14 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
         
         with col2:
             st.markdown(f"#### 🌿 植生指数（NDVI）")
-            st.image(
-                selected_data['ndvi_image'],
-                caption=f"{selected_data['year']}年4月のNDVIデータ",
-                use_container_width=True
-            )
+            if ndvi_cube.time_mask[cube_idx]:
+                st.image(
+                    get_year_image('ndvi', selected_year, ndvi_cube.data[cube_idx], get_provider().display_range('ndvi', [])),
+                    caption=f"{selected_year}年4月のNDVIデータ",
+                    use_container_width=True
+                )
+            else:
+                st.info(f"🛰️ {selected_year}年の画像を取得中です。" if fetch_in_progress else f"ℹ️ {selected_year}年の画像はありません。")
             st.markdown("""
             <div class="info-box">
             <b>NDVI (Normalized Difference Vegetation Index)</b><br>
@@ -191,58 +336,67 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
         # 折れ線グラフ作成（未来予測付き）
         st.markdown("---")
         st.markdown("### 📊 step3：トレンド分析と未来予測")
+        if st.session_state.index_means is not None:
+            st.caption("📇 このエリアは事前集計済みのインデックスから表示しています")
         
-        # LSTとNDVIの平均値を計算
-        lst_values = []
-        ndvi_values = []
-        years = []
-        
-        for data in valid_data:
-            years.append(data['year'])
-            if data['lst_data'] is not None:
-                lst_values.append(np.nanmean(data['lst_data']))
-            else:
-                lst_values.append(0)
-            
-            if data['ndvi_data'] is not None:
-                ndvi_values.append(np.nanmean(data['ndvi_data']))
-            else:
-                ndvi_values.append(0)
-        
-        # 未来予測の計算（テーブル用）
-        from sklearn.linear_model import LinearRegression
-        
-        years_obs = np.array(years).reshape(-1, 1)
-        ndvi_obs = np.array(ndvi_values).reshape(-1, 1)
-        lst_obs = np.array(lst_values).reshape(-1, 1)
-        
-        model_ndvi = LinearRegression().fit(years_obs, ndvi_obs)
-        model_lst = LinearRegression().fit(ndvi_obs, lst_obs)
+        # 予測モデル（グラフ・テーブル・シミュレーションで共有し、回帰は1度だけ計算）
+        forecast = fit_forecast(years, ndvi_values, lst_values)
         
         # 未来20年分の予測
-        last_year = years[-1]
+        last_year = int(years[-1])
         years_future = list(range(last_year + 1, last_year + 21))
-        ndvi_future = []
-        lst_future = []
-        
-        for year in years_future:
-            predicted_ndvi = model_ndvi.predict([[year]])[0][0]
-            predicted_lst = model_lst.predict([[predicted_ndvi]])[0][0]
-            ndvi_future.append(predicted_ndvi)
-            lst_future.append(predicted_lst)
+        ndvi_future, lst_future = forecast.predict(years_future)
+        # 残差ブートストラップによる予測区間（グラフとテーブルで共有、結果はキャッシュされる）
+        ndvi_low, ndvi_high, lst_low, lst_high = forecast_intervals(years, ndvi_values, lst_values, years_future)
         
         # 未来予測グラフを生成
         fig = create_future_prediction_graph(years, ndvi_values, lst_values, START_YEAR, predict_years=20)
         st.pyplot(fig)
         
-        st.markdown("""
+        st.markdown(f"""
         <div class="warning-box">
         <b>💡 グラフの見方</b><br>
         • <b>実線</b>：過去の観測データ（衛星から取得した実測値）<br>
         • <b>破線</b>：未来予測データ（線形回帰モデルによる推定値）<br>
+        • <b>帯</b>：予測区間（観測のばらつきから、値がこの範囲に入る見込みが約{DEFAULT_INTERVAL_LEVEL:.0%}）<br>
         • 左軸（緑）：NDVI（植生指数） / 右軸（赤）：LST（地表面温度）
         </div>
         """, unsafe_allow_html=True)
+
+        # ピクセル単位の解析（エリア平均ではなく各ピクセルで回帰）
+        if has_rasters and st.checkbox("🗺️ ピクセルごとのトレンド・予測マップを表示"):
+            pixel_trends = get_pixel_trends(ndvi_cube, lst_cube)
+            map_year = st.slider(
+                "予測マップの対象年",
+                min_value=last_year + 1,
+                max_value=last_year + 20,
+                value=last_year + 10
+            )
+            _, lst_map = pixel_trends.forecast(map_year)
+            renderer = get_provider().renderer
+            bbox = st.session_state.last_bbox
+
+            col_map1, col_map2, col_map3 = st.columns(3)
+            with col_map1:
+                st.image(
+                    renderer.render(pixel_trends.ndvi_slope, bbox, *map_range(pixel_trends.ndvi_slope, symmetric=True),
+                                    'NDVI / year', 'NDVI trend'),
+                    caption="NDVIの年変化率（傾き）",
+                    use_container_width=True
+                )
+            with col_map2:
+                st.image(
+                    renderer.render(pixel_trends.lst_slope, bbox, *map_range(pixel_trends.lst_slope, symmetric=True),
+                                    '°C / NDVI', 'LST sensitivity to NDVI'),
+                    caption="NDVIあたりのLST変化（傾き）",
+                    use_container_width=True
+                )
+            with col_map3:
+                st.image(
+                    renderer.render(lst_map, bbox, *map_range(lst_map), 'Temperature (°C)', f'LST forecast - {map_year}'),
+                    caption=f"{map_year}年のLST予測マップ",
+                    use_container_width=True
+                )
         
         # データテーブル表示
         st.markdown("---")
@@ -262,17 +416,20 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
         
         with tab2:
             # 観測データと予測データを結合
-            all_years = years + years_future
-            all_ndvi = ndvi_values + ndvi_future
-            all_lst = lst_values + lst_future
+            all_years = list(years) + years_future
+            all_ndvi = list(ndvi_values) + list(ndvi_future)
+            all_lst = list(lst_values) + list(lst_future)
             data_type = ['✅ 観測'] * len(years) + ['🔮 予測'] * len(years_future)
+            interval_label = f"{DEFAULT_INTERVAL_LEVEL:.0%}予測区間"
             
             # DataFrameの作成
             df_all = pd.DataFrame({
                 '年': all_years,
                 '種別': data_type,
                 'NDVI（植生指数）': [f"{v:.4f}" for v in all_ndvi],
-                'LST（地表面温度 ℃）': [f"{v:.2f}" for v in all_lst]
+                f'NDVI {interval_label}': ['-'] * len(years) + [f"{lo:.4f}～{hi:.4f}" for lo, hi in zip(ndvi_low, ndvi_high)],
+                'LST（地表面温度 ℃）': [f"{v:.2f}" for v in all_lst],
+                f'LST {interval_label}（℃）': ['-'] * len(years) + [f"{lo:.2f}～{hi:.2f}" for lo, hi in zip(lst_low, lst_high)],
             })
             
             st.dataframe(df_all, use_container_width=True, hide_index=True)
@@ -327,9 +484,9 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
             # シミュレーション設定
             target_year = st.number_input(
                 "対象年",
-                min_value=years[-1] + 1,
-                max_value=years[-1] + 20,
-                value=years[-1] + 5,
+                min_value=last_year + 1,
+                max_value=last_year + 20,
+                value=last_year + 5,
                 step=1
             )
             
@@ -348,14 +505,7 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
             
             if run_simulation:
                 # ベースライン（通常予測）の計算
-                from sklearn.linear_model import LinearRegression as _LR
-                _years_obs = np.array(years).reshape(-1, 1)
-                _ndvi_obs = np.array(ndvi_values).reshape(-1, 1)
-                _lst_obs = np.array(lst_values).reshape(-1, 1)
-                _model_ndvi_tmp = _LR().fit(_years_obs, _ndvi_obs)
-                _model_lst_tmp = _LR().fit(_ndvi_obs, _lst_obs)
-                base_ndvi = _model_ndvi_tmp.predict([[target_year]])[0][0]
-                base_lst = _model_lst_tmp.predict([[base_ndvi]])[0][0]
+                base_ndvi, base_lst = (float(v) for v in forecast.predict(target_year))
                 sim_ndvi = base_ndvi * (1 + increase_rate)
                 
                 # simulate_greening_effect() を呼び出してシミュレーション後のLSTを取得
@@ -395,6 +545,104 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
                     st.info(f"ℹ️ このシミュレーションでは温度抑制効果が見られませんでした。")
             else:
                 st.info("👈 左側で設定を行い、「シミュレーション実行」ボタンを押してください")
+
+        # 全シナリオの一覧（対象年 × NDVI向上率を一括計算）
+        st.markdown("#### 🗺️ シナリオ一覧（対象年 × NDVI向上率）")
+        grid_years = np.arange(last_year + 1, last_year + 21)
+        grid_rates = np.arange(1, 21) / 100
+        lst_reduction = simulate_greening_grid(years, ndvi_values, lst_values, grid_years, grid_rates)
+        st.pyplot(create_greening_heatmap(grid_years, grid_rates, lst_reduction))
+
+        # ピクセル単位の緑化効果マップ
+        if has_rasters and st.checkbox("🗺️ ピクセルごとの緑化効果マップを表示"):
+            pixel_trends = get_pixel_trends(ndvi_cube, lst_cube)
+            base_ndvi_map, base_lst_map = pixel_trends.forecast(int(target_year))
+
+            target_mode = st.radio(
+                "緑化するピクセル",
+                ["すべてのピクセル", "予測LSTが高いピクセル", "予測NDVIが低いピクセル"],
+                horizontal=True
+            )
+            if target_mode == "予測LSTが高いピクセル":
+                top_percent = st.slider("対象とする高温ピクセルの割合（%）", 5, 100, 20, step=5)
+                greening_mask = base_lst_map >= np.nanpercentile(base_lst_map, 100 - top_percent)
+            elif target_mode == "予測NDVIが低いピクセル":
+                ndvi_threshold = st.slider("NDVIのしきい値", 0.0, 1.0, 0.3, step=0.05)
+                greening_mask = base_ndvi_map < ndvi_threshold
+            else:
+                greening_mask = None
+
+            cooling_map = simulate_greening_map(pixel_trends, int(target_year), increase_rate, mask=greening_mask)
+            selected = np.isfinite(cooling_map) if greening_mask is None else greening_mask & np.isfinite(cooling_map)
+
+            col_gmap1, col_gmap2 = st.columns([2, 1])
+            with col_gmap1:
+                st.image(
+                    get_provider().renderer.render(
+                        cooling_map, st.session_state.last_bbox, *map_range(cooling_map),
+                        'LST reduction (°C)', f'Greening effect - {int(target_year)}'
+                    ),
+                    caption=f"{int(target_year)}年にNDVIを{increase_rate*100:.0f}%向上させた場合の温度低減量",
+                    use_container_width=True
+                )
+            with col_gmap2:
+                if selected.any():
+                    st.metric("対象ピクセル数", f"{int(selected.sum())}")
+                    st.metric("平均低減量", f"{np.mean(cooling_map[selected]):.2f}℃")
+                    st.metric("最大低減量", f"{np.max(cooling_map[selected]):.2f}℃")
+                else:
+                    st.info("ℹ️ 条件に合うピクセルがありません。")
+
+        # ゾーン別の分析（描いた・アップロードした多角形の内側のピクセルだけを集計）
+        st.markdown("---")
+        st.markdown("### 🧩 step6：ゾーン別の分析")
+        st.markdown("区・公園・緑化予定地などの範囲ごとに、海や周辺の市街地を含めずに集計します。")
+        zones = zones_from_geojson((output or {}).get('all_drawings') or [], default_name="描いたゾーン")
+        uploaded = st.file_uploader("ゾーンのGeoJSONをアップロード（名前はnameプロパティ）", type=["geojson", "json"])
+        if uploaded is not None:
+            try:
+                zones += zones_from_geojson(uploaded.getvalue())
+            except ValueError:
+                st.error("❌ GeoJSONを読み込めませんでした。")
+
+        if not has_rasters:
+            st.info("🛰️ 画像の取得後にゾーン別の集計を表示します。")
+        elif not zones:
+            st.info("👆 step1の地図に多角形を描くか、GeoJSONをアップロードしてください。")
+        else:
+            # マスクはキャッシュから取り出し、全ゾーン・全年の平均は1回の行列積でまとめて計算
+            zone_masks = get_zone_masks().masks(zones, ndvi_cube.bbox, ndvi_cube.shape[1:])
+            zone_ndvi = zonal_means(ndvi_cube, zone_masks)
+            zone_lst = zonal_means(lst_cube, zone_masks)
+            zone_forecasts = fit_zone_forecasts(ndvi_cube.years, zone_ndvi, zone_lst)
+            zone_names = [zone.name for zone in zones]
+            zone_names = [f"{name} ({i + 1})" if zone_names.count(name) > 1 else name for i, name in enumerate(zone_names)]
+
+            rows = []
+            for i, zone_forecast in enumerate(zone_forecasts):
+                observed = np.isfinite(zone_ndvi[:, i]) & np.isfinite(zone_lst[:, i])
+                row = {'ゾーン': zone_names[i], 'ピクセル数': int(zone_masks[i].sum()), '観測年数': int(observed.sum())}
+                if zone_forecast is not None:
+                    zone_ndvi_target, zone_lst_target = (float(v) for v in zone_forecast.predict(int(target_year)))
+                    row.update({
+                        'LST平均（℃）': f"{np.mean(zone_lst[observed, i]):.2f}",
+                        f'{int(target_year)}年NDVI予測': f"{zone_ndvi_target:.4f}",
+                        f'{int(target_year)}年LST予測（℃）': f"{zone_lst_target:.2f}",
+                        f'緑化{increase_rate*100:.0f}%の低減量（℃）':
+                            f"{-float(greening_temperature_change(zone_ndvi_target, increase_rate)):.2f}",
+                    })
+                rows.append(row)
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+            st.caption(f"予測・緑化はstep5の設定（{int(target_year)}年、NDVI向上率{increase_rate*100:.0f}%）で計算しています。"
+                       "範囲外のゾーンはピクセル数が0になります。")
+
+            col_zone1, col_zone2 = st.columns(2)
+            with col_zone1:
+                st.markdown("#### 🌿 ゾーン別NDVI")
+                st.line_chart(pd.DataFrame(zone_ndvi, index=ndvi_cube.years, columns=zone_names))
+            with col_zone2:
+                st.markdown("#### 🌡️ ゾーン別LST（℃）")
+                st.line_chart(pd.DataFrame(zone_lst, index=lst_cube.years, columns=zone_names))
         
         # 技術情報（折りたたみ）
         st.markdown("---")
@@ -427,6 +675,11 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
             温度低減効果 = シミュレーションLST - 通常予測LST
             ```
             
+            #### 4. 予測区間（残差ブートストラップ）
+            - 2つの回帰の残差（同じ年の組）を2000回引き直して観測値を作り直し、それぞれで回帰をやり直す
+            - 各回の予測値に残差のばらつきも加え、その分布の5～95パーセンタイルを90%予測区間とする
+            - 観測の年数が少ない・ばらつきが大きいほど、また遠い将来ほど区間は広がる
+            
             ### モデルの特徴と注意点
             
             - ✅ **利点**: 過去のトレンドを基にした客観的な予測が可能
@@ -453,6 +706,8 @@ if st.session_state.lst_images and st.session_state.ndvi_images:
             - **JAXA**: 宇宙航空研究開発機構が提供する衛星データ
             """)
     
+    elif fetch_in_progress:
+        st.info("🛰️ 衛星データを取得中です。最初の年が届くと表示が始まります。")
     else:
         st.error("❌ 画像の取得に失敗しました。別のエリアを選択してください。")
 else:
@@ -464,6 +719,42 @@ else:
     </div>
     """, unsafe_allow_html=True)
 
+if SHOW_DIAGNOSTICS:
+    with st.expander("🩺 診断（処理時間・キャッシュ）"):
+        metrics = get_metrics()
+        snapshot = metrics.snapshot()
+        if snapshot["stages"]:
+            stage_df = pd.DataFrame.from_dict(snapshot["stages"], orient="index").sort_values("total_ms", ascending=False)
+            st.dataframe(stage_df.style.format({"total_ms": "{:.1f}", "mean_ms": "{:.2f}", "max_ms": "{:.1f}"}), use_container_width=True)
+        else:
+            st.caption("まだ計測結果がありません")
+
+        counters = snapshot["counters"]
+        hits, misses = counters.get("cache.hit", 0), counters.get("cache.miss", 0)
+        cols = st.columns(4)
+        cols[0].metric("APIリクエスト", f"{counters.get('jaxa.requests', 0):,}")
+        cols[1].metric("取得データ量", f"{counters.get('jaxa.bytes', 0) / 2**20:.1f} MiB")
+        cols[2].metric("取得ピクセル数", f"{counters.get('jaxa.pixels', 0):,}")
+        cols[3].metric("キャッシュヒット率", f"{hits / (hits + misses) * 100:.0f}%" if hits + misses else "-")
+
+        events = metrics.recent_events(limit=50)
+        if events:
+            events_df = pd.DataFrame(events)
+            events_df["ts"] = pd.to_datetime(events_df["ts"], unit="s")
+            st.dataframe(events_df, use_container_width=True, hide_index=True)
+        memory_usage = get_session_memory().usage()
+        st.markdown(
+            f"**メモリ**: セッション {len(memory_usage['sessions'])}件 / "
+            f"{memory_usage['total_bytes'] / 2**20:.1f} MiB（上限 {memory_usage['max_total_bytes'] / 2**20:.0f} MiB、"
+            f"1セッション {memory_usage['max_session_bytes'] / 2**20:.0f} MiB、破棄 {memory_usage['evictions']}回） / "
+            f"共有ストア {get_shared_store().total_bytes() / 2**20:.1f} MiB / "
+            f"描画済み画像 {len(get_frame_cache())}枚 {get_frame_cache().nbytes / 2**20:.1f} MiB"
+        )
+        if memory_usage["sessions"]:
+            st.dataframe(pd.DataFrame(memory_usage["sessions"]), use_container_width=True, hide_index=True)
+        if st.button("計測結果をリセット"):
+            metrics.reset()
+
 # フッター
 st.markdown("---")
 st.markdown("""
@@ -471,4 +762,11 @@ st.markdown("""
     <p>LeafCast - Future Land Surface Temperature Prediction System</p>
     <p>データ提供: JAXA (宇宙航空研究開発機構) / NASA MODIS</p>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+record_stage("app.run", time.perf_counter() - run_started, fetching=bool(fetch_in_progress))
+
+# 取得中はジョブの状況を定期的に確認して再描画
+if fetch_in_progress:
+    time.sleep(JOB_POLL_INTERVAL)
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+複数エリアの予測をまとめて実行するコマンドラインツール
+
+使い方:
+    python batch_forecast.py regions.csv results.csv
+    python batch_forecast.py regions.json results_parquet/ --format parquet --workers 16
+    python batch_forecast.py regions.csv summer.csv --season 7,8
+    python batch_forecast.py regions.csv results.csv --use-stats
+
+入力ファイルは name, west, south, east, north の列を持つCSV、または同じキーを持つ
+オブジェクトのリストのJSON。エリアはプロセスプールに分散され、終わったものから順に
+出力へ書き込まれる。中断後に同じコマンドを再実行すると、出力済みのエリアは飛ばして再開する。
+--seasonを指定すると毎年4月の代わりに全月を期間指定でまとめて取得し、指定した月の平均で予測する。
+--use-statsを指定すると、forecast_stats.pyで保存・更新した統計量があるエリアは取得せずにそこから予測し、
+無いエリアは取得して統計量を保存する（以降はforecast_stats.py refreshで新しい年に進められる）。
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+START_YEAR = 2002
+NUM_YEARS = 23
+DEFAULT_TARGET_YEAR = 2045
+DEFAULT_RATES = "0.05,0.1,0.2"
+
+_provider = None
+
+
+def load_regions(path):
+    """
+    エリア定義ファイルを読み込む
+
+    Returns:
+        list: {'name', 'bbox'} の辞書のリスト
+    """
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    else:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+
+    regions = []
+    for row in rows:
+        bbox = [float(row["west"]), float(row["south"]), float(row["east"]), float(row["north"])]
+        regions.append({"name": str(row["name"]), "bbox": bbox})
+    return regions
+
+
+def result_columns(target_year, rates):
+    """出力の列名"""
+    columns = [
+        "name", "west", "south", "east", "north", "n_years", "first_year", "last_year",
+        "ndvi_slope", "ndvi_intercept", "lst_slope", "lst_intercept",
+        f"ndvi_{target_year}", f"lst_{target_year}",
+    ]
+    columns += [f"lst_reduction_{rate * 100:g}pct" for rate in rates]
+    return columns
+
+
+def _init_worker(request_workers):
+    global _provider
+    from jaxa_api import JaxaDataProvider
+    _provider = JaxaDataProvider(max_workers=request_workers)
+
+
+def forecast_region(region, start_year, num_years, target_year, rates, season=None, use_stats=False):
+    """
+    1エリア分の取得・回帰・緑化シミュレーションを実行（ワーカープロセス内で呼ばれる）
+
+    Args:
+        season (tuple): 平均する月（省略時は毎年4月の観測を使う）
+        use_stats (bool): 保存済みの統計量があれば取得せずに使い、無ければ取得して保存する
+
+    Returns:
+        dict: 出力する1行分の値（観測年が2年未満の場合はNone）
+    """
+    from forecast_stats import AreaStats, ForecastStatsStore
+    from future_prefiction import fit_forecast, greening_temperature_change
+
+    months = season or (4,)
+    area = None
+    if use_stats:
+        store = ForecastStatsStore()
+        ppu = _provider.resolve_ppu(region["bbox"])
+        area = store.get(region["bbox"], ppu, months, start_year)
+        # 保存済みの統計量は新しい年に進んでいることがある（num_yearsより長い）
+        if area is not None and area.last_year < start_year + num_years - 1:
+            area = None
+
+    if area is not None:
+        years, ndvi_means, lst_means = area.years, area.ndvi_means, area.lst_means
+    else:
+        if season:
+            lst_cube, ndvi_cube = _provider.get_lst_ndvi_monthly_cubes(region["bbox"], start_year, num_years=num_years)
+            lst_cube = lst_cube.seasonal_mean(season)
+            ndvi_cube = ndvi_cube.seasonal_mean(season)
+        else:
+            lst_cube, ndvi_cube = _provider.get_lst_ndvi_cubes(region["bbox"], start_year, num_years=num_years)
+        if use_stats:
+            area = AreaStats.from_cubes(region["bbox"], ppu, months, ndvi_cube, lst_cube)
+            store.put(area)
+        years, ndvi_means, lst_means = lst_cube.years, ndvi_cube.spatial_mean(), lst_cube.spatial_mean()
+
+    valid = np.isfinite(lst_means) & np.isfinite(ndvi_means)
+    if valid.sum() < 2:
+        return None
+
+    years = years[valid]
+    # 統計量があれば系列を回帰し直さずに係数を求める
+    forecast = area.forecast() if area is not None else fit_forecast(years, ndvi_means[valid], lst_means[valid])
+    ndvi_target, lst_target = forecast.predict(target_year)
+    reduction = -greening_temperature_change(ndvi_target, np.asarray(rates, dtype=np.float64))
+
+    values = [
+        region["name"], *region["bbox"], int(valid.sum()), int(years[0]), int(years[-1]),
+        forecast.ndvi_slope, forecast.ndvi_intercept, forecast.lst_slope, forecast.lst_intercept,
+        float(ndvi_target), float(lst_target), *(float(v) for v in reduction),
+    ]
+    return dict(zip(result_columns(target_year, rates), values))
+
+
+def _part_name(name):
+    return re.sub(r"[^\w\-.]", "_", name)
+
+
+class CsvResultWriter:
+    """結果を1行ずつ追記するCSV出力（途中で中断しても書き込み済みの行は残る）"""
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self._repair()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=columns)
+        if is_new:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def _repair(self):
+        """中断で途中までしか書かれなかった最終行を取り除く"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def done_names(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return {row["name"] for row in csv.DictReader(f)}
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """結果をエリアごとのParquetファイルとしてディレクトリに書き出す"""
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        os.makedirs(path, exist_ok=True)
+
+    def done_names(self):
+        import pandas as pd
+        names = set()
+        for fname in os.listdir(self.path):
+            if fname.endswith(".parquet"):
+                names.update(pd.read_parquet(os.path.join(self.path, fname), columns=["name"])["name"])
+        return names
+
+    def write(self, row):
+        import pandas as pd
+        target = os.path.join(self.path, f"{_part_name(row['name'])}.parquet")
+        tmp = f"{target}.tmp"
+        pd.DataFrame([row], columns=self.columns).to_parquet(tmp, index=False)
+        os.replace(tmp, target)
+
+    def close(self):
+        pass
+
+
+def run_batch(regions, writer, workers, request_workers, start_year, num_years, target_year, rates, season=None,
+              use_stats=False):
+    """
+    未処理のエリアをプロセスプールで実行し、終わった順に書き出す
+
+    Returns:
+        tuple: (成功数, 失敗数)
+    """
+    done = writer.done_names()
+    todo = [r for r in regions if r["name"] not in done]
+    print(f"{len(regions)} regions, {len(regions) - len(todo)} already done, {len(todo)} to run", file=sys.stderr)
+
+    succeeded = failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(request_workers,)) as executor:
+        futures = {
+            executor.submit(
+                forecast_region, region, start_year, num_years, target_year, rates, season, use_stats
+            ): region
+            for region in todo
+        }
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                row = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error {region['name']}: {e}", file=sys.stderr)
+                continue
+            if row is None:
+                failed += 1
+                print(f"Error {region['name']}: not enough valid years", file=sys.stderr)
+                continue
+            writer.write(row)
+            succeeded += 1
+            print(f"[{succeeded + failed}/{len(todo)}] {region['name']}", file=sys.stderr)
+    return succeeded, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数エリアのNDVI/LST予測と緑化シミュレーションを一括実行")
+    parser.add_argument("regions", help="エリア定義ファイル（CSVまたはJSON、列: name, west, south, east, north）")
+    parser.add_argument("output", help="出力先（CSVファイル、またはParquetの場合はディレクトリ）")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None,
+                        help="出力形式（省略時は出力先の拡張子から判定）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="プロセス数（既定: CPUコア数）")
+    parser.add_argument("--request-workers", type=int, default=4, help="1プロセスあたりの同時APIリクエスト数")
+    parser.add_argument("--start-year", type=int, default=START_YEAR)
+    parser.add_argument("--num-years", type=int, default=NUM_YEARS)
+    parser.add_argument("--target-year", type=int, default=DEFAULT_TARGET_YEAR, help="予測・緑化シミュレーションの対象年")
+    parser.add_argument("--rates", default=DEFAULT_RATES, help="NDVI向上率のカンマ区切りリスト（0.05 = 5%%）")
+    parser.add_argument("--season", default=None, help="平均する月のカンマ区切りリスト（例: 7,8 で7～8月平均、省略時は4月）")
+    parser.add_argument("--use-stats", action="store_true",
+                        help="保存済みの予測の統計量を使う（無いエリアは取得して保存、保存先はLEAFCAST_FORECAST_STATS_DIR）")
+    args = parser.parse_args(argv)
+
+    rates = [float(r) for r in args.rates.split(",")]
+    season = tuple(int(m) for m in args.season.split(",")) if args.season else None
+    columns = result_columns(args.target_year, rates)
+    output_format = args.format or ("csv" if args.output.endswith(".csv") else "parquet")
+    writer = CsvResultWriter(args.output, columns) if output_format == "csv" else ParquetResultWriter(args.output, columns)
+
+    try:
+        succeeded, failed = run_batch(
+            load_regions(args.regions), writer, args.workers, args.request_workers,
+            args.start_year, args.num_years, args.target_year, rates, season, args.use_stats
+        )
+    finally:
+        writer.close()
+
+    print(f"done: {succeeded} succeeded, {failed} failed", file=sys.stderr)
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
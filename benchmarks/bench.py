@@ -0,0 +1,409 @@
+"""
+取得・描画・集計・予測の各段階の処理時間を測るベンチマーク
+
+使い方:
+    python benchmarks/bench.py run --output benchmarks/results/before.json
+    python benchmarks/bench.py run --sizes small,medium --repeat 5 --compare benchmarks/results/before.json
+    python benchmarks/bench.py record benchmarks/fixtures.npz --sizes small,medium
+    python benchmarks/bench.py coldstart --budget-ms 300
+    python benchmarks/bench.py pan --size medium --pans 3
+
+je.ImageCollectionはスタブ（je_stub.py）に差し替えるため、ネットワークなしで同じ入力を再現できる。
+recordで実際のAPIの応答をフィクスチャとして記録しておくと、runの--fixturesで再生する
+（記録に無い要求は決まった乱数の合成ラスタになる）。結果はJSONで出力する。
+coldstartは新しいインタプリタでアプリのモジュールを読み込む時間を測り、重い依存関係が
+読み込み時に入り込んでいないかを確かめる。
+panは地図を1度ずつ動かしたときのAPI呼び出し数と取得ピクセル数を数え、重なっているタイルが
+キャッシュから使い回されるかを確かめる。
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from je_stub import FixtureStore, fixture_key, stub_jaxa  # noqa: E402
+
+START_YEAR = 2002
+NUM_YEARS = 23
+# app.pyが読み込む自前のモジュール
+APP_MODULES = (
+    "instrumentation", "tile_grid", "raster_cube", "raster_cache", "raster_render", "data_sources",
+    "jaxa_api", "fetch_jobs", "shared_store", "region_index", "future_prefiction", "session_memory",
+    "zones",
+)
+# 読み込み時には入れず、使う段階で初めて読み込む依存関係
+DEFERRED_MODULES = ("matplotlib", "jaxa", "sklearn", "PIL")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BBOXES = {
+    "small": [130, 33, 131, 34],      # 福岡周辺
+    "medium": [129, 31, 132, 34],     # 九州
+    "country": [129, 30, 146, 46],    # 日本の大部分
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_stage(func, repeat, setup=None):
+    """
+    funcをrepeat回実行して処理時間を測る（setupは計測に含めない）
+
+    Returns:
+        list: 各回の秒数
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_size(name, bbox, num_years, repeat, latency, fixtures):
+    """
+    1つの大きさのbboxについて全段階を計測
+
+    Returns:
+        list: 段階ごとの結果の辞書
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    from data_sources import JaxaDataSource
+    from future_prefiction import (
+        _fit_forecast_cached, _forecast_intervals_cached, create_future_prediction_graph, fit_pixel_trends,
+        simulate_greening_effect
+    )
+    from jaxa_api import JaxaDataProvider
+    from raster_cache import RasterDiskCache
+    from raster_render import RasterRenderer
+
+    results = []
+    # ウォームキャッシュの計測が終わったら一時ディレクトリごと消す
+    with tempfile.TemporaryDirectory(prefix="leafcast-bench-") as cache_dir:
+        with stub_jaxa(fixtures, latency=latency) as stub:
+            cold = JaxaDataProvider(source=JaxaDataSource(), cache=False)
+            warm = JaxaDataProvider(source=JaxaDataSource(), cache=RasterDiskCache(cache_dir))
+            ppu = cold.resolve_ppu(bbox)
+
+            def fetch_cold():
+                stub.calls = 0
+                return cold.get_lst_ndvi_cubes(bbox, START_YEAR, num_years)
+
+            stages = [("fetch_cold", fetch_cold, None)]
+            lst_cube, ndvi_cube = fetch_cold()
+            api_calls = stub.calls
+
+            warm.get_lst_ndvi_cubes(bbox, START_YEAR, num_years)
+            stages.append(("fetch_warm_cache", lambda: warm.get_lst_ndvi_cubes(bbox, START_YEAR, num_years), None))
+
+        lst_range = cold.display_range('LST', [lst_cube.data])
+
+        def render_png():
+            cold.renderer = RasterRenderer()
+            for i, year in enumerate(lst_cube.years):
+                for band, cube, value_range in (('LST', lst_cube, lst_range), ('ndvi', ndvi_cube, (0.0, 1.0))):
+                    if cube.time_mask[i]:
+                        image = cold.render_image(cube.data[i], bbox, band, int(year), value_range)
+                        image.save(io.BytesIO(), format="PNG")
+
+        def cube_reductions():
+            lst_means = lst_cube.spatial_mean()
+            ndvi_means = ndvi_cube.spatial_mean()
+            valid = np.isfinite(lst_means) & np.isfinite(ndvi_means)
+            cold.display_range('LST', [lst_cube.data])
+            return lst_cube.years[valid], ndvi_means[valid], lst_means[valid]
+
+        years, ndvi_values, lst_values = cube_reductions()
+
+        def forecast_graph():
+            plt.close(create_future_prediction_graph(years, ndvi_values, lst_values, START_YEAR, predict_years=20))
+
+        def greening_effect():
+            simulate_greening_effect(years, ndvi_values, lst_values, int(years[-1]) + 10, increase_rate=0.1)
+
+        def clear_model_caches():
+            _fit_forecast_cached.cache_clear()
+            _forecast_intervals_cached.cache_clear()
+
+        stages += [
+            ("render_png", render_png, None),
+            ("cube_reductions", cube_reductions, None),
+            ("pixel_trends", lambda: fit_pixel_trends(ndvi_cube, lst_cube), None),
+            ("forecast_graph", forecast_graph, clear_model_caches),
+            ("greening_effect", greening_effect, _fit_forecast_cached.cache_clear),
+        ]
+
+        for stage, func, setup in stages:
+            with stub_jaxa(fixtures, latency=latency):
+                times = time_stage(func, repeat, setup)
+            results.append({
+                "size": name, "bbox": bbox, "ppu": ppu, "pixels": int(np.prod(lst_cube.shape[1:])),
+                "years": num_years, "api_calls": api_calls, "stage": stage, "times": times,
+                "min": min(times), "median": statistics.median(times), "mean": statistics.fmean(times),
+            })
+            print(f"{name:8s} {stage:18s} median {statistics.median(times) * 1000:10.2f} ms", file=sys.stderr)
+        return results
+
+
+def compare(previous, current):
+    """前回の結果と中央値を比べた表を出力"""
+    before = {(r["size"], r["stage"]): r["median"] for r in previous["results"]}
+    print(f"{'size':8s} {'stage':18s} {'before ms':>12s} {'after ms':>12s} {'ratio':>8s}")
+    for r in current["results"]:
+        old = before.get((r["size"], r["stage"]))
+        if old is None:
+            continue
+        print(f"{r['size']:8s} {r['stage']:18s} {old * 1000:12.2f} {r['median'] * 1000:12.2f} {r['median'] / old:8.2f}")
+
+
+def run(args):
+    fixtures = FixtureStore.load(args.fixtures) if args.fixtures else FixtureStore()
+    results = []
+    for name in args.sizes.split(","):
+        results += bench_size(name, BBOXES[name], args.num_years, args.repeat, args.latency, fixtures)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "fixtures": args.fixtures,
+            "fixture_hits": fixtures.hits,
+            "fixture_misses": fixtures.misses,
+        },
+        "results": results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import numpy
+numpy_seconds = time.perf_counter() - start
+for name in {modules!r}:
+    __import__(name)
+total = time.perf_counter() - start
+loaded = sorted({{m for m in {deferred!r} if m in sys.modules}})
+print(json.dumps({{"total": total, "numpy": numpy_seconds, "deferred_loaded": loaded}}))
+"""
+
+
+def measure_cold_start(modules=APP_MODULES, repeat=5):
+    """
+    新しいインタプリタでmodulesを読み込む時間を測る
+
+    Returns:
+        dict: 各回の合計秒数・numpyだけの秒数と、読み込み時に入った遅延対象のモジュール
+    """
+    script = _IMPORT_SCRIPT.format(root=REPO_ROOT, modules=list(modules), deferred=list(DEFERRED_MODULES))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", script], check=True, capture_output=True, text=True, cwd=REPO_ROOT
+        ).stdout
+        runs.append(json.loads(out.splitlines()[-1]))
+
+    # モジュールごとの内訳（累積時間）は-X importtimeの1回分から取る
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script], check=True, capture_output=True, text=True, cwd=REPO_ROOT
+    ).stderr
+    per_module = {}
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() in modules:
+            per_module[parts[2].strip()] = int(parts[1]) / 1e6
+
+    totals = [run["total"] for run in runs]
+    return {
+        "times": totals,
+        "median": statistics.median(totals),
+        "numpy_median": statistics.median(run["numpy"] for run in runs),
+        "modules": per_module,
+        "deferred_loaded": runs[0]["deferred_loaded"],
+    }
+
+
+def coldstart(args):
+    result = measure_cold_start(repeat=args.repeat)
+    for name, seconds in sorted(result["modules"].items(), key=lambda item: -item[1]):
+        print(f"{name:20s} {seconds * 1000:10.2f} ms", file=sys.stderr)
+    own = result["median"] - result["numpy_median"]
+    print(
+        f"total median {result['median'] * 1000:.1f} ms (numpy {result['numpy_median'] * 1000:.1f} ms, "
+        f"app modules {own * 1000:.1f} ms)", file=sys.stderr
+    )
+    json.dump({"meta": {"commit": _git_commit(), "python": platform.python_version()}, "coldstart": result},
+              sys.stdout, indent=2)
+    print()
+
+    failed = False
+    if result["deferred_loaded"]:
+        print(f"heavy modules loaded at import time: {', '.join(result['deferred_loaded'])}", file=sys.stderr)
+        failed = True
+    if args.budget_ms is not None and own * 1000 > args.budget_ms:
+        print(f"import time {own * 1000:.1f} ms exceeds the budget of {args.budget_ms} ms", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+def measure_pan(bbox, pans, num_years, fixtures, step=1.0):
+    """
+    アプリと同じ速報つきの取得で、bboxを東へstep度ずつずらしたときのAPI呼び出し数・取得ピクセル数・
+    キャッシュから読んだタイル数を数える
+
+    Returns:
+        list: 最初の表示と各移動の {'bbox', 'calls', 'pixels', 'cache_hits'}
+    """
+    from data_sources import JaxaDataSource
+    from instrumentation import get_metrics
+    from jaxa_api import JaxaDataProvider
+    from raster_cache import RasterDiskCache
+
+    steps = []
+    with tempfile.TemporaryDirectory(prefix="leafcast-bench-") as cache_dir, stub_jaxa(fixtures) as stub:
+        provider = JaxaDataProvider(source=JaxaDataSource(), cache=RasterDiskCache(cache_dir))
+        for i in range(pans + 1):
+            view = [bbox[0] + i * step, bbox[1], bbox[2] + i * step, bbox[3]]
+            stub.calls = 0
+            get_metrics().reset()
+            for _ in provider.iter_rasters_progressive(view, START_YEAR, num_years):
+                pass
+            counters = get_metrics().snapshot()["counters"]
+            steps.append({
+                "bbox": view, "calls": stub.calls, "pixels": counters.get("jaxa.pixels", 0),
+                "cache_hits": counters.get("cache.hit", 0),
+            })
+            print(f"{view} {stub.calls:6d} calls {steps[-1]['pixels']:10d} pixels "
+                  f"{steps[-1]['cache_hits']:6d} cached tiles", file=sys.stderr)
+    return steps
+
+
+def pan(args):
+    steps = measure_pan(BBOXES[args.size], args.pans, args.num_years, FixtureStore())
+    json.dump({"meta": {"commit": _git_commit(), "python": platform.python_version()}, "pan": steps},
+              sys.stdout, indent=2)
+    print()
+
+    # 移動後も重なっているタイルはキャッシュにあるため、キャッシュを使わずに最初の表示と同じだけ取り直していたら失敗
+    first = steps[0]["pixels"]
+    refetched = [step["bbox"] for step in steps[1:] if step["cache_hits"] == 0 or step["pixels"] >= first]
+    if refetched:
+        print(f"panning refetched the whole view ({first} pixels) for {refetched}", file=sys.stderr)
+        return 1
+    return 0
+
+
+class RecordingSource:
+    """JAXA APIから取得したラスタをフィクスチャとして記録するデータソース"""
+    cacheable = False
+
+    def __init__(self, source, fixtures):
+        self.source = source
+        self.fixtures = fixtures
+
+    def request_raster(self, bbox, coll, band, target_year, ppu):
+        raster = self.source.request_raster(bbox, coll, band, target_year, ppu)
+        if raster is not None:
+            key = fixture_key(coll, band, f"{target_year}-04", ppu, bbox)
+            self.fixtures.arrays[key] = np.asarray(raster, dtype=np.float32)
+        return raster
+
+    def request_range(self, bbox, coll, band, start_month, end_month, ppu):
+        rasters = self.source.request_range(bbox, coll, band, start_month, end_month, ppu)
+        for month, raster in rasters.items():
+            self.fixtures.arrays[fixture_key(coll, band, month, ppu, bbox)] = np.asarray(raster, dtype=np.float32)
+        return rasters
+
+
+def record(args):
+    from data_sources import JaxaDataSource
+    from jaxa_api import JaxaDataProvider
+
+    fixtures = FixtureStore.load(args.fixtures) if os.path.exists(args.fixtures) else FixtureStore()
+    provider = JaxaDataProvider(source=RecordingSource(JaxaDataSource(), fixtures), cache=False)
+    for name in args.sizes.split(","):
+        provider.get_lst_ndvi_cubes(BBOXES[name], START_YEAR, args.num_years)
+        print(f"{name}: {len(fixtures.arrays)} rasters recorded", file=sys.stderr)
+    fixtures.save(args.fixtures)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LeafCastの各処理段階のベンチマーク")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="ベンチマークを実行")
+    run_parser.add_argument("--sizes", default="small,medium,country", help=f"bboxの大きさ（{', '.join(BBOXES)}）")
+    run_parser.add_argument("--num-years", type=int, default=NUM_YEARS)
+    run_parser.add_argument("--repeat", type=int, default=3, help="各段階の実行回数")
+    run_parser.add_argument("--latency", type=float, default=0.0, help="スタブが1枚あたりに待つ秒数")
+    run_parser.add_argument("--fixtures", help="recordで記録したフィクスチャ（省略時は合成ラスタ）")
+    run_parser.add_argument("--output", help="結果のJSONの出力先（省略時は標準出力）")
+    run_parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    run_parser.set_defaults(func=run)
+
+    record_parser = sub.add_parser("record", help="JAXA APIの応答をフィクスチャとして記録")
+    record_parser.add_argument("fixtures", help="記録先の.npz（既存なら追記）")
+    record_parser.add_argument("--sizes", default="small,medium", help=f"bboxの大きさ（{', '.join(BBOXES)}）")
+    record_parser.add_argument("--num-years", type=int, default=NUM_YEARS)
+    record_parser.set_defaults(func=record)
+
+    coldstart_parser = sub.add_parser("coldstart", help="アプリのモジュールの読み込み時間を計測")
+    coldstart_parser.add_argument("--repeat", type=int, default=5, help="計測回数")
+    coldstart_parser.add_argument(
+        "--budget-ms", type=float, help="numpyを除いた読み込み時間の上限（超えたら終了コード1）"
+    )
+    coldstart_parser.set_defaults(func=coldstart)
+
+    pan_parser = sub.add_parser("pan", help="地図を動かしたときのタイルの使い回しを確認")
+    pan_parser.add_argument("--size", default="medium", help=f"最初の表示範囲（{', '.join(BBOXES)}）")
+    pan_parser.add_argument("--pans", type=int, default=3, help="東へ1度ずつ動かす回数")
+    pan_parser.add_argument("--num-years", type=int, default=NUM_YEARS)
+    pan_parser.set_defaults(func=pan)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
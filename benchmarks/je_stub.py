@@ -0,0 +1,169 @@
+"""
+je.ImageCollectionの代わりに記録済みのラスタを返すスタブ
+
+ベンチマークをネットワークなしで再現できるよう、JaxaDataSourceが呼ぶ
+filter_date → filter_resolution → filter_bounds → select → get_images の流れを
+そのまま受け付け、記録済みのフィクスチャ（無ければ決まった乱数で作った合成ラスタ）を返す。
+"""
+import contextlib
+import hashlib
+import re
+import sys
+import time
+import types
+
+import numpy as np
+
+
+def fixture_key(coll, band, month, ppu, bbox):
+    """フィクスチャを引くためのキー"""
+    bbox_str = ",".join(f"{v:.4f}" for v in bbox)
+    return f"{coll}|{band}|{month}|{ppu:g}|{bbox_str}"
+
+
+class FixtureStore:
+    """
+    記録済みラスタの集まり
+
+    キーはfixture_key、値は取得元と同じ単位（LSTはケルビン）のfloat32配列。
+    記録が無い要求には、キーから決まる乱数で作った合成ラスタを返す。
+    """
+    def __init__(self, arrays=None, synthesize=True):
+        self.arrays = dict(arrays or {})
+        self.synthesize = synthesize
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, path, synthesize=True):
+        with np.load(path) as data:
+            return cls({key: data[key] for key in data.files}, synthesize=synthesize)
+
+    def save(self, path):
+        np.savez_compressed(path, **self.arrays)
+
+    def get(self, coll, band, month, ppu, bbox):
+        key = fixture_key(coll, band, month, ppu, bbox)
+        if key in self.arrays:
+            self.hits += 1
+            return self.arrays[key]
+        self.misses += 1
+        if not self.synthesize:
+            return None
+        return self._synthetic(key, band, month, ppu, bbox)
+
+    @staticmethod
+    def _synthetic(key, band, month, ppu, bbox):
+        """実データに近い値域・トレンドを持つ合成ラスタ"""
+        seed = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16)
+        rng = np.random.default_rng(seed)
+        rows = max(int(round((bbox[3] - bbox[1]) * ppu)), 1)
+        cols = max(int(round((bbox[2] - bbox[0]) * ppu)), 1)
+        year = int(month[:4])
+        if band == 'LST':
+            raster = 290 + 0.05 * (year - 2002) + rng.normal(0, 3, (rows, cols))
+        else:
+            raster = 0.55 - 0.002 * (year - 2002) + rng.normal(0, 0.1, (rows, cols))
+        # 海などの欠損ピクセル
+        raster[rng.random((rows, cols)) < 0.1] = np.nan
+        return raster.astype(np.float32)
+
+
+class _Raster:
+    def __init__(self, img):
+        self.img = img
+
+
+class _StacDate:
+    def __init__(self, ids):
+        self.id = ids
+
+
+class StubImageCollection:
+    """je.ImageCollectionと同じ呼び出し方で記録済みのラスタを返すスタブ"""
+    fixtures = FixtureStore()
+    latency = 0.0
+    calls = 0
+
+    def __init__(self, collection, ssl_verify=True):
+        self.collection = collection
+        self._months = []
+        self._ppu = None
+        self._bbox = None
+        self._band = None
+
+    def filter_date(self, dlim):
+        start = re.match(r"(\d{4}-\d{2})", dlim[0]).group(1)
+        end = re.match(r"(\d{4}-\d{2})", dlim[1]).group(1)
+        months = np.arange(np.datetime64(start, 'M'), np.datetime64(end, 'M') + 1)
+        self._months = [str(month) for month in months]
+        return self
+
+    def filter_resolution(self, ppu):
+        self._ppu = ppu
+        return self
+
+    def filter_bounds(self, bbox):
+        self._bbox = list(bbox)
+        return self
+
+    def select(self, band):
+        self._band = band
+        return self
+
+    def get_images(self):
+        cls = type(self)
+        cls.calls += 1
+        if cls.latency:
+            time.sleep(cls.latency * len(self._months))
+
+        arrays = []
+        ids = []
+        for month in self._months:
+            array = cls.fixtures.get(self.collection, self._band, month, self._ppu, self._bbox)
+            if array is not None:
+                arrays.append(array)
+                ids.append(f"{month}/")
+        if not arrays:
+            return None
+        self.raster = _Raster(np.stack(arrays))
+        self.stac_date = _StacDate(ids)
+        return self
+
+
+@contextlib.contextmanager
+def stub_jaxa(fixtures, latency=0.0):
+    """
+    jaxa.earth.je.ImageCollectionをスタブに差し替える（jaxa-earthが無い環境でも使える）
+
+    Args:
+        fixtures (FixtureStore): 返すラスタ
+        latency (float): 1枚あたりに待つ秒数（APIの応答時間の代わり）
+    """
+    StubImageCollection.fixtures = fixtures
+    StubImageCollection.latency = latency
+    StubImageCollection.calls = 0
+
+    try:
+        from jaxa.earth import je
+        saved_modules = None
+    except ImportError:
+        je = types.ModuleType("jaxa.earth.je")
+        package = types.ModuleType("jaxa.earth")
+        package.je = je
+        saved_modules = {name: sys.modules.get(name) for name in ("jaxa", "jaxa.earth", "jaxa.earth.je")}
+        sys.modules.update({"jaxa": types.ModuleType("jaxa"), "jaxa.earth": package, "jaxa.earth.je": je})
+
+    original = getattr(je, "ImageCollection", None)
+    je.ImageCollection = StubImageCollection
+    try:
+        yield StubImageCollection
+    finally:
+        if saved_modules is None:
+            je.ImageCollection = original
+        else:
+            for name, module in saved_modules.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
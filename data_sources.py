@@ -0,0 +1,256 @@
+"""
+ラスタの取得元（データソース）
+
+JaxaDataProviderはデータソースを通してラスタを取得する。JaxaDataSourceはJAXA Earth APIから、
+LocalDataSourceはローカルのディレクトリに保存したタイルファイルから読み出す。
+
+使い方（JAXA APIのデータをローカルに複製）:
+    python data_sources.py /data/leafcast --bbox 128,30,132,35 --start-year 2002 --num-years 23
+"""
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+
+from tile_grid import DEFAULT_TILE_SIZE, crop_to_bbox, mosaic_tiles, tile_layout
+
+
+def month_range(start_month, end_month):
+    """
+    開始月から終了月までの月のリスト
+
+    Args:
+        start_month (str): 開始月（'YYYY-MM'）
+        end_month (str): 終了月（'YYYY-MM'、この月を含む）
+
+    Returns:
+        list: 'YYYY-MM' の文字列のリスト
+    """
+    months = np.arange(np.datetime64(start_month, 'M'), np.datetime64(end_month, 'M') + 1)
+    return [str(month) for month in months]
+
+
+class DataSource:
+    """
+    ラスタの取得元の基底クラス
+
+    request_rasterとrequest_rangeを実装する。cacheableがTrueの取得元は、
+    JaxaDataProviderがディスクキャッシュを前に置く。
+    """
+    cacheable = True
+
+    def request_raster(self, bbox, coll, band, target_year, ppu):
+        """
+        1年分（4月）のラスタを取得
+
+        Returns:
+            numpy.ndarray: ラスタ配列（データが無い場合はNone）
+        """
+        raise NotImplementedError
+
+    def request_range(self, bbox, coll, band, start_month, end_month, ppu):
+        """
+        期間内の全ての月次ラスタを取得
+
+        Returns:
+            dict: {'YYYY-MM': ラスタ配列}（データが無い月は含まない）
+        """
+        raise NotImplementedError
+
+
+class JaxaDataSource(DataSource):
+    """JAXA Earth APIから取得するデータソース"""
+    def _query(self, bbox, coll, band, dlim, ppu):
+        from jaxa.earth import je
+
+        return je.ImageCollection(
+            collection=coll,
+            ssl_verify=True
+        ).filter_date(
+            dlim=dlim
+        ).filter_resolution(
+            ppu=ppu
+        ).filter_bounds(
+            bbox=bbox
+        ).select(
+            band=band
+        ).get_images()
+
+    def request_raster(self, bbox, coll, band, target_year, ppu):
+        data = self._query(
+            bbox, coll, band, [f"{target_year}-04-01T00:00:00", f"{target_year}-04-01T00:00:00"], ppu
+        )
+        if data:
+            return data.raster.img[0]
+        return None
+
+    def request_range(self, bbox, coll, band, start_month, end_month, ppu):
+        data = self._query(bbox, coll, band, [f"{start_month}-01T00:00:00", f"{end_month}-01T00:00:00"], ppu)
+        if not data:
+            return {}
+        rasters = {}
+        for date_id, raster_data in zip(data.stac_date.id, data.raster.img):
+            match = re.search(r"(\d{4})-(\d{2})", str(date_id))
+            if match:
+                rasters[f"{match.group(1)}-{match.group(2)}"] = raster_data
+        return rasters
+
+
+class LocalDataSource(DataSource):
+    """
+    ローカルのディレクトリに保存したタイルファイルから読み出すデータソース
+
+    ラスタは経緯度に揃った固定グリッドのタイルごとにfloat32の.npyとして保存し、
+    読み出し時はメモリマップで開く。配置は次のとおり:
+
+        root/<コレクション>/<バンド>/ppu<解像度>/<年>/<月>/<西端>_<南端>.npy
+
+    値は取得元と同じ単位（LSTはケルビン）で保存する。
+    """
+    cacheable = False
+
+    def __init__(self, root, tile_size=DEFAULT_TILE_SIZE):
+        """
+        Args:
+            root (str): 保存先ディレクトリ
+            tile_size (float): タイルの一辺（度）
+        """
+        self.root = root
+        self.tile_size = tile_size
+
+    def tile_path(self, coll, band, ppu, month, tile):
+        """タイルファイルのパス"""
+        year, mon = month.split("-")
+        name = f"{tile[0]:g}_{tile[1]:g}.npy"
+        return os.path.join(self.root, coll, band, f"ppu{ppu:g}", year, mon, name)
+
+    def _read_tile(self, coll, band, ppu, month, tile):
+        try:
+            return np.load(self.tile_path(coll, band, ppu, month, tile), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+    def read(self, bbox, coll, band, month, ppu):
+        """
+        1か月分のラスタをタイルから組み立てる
+
+        bboxがタイル1枚と一致する場合はメモリマップ配列をそのまま返す。
+
+        Returns:
+            numpy.ndarray: ラスタ配列（該当するタイルが1枚も無い場合はNone）
+        """
+        tiles, n_rows, n_cols, grid_bbox = tile_layout(bbox, self.tile_size)
+        arrays = [self._read_tile(coll, band, ppu, month, tile) for tile in tiles]
+        if len(tiles) == 1 and np.allclose(grid_bbox, bbox):
+            return arrays[0]
+        mosaic = mosaic_tiles(arrays, n_rows, n_cols, int(round(self.tile_size * ppu)))
+        return None if mosaic is None else crop_to_bbox(mosaic, grid_bbox, bbox, ppu)
+
+    def request_raster(self, bbox, coll, band, target_year, ppu):
+        return self.read(bbox, coll, band, f"{target_year}-04", ppu)
+
+    def request_range(self, bbox, coll, band, start_month, end_month, ppu):
+        rasters = {}
+        for month in month_range(start_month, end_month):
+            raster_data = self.read(bbox, coll, band, month, ppu)
+            if raster_data is not None:
+                rasters[month] = raster_data
+        return rasters
+
+    def write(self, bbox, coll, band, month, ppu, raster):
+        """
+        1か月分のラスタをタイルに分けて保存
+
+        Args:
+            bbox (list): ラスタの範囲（タイル境界に揃っていること）
+            raster (numpy.ndarray): 取得元と同じ単位のラスタ
+
+        Returns:
+            int: 保存したタイルの数（全てNaNのタイルは保存しない）
+        """
+        tiles, n_rows, n_cols, grid_bbox = tile_layout(bbox, self.tile_size)
+        if not np.allclose(grid_bbox, bbox):
+            raise ValueError(f"bbox {bbox} is not aligned to the {self.tile_size} degree tile grid")
+
+        tile_pixels = int(round(self.tile_size * ppu))
+        raster = np.asarray(raster, dtype=np.float32)
+        written = 0
+        for i, tile in enumerate(tiles):
+            row, col = divmod(i, n_cols)
+            array = raster[row * tile_pixels:(row + 1) * tile_pixels, col * tile_pixels:(col + 1) * tile_pixels]
+            if array.size == 0 or not np.isfinite(array).any():
+                continue
+            path = self.tile_path(coll, band, ppu, month, tile)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp, path)
+            written += 1
+        return written
+
+    def write_cube(self, cube, coll, band, ppu, offset=0.0):
+        """
+        RasterCubeの全時刻をタイルに分けて保存
+
+        Args:
+            cube (RasterCube): 保存するキューブ（bboxがタイル境界に揃っていること）
+            offset (float): 保存前に足す値（摂氏のLSTキューブは273.15でケルビンに戻す）
+
+        Returns:
+            int: 保存したタイルの数
+        """
+        written = 0
+        for i, month in enumerate(cube.times):
+            if cube.time_mask[i]:
+                written += self.write(cube.bbox, coll, band, str(month), ppu, cube.data[i] + offset)
+        return written
+
+
+def default_data_source():
+    """環境変数LEAFCAST_LOCAL_DATAがあればそのディレクトリを、無ければJAXA APIを使う"""
+    root = os.environ.get("LEAFCAST_LOCAL_DATA")
+    if root:
+        return LocalDataSource(root)
+    return JaxaDataSource()
+
+
+def main(argv=None):
+    from jaxa_api import COLLECTION_BANDS, DEFAULT_PPU, JaxaDataProvider
+
+    parser = argparse.ArgumentParser(description="JAXA APIのラスタをローカルのタイルファイルに複製")
+    parser.add_argument("root", help="保存先ディレクトリ")
+    parser.add_argument("--bbox", action="append", required=True, help="複製する範囲 west,south,east,north（複数指定可）")
+    parser.add_argument("--start-year", type=int, default=2002)
+    parser.add_argument("--num-years", type=int, default=23)
+    parser.add_argument("--ppu", type=int, action="append", help="複製する解像度（複数指定可、既定: 20）")
+    parser.add_argument("--monthly", action="store_true", help="4月だけでなく全ての月を複製する")
+    parser.add_argument("--workers", type=int, default=8, help="同時APIリクエスト数")
+    args = parser.parse_args(argv)
+
+    local = LocalDataSource(args.root)
+    provider = JaxaDataProvider(max_workers=args.workers, source=JaxaDataSource())
+    written = 0
+    for bbox in args.bbox:
+        _, _, _, grid_bbox = tile_layout([float(v) for v in bbox.split(",")], local.tile_size)
+        for ppu in args.ppu or [DEFAULT_PPU]:
+            for coll, band in COLLECTION_BANDS.items():
+                if args.monthly:
+                    cube = provider.get_monthly_cube(
+                        grid_bbox, coll, f"{args.start_year}-01", f"{args.start_year + args.num_years - 1}-12", ppu=ppu
+                    )
+                    written += local.write_cube(cube, coll, band, ppu)
+                    continue
+                years = range(args.start_year, args.start_year + args.num_years)
+                rasters = provider.fetch_rasters([(grid_bbox, coll, band, year) for year in years], ppu=ppu)
+                for year, raster in zip(years, rasters):
+                    if raster is not None:
+                        written += local.write(grid_bbox, coll, band, f"{year}-04", ppu, raster)
+    print(f"wrote {written} tiles to {args.root}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
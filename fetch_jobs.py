@@ -0,0 +1,205 @@
+import threading
+
+from jaxa_api import LST_COLLECTION, NDVI_COLLECTION
+from raster_cube import RasterCube
+
+DEFAULT_DEBOUNCE = 0.8
+
+
+class FetchJob:
+    """
+    1つのbboxのLST・NDVIを取得するバックグラウンドジョブ
+
+    取得済みのラスタは届いた順に保持され、実行中でもcubes()で途中経過を参照できる。
+    キューブは読み取り専用で、複数のセッションから同じものを参照してよい。
+    progressiveの場合は低解像度の速報を先に取得し、本来の解像度の全年分が揃った時点で差し替える。
+    """
+    WAITING = 'waiting'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+
+    def __init__(self, key, bbox, start_year, num_years, progressive=False):
+        self.key = key
+        self.bbox = bbox
+        self.start_year = start_year
+        self.num_years = num_years
+        self.progressive = progressive
+        self.collections = (LST_COLLECTION, NDVI_COLLECTION)
+        self.status = self.WAITING
+        self.error = None
+        self.done_count = 0
+        self.total = len(self.collections) * num_years
+        self.target_ppu = None
+        # 解像度ごとの {コレクション: 年ごとのラスタ} と取得済み数（粗い順）
+        self._levels = {}
+        self._level_counts = {}
+        self._cubes = None
+        self._cubes_state = None
+        self._cubes_ppu = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.CANCELLED, self.FAILED)
+
+    @property
+    def cancel_requested(self):
+        """取り消しが要求されたかどうか（実行中のジョブはまもなくCANCELLEDになる）"""
+        return self._cancel.is_set()
+
+    @property
+    def nbytes(self):
+        """作成済みキューブの合計バイト数"""
+        if self._cubes is None:
+            return 0
+        return sum(cube.nbytes for cube in self._cubes)
+
+    @property
+    def progress(self):
+        """進捗（0～1）"""
+        return self.done_count / self.total if self.total else 1.0
+
+    @property
+    def ppu(self):
+        """cubes()が返すキューブの解像度（まだ何も届いていなければNone）"""
+        return self._cubes_ppu
+
+    @property
+    def is_preview(self):
+        """cubes()が低解像度の速報を返しているかどうか"""
+        return self._cubes_ppu is not None and self._cubes_ppu != self.target_ppu
+
+    def cancel(self):
+        """ジョブを取り消す（待機中なら取得を始めず、実行中なら残りのリクエストを取り消す）"""
+        self._cancel.set()
+
+    def run(self, provider, debounce=DEFAULT_DEBOUNCE):
+        """
+        debounce秒待ってから取得を実行（待機中に取り消されたら何もしない）
+
+        Args:
+            provider (JaxaDataProvider): データ取得クラス
+            debounce (float): 取得を始めるまでの待ち時間（秒）
+        """
+        if self._cancel.wait(debounce):
+            self.status = self.CANCELLED
+            return
+
+        # 解像度の決定などで失敗してもFAILEDで終わるよう、準備からまとめて例外を捕まえる
+        rasters = None
+        try:
+            self.target_ppu = provider.resolve_ppu(self.bbox)
+            if self.progressive and provider.preview_ppu(self.bbox) is not None:
+                self.total *= 2
+                rasters = levels = provider.iter_rasters_progressive(
+                    self.bbox, self.start_year, self.num_years, collections=self.collections, cancel_event=self._cancel
+                )
+            else:
+                rasters = provider.iter_rasters(
+                    self.bbox, self.start_year, self.num_years, collections=self.collections,
+                    cancel_event=self._cancel, ppu=self.target_ppu
+                )
+                levels = ((self.target_ppu, year, coll, raster) for year, coll, raster in rasters)
+
+            self.status = self.RUNNING
+            for ppu, year, coll, raster in levels:
+                if raster is not None and coll == LST_COLLECTION:
+                    raster = raster - 273.15
+                with self._lock:
+                    if ppu not in self._levels:
+                        self._levels[ppu] = {c: [None] * self.num_years for c in self.collections}
+                        self._level_counts[ppu] = 0
+                    self._levels[ppu][coll][year - self.start_year] = raster
+                    self._level_counts[ppu] += 1
+                    self.done_count += 1
+            if self._cancel.is_set():
+                self.status = self.CANCELLED
+            else:
+                # 完了後はキューブだけを残して年ごとのラスタを手放す
+                self.cubes()
+                with self._lock:
+                    self._levels = {}
+                self.status = self.DONE
+        except Exception as e:
+            self.error = e
+            self.status = self.FAILED
+        finally:
+            # プロバイダのジェネレータ自体を閉じて、まだ始まっていないリクエストをすぐに取り消す
+            # （包んだジェネレータ式を閉じても中のジェネレータはガベージコレクションまで閉じられない）
+            if rasters is not None:
+                rasters.close()
+
+    def cubes(self):
+        """
+        取得済みのデータから作ったキューブ
+
+        届いた数が最も多い解像度を使い、同数なら細かい方を使う。
+
+        Returns:
+            tuple: (LST摂氏のRasterCube, NDVIのRasterCube)
+        """
+        with self._lock:
+            if not self._levels:
+                if self._cubes is None:
+                    self._cubes = (
+                        RasterCube.from_yearly_arrays([None] * self.num_years, self.start_year, self.bbox).read_only(),
+                        RasterCube.from_yearly_arrays([None] * self.num_years, self.start_year, self.bbox).read_only(),
+                    )
+                return self._cubes
+
+            ppu = max(self._levels, key=lambda level: (self._level_counts[level], level))
+            state = (ppu, self._level_counts[ppu])
+            if self._cubes_state != state:
+                rasters = self._levels[ppu]
+                self._cubes = (
+                    RasterCube.from_yearly_arrays(rasters[LST_COLLECTION], self.start_year, self.bbox).read_only(),
+                    RasterCube.from_yearly_arrays(rasters[NDVI_COLLECTION], self.start_year, self.bbox).read_only(),
+                )
+                self._cubes_state = state
+                self._cubes_ppu = ppu
+            return self._cubes
+
+
+class FetchJobManager:
+    """
+    セッションごとの取得ジョブを管理するクラス
+
+    ジョブ自体はSharedResultStoreが持ち、同じ範囲を見ている他のセッションと共有される。
+    新しいbboxのジョブに切り替えると、それより前のジョブの参照をやめる（誰も参照していなければ取り消される）。
+    ジョブはdebounce秒待ってから始まるため、地図を続けて動かした場合は最後の範囲だけが取得される。
+    """
+    def __init__(self, store):
+        """
+        Args:
+            store (SharedResultStore): プロセス全体で共有するジョブのストア
+        """
+        self.store = store
+        self.current = None
+        self._lock = threading.Lock()
+
+    def submit(self, key, bbox, start_year, num_years):
+        """
+        bboxの取得ジョブに切り替える（同じ条件のジョブが既にあればそれを共有する）
+
+        Returns:
+            FetchJob: 参照するジョブ
+        """
+        with self._lock:
+            previous = self.current
+            if previous is not None and previous.key == key and not previous.cancel_requested:
+                return previous
+
+            self.current = self.store.acquire(self, key, bbox, start_year, num_years)
+            if previous is not None and previous is not self.current:
+                self.store.release(self, previous)
+            return self.current
+
+    def cancel(self):
+        """現在のジョブの参照をやめる"""
+        with self._lock:
+            if self.current is not None:
+                self.store.release(self, self.current)
+                self.current = None
@@ -0,0 +1,272 @@
+"""
+エリアごとの予測の十分統計量のキャッシュと、新しい年への更新
+
+使い方（cronなどで定期実行）:
+    python forecast_stats.py refresh
+    python forecast_stats.py refresh --until-year 2025
+    python forecast_stats.py list
+
+エリアごとに、年ごとの領域平均の系列と、エリア平均・ピクセルごとの回帰の十分統計量
+（観測数・和・平方和・積和）を1つの.npzに保存する。新しい年の観測が公開されたら、
+その年のラスタだけを取得して統計量に足し込むため、過去の年のラスタの再取得や回帰のやり直しは要らない。
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+from future_prefiction import ForecastStats
+from raster_cube import _fit_shape
+
+DEFAULT_STATS_DIR = os.path.join(os.path.expanduser("~"), ".cache", "leafcast", "forecast_stats")
+
+
+def _area_mean(raster):
+    """ラスタの領域平均（全ピクセルNaNならNaN）"""
+    if raster is None:
+        return np.nan
+    raster = np.asarray(raster, dtype=np.float64)
+    valid = np.isfinite(raster)
+    return float(raster[valid].mean()) if valid.any() else np.nan
+
+
+class AreaStats:
+    """
+    1エリア分の年ごとの領域平均の系列と、回帰の十分統計量
+
+    エリアはbbox・解像度・平均する月・開始年の組で区別する。
+    """
+    def __init__(self, bbox, ppu, months, start_year, years, ndvi_means, lst_means, area, pixels):
+        """
+        Args:
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+            ppu (int): 取得解像度
+            months (tuple): 平均する月（毎年4月なら (4,)）
+            start_year (int): 最初の年
+            years (numpy.ndarray): 系列の年
+            ndvi_means (numpy.ndarray): 年ごとのNDVIの領域平均（欠損はNaN）
+            lst_means (numpy.ndarray): 年ごとのLST（摂氏）の領域平均（欠損はNaN）
+            area (ForecastStats): エリア平均の統計量
+            pixels (ForecastStats): ピクセルごとの統計量
+        """
+        self.bbox = [float(v) for v in bbox]
+        self.ppu = int(ppu)
+        self.months = tuple(int(m) for m in months)
+        self.start_year = int(start_year)
+        self.years = np.asarray(years, dtype=np.int64)
+        self.ndvi_means = np.asarray(ndvi_means, dtype=np.float64)
+        self.lst_means = np.asarray(lst_means, dtype=np.float64)
+        self.area = area
+        self.pixels = pixels
+
+    @classmethod
+    def from_cubes(cls, bbox, ppu, months, ndvi_cube, lst_cube):
+        """
+        年ごとのキューブ（LSTは摂氏）から作成
+
+        Args:
+            ndvi_cube (RasterCube): 年ごとのNDVIのキューブ（4月、またはseasonal_meanの結果）
+            lst_cube (RasterCube): ndvi_cubeと同じ時刻・格子のLSTのキューブ
+        """
+        ndvi_means = ndvi_cube.spatial_mean()
+        lst_means = lst_cube.spatial_mean()
+        valid = np.isfinite(ndvi_means) & np.isfinite(lst_means)
+        years = ndvi_cube.years
+        area = ForecastStats.from_series(years[valid], ndvi_means[valid], lst_means[valid])
+        area.last_year = int(years[-1])
+        pixels = ForecastStats.from_cubes(ndvi_cube, lst_cube)
+        pixels.last_year = int(years[-1])
+        return cls(bbox, ppu, months, int(years[0]), years, ndvi_means, lst_means, area, pixels)
+
+    @property
+    def last_year(self):
+        """反映済みの最後の年"""
+        return int(self.years[-1]) if len(self.years) else self.start_year - 1
+
+    @property
+    def key(self):
+        return area_key(self.bbox, self.ppu, self.months, self.start_year)
+
+    def add_year(self, year, ndvi_raster, lst_raster):
+        """
+        1年分のラスタを系列と統計量に足し込む（過去の年のラスタは使わない）
+
+        Args:
+            year (int): 観測年（last_yearの次の年）
+            ndvi_raster (numpy.ndarray): NDVIのラスタ（データが無ければNone）
+            lst_raster (numpy.ndarray): LST（摂氏）のラスタ（データが無ければNone）
+        """
+        if year <= self.last_year:
+            raise ValueError(f"year {year} is already included (last year {self.last_year})")
+
+        ndvi_mean = _area_mean(ndvi_raster)
+        lst_mean = _area_mean(lst_raster)
+        self.years = np.append(self.years, year)
+        self.ndvi_means = np.append(self.ndvi_means, ndvi_mean)
+        self.lst_means = np.append(self.lst_means, lst_mean)
+
+        if np.isfinite(ndvi_mean) and np.isfinite(lst_mean):
+            self.area.add_year(year, ndvi_mean, lst_mean)
+        self.area.last_year = year
+        if ndvi_raster is not None and lst_raster is not None:
+            shape = self.pixels.ndvi_stats.shape
+            self.pixels.add_year(
+                year,
+                _fit_shape(np.asarray(ndvi_raster, dtype=np.float32), shape),
+                _fit_shape(np.asarray(lst_raster, dtype=np.float32), shape),
+            )
+        self.pixels.last_year = year
+
+    def forecast(self):
+        """エリア平均の予測モデル（ChainedForecast）"""
+        return self.area.forecast()
+
+    def pixel_trends(self):
+        """ピクセルごとの回帰係数マップ（PixelTrends）"""
+        return self.pixels.pixel_trends(self.bbox)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp, bbox=np.array(self.bbox), ppu=self.ppu, months=np.array(self.months), start_year=self.start_year,
+            years=self.years, ndvi_means=self.ndvi_means, lst_means=self.lst_means,
+            **self.area.state("area"), **self.pixels.state("pixels"),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            state = {key: data[key] for key in data.files}
+        return cls(
+            state["bbox"].tolist(), int(state["ppu"]), state["months"].tolist(), int(state["start_year"]),
+            state["years"], state["ndvi_means"], state["lst_means"],
+            ForecastStats.from_state(state, "area"), ForecastStats.from_state(state, "pixels"),
+        )
+
+
+def area_key(bbox, ppu, months, start_year):
+    """エリアを区別する文字列"""
+    bbox_str = ",".join(f"{v:.4f}" for v in bbox)
+    months_str = "-".join(f"{m:02d}" for m in months)
+    return f"{bbox_str}|ppu{ppu:g}|{months_str}|{start_year}"
+
+
+class ForecastStatsStore:
+    """
+    エリアごとのAreaStatsを保存するディレクトリ
+
+    保存先は環境変数LEAFCAST_FORECAST_STATS_DIR（既定: ~/.cache/leafcast/forecast_stats）。
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get("LEAFCAST_FORECAST_STATS_DIR", DEFAULT_STATS_DIR)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest()[:20] + ".npz")
+
+    def get(self, bbox, ppu, months, start_year):
+        """保存済みのエリアの統計量（無ければNone）"""
+        path = self.path(area_key(bbox, ppu, months, start_year))
+        if not os.path.exists(path):
+            return None
+        try:
+            return AreaStats.load(path)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, area):
+        area.save(self.path(area.key))
+
+    def __iter__(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(".npz") and not name.endswith(".tmp.npz"):
+                try:
+                    yield AreaStats.load(os.path.join(self.directory, name))
+                except (OSError, KeyError, ValueError):
+                    continue
+
+
+def latest_final_year(months, today=None):
+    """指定した月の観測が全て確定している最後の年（その年の最後の月が先月以前）"""
+    today = today or datetime.date.today()
+    return today.year if today.month > max(months) else today.year - 1
+
+
+def fetch_year(provider, bbox, ppu, months, year):
+    """
+    1年分の指定した月の平均ラスタを取得
+
+    Returns:
+        tuple: (NDVIのラスタ, LST摂氏のラスタ)（データが無い場合はNone）
+    """
+    from jaxa_api import LST_COLLECTION, NDVI_COLLECTION
+
+    rasters = []
+    for coll in (NDVI_COLLECTION, LST_COLLECTION):
+        cube = provider.get_monthly_cube(
+            bbox, coll, f"{year}-{min(months):02d}", f"{year}-{max(months):02d}", ppu=ppu
+        ).seasonal_mean(months)
+        rasters.append(cube.frame(0))
+    ndvi, lst = rasters
+    return ndvi, None if lst is None else lst - 273.15
+
+
+def refresh_area(provider, store, area, until_year):
+    """
+    エリアの統計量をuntil_yearまで1年ずつ進めて保存
+
+    まだ公開されていない年（NDVI・LSTのどちらも無い年）に当たったらそこで止め、次回に持ち越す。
+
+    Returns:
+        int: 追加した年数
+    """
+    added = 0
+    for year in range(area.last_year + 1, until_year + 1):
+        ndvi, lst = fetch_year(provider, area.bbox, area.ppu, area.months, year)
+        if ndvi is None and lst is None:
+            break
+        area.add_year(year, ndvi, lst)
+        added += 1
+    if added:
+        store.put(area)
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存済みエリアの予測の統計量を新しい年に進める")
+    parser.add_argument("--dir", help="保存先ディレクトリ（既定: LEAFCAST_FORECAST_STATS_DIR）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = sub.add_parser("refresh", help="全エリアに新しい年の観測を足し込む")
+    refresh_parser.add_argument("--until-year", type=int, help="ここまで進める（既定: 観測が確定している最後の年）")
+    refresh_parser.add_argument("--workers", type=int, default=8, help="同時APIリクエスト数")
+    sub.add_parser("list", help="保存済みのエリアを表示")
+    args = parser.parse_args(argv)
+
+    store = ForecastStatsStore(args.dir)
+    if args.command == "list":
+        for area in store:
+            print(f"{area.key}\tlast_year={area.last_year}")
+        return 0
+
+    from jaxa_api import JaxaDataProvider
+
+    provider = JaxaDataProvider(max_workers=args.workers)
+    areas = added = 0
+    for area in store:
+        until_year = args.until_year or latest_final_year(area.months)
+        n = refresh_area(provider, store, area, until_year)
+        areas += 1
+        added += n
+        print(f"{area.key}: +{n} years (last {area.last_year})", file=sys.stderr)
+    print(f"refreshed {areas} areas, added {added} area-years", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,169 @@
+import functools
+
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
 
-def create_future_prediction_graph(years, ndvi_values, lst_values, start_year=2002, predict_years=20):
+from instrumentation import log_event, timed
+
+# 緑化による温度感度の公式: 温度感度(℃/NDVI) = GREENING_SENSITIVITY_SLOPE × NDVI + GREENING_SENSITIVITY_INTERCEPT
+GREENING_SENSITIVITY_SLOPE = -32.3515
+GREENING_SENSITIVITY_INTERCEPT = 46.1069
+# 予測区間のブートストラップ標本数と信頼水準
+DEFAULT_BOOTSTRAP_SAMPLES = 2000
+DEFAULT_INTERVAL_LEVEL = 0.9
+
+
+class ChainedForecast:
+    """
+    NDVI～年 と LST～NDVI の2段階の線形回帰による予測モデル
+
+    NDVI(年) = ndvi_slope × 年 + ndvi_intercept
+    LST(NDVI) = lst_slope × NDVI + lst_intercept
+    """
+    def __init__(self, ndvi_slope, ndvi_intercept, lst_slope, lst_intercept):
+        self.ndvi_slope = ndvi_slope
+        self.ndvi_intercept = ndvi_intercept
+        self.lst_slope = lst_slope
+        self.lst_intercept = lst_intercept
+
+    @property
+    def params(self):
+        """当てはめた回帰係数"""
+        return {
+            'ndvi_slope': self.ndvi_slope,
+            'ndvi_intercept': self.ndvi_intercept,
+            'lst_slope': self.lst_slope,
+            'lst_intercept': self.lst_intercept,
+        }
+
+    def predict_ndvi(self, years):
+        """任意の年（スカラーまたは配列）のNDVIを一括予測"""
+        return self.ndvi_slope * np.asarray(years, dtype=np.float64) + self.ndvi_intercept
+
+    def predict_lst(self, ndvi):
+        """任意のNDVI（スカラーまたは配列）に対するLSTを一括予測"""
+        return self.lst_slope * np.asarray(ndvi, dtype=np.float64) + self.lst_intercept
+
+    def predict(self, years):
+        """
+        任意の年のNDVIとLSTを一括予測
+
+        Args:
+            years (array-like): 予測する年（スカラーまたは配列）
+
+        Returns:
+            tuple: (NDVI予測値, LST予測値)
+        """
+        ndvi = self.predict_ndvi(years)
+        return ndvi, self.predict_lst(ndvi)
+
+
+@functools.lru_cache(maxsize=128)
+@timed("model.fit")
+def _fit_forecast_cached(years, ndvi_values, lst_values):
+    years = np.array(years)
+    ndvi = np.array(ndvi_values)
+    lst = np.array(lst_values)
+
+    ndvi_slope, ndvi_intercept, _ = batched_linregress(years[:, None], ndvi[:, None])
+    lst_slope, lst_intercept, _ = batched_linregress(ndvi[:, None], lst[:, None])
+    return ChainedForecast(float(ndvi_slope[0]), float(ndvi_intercept[0]),
+                           float(lst_slope[0]), float(lst_intercept[0]))
+
+
+def fit_forecast(years, ndvi_values, lst_values):
+    """
+    観測系列から予測モデルを当てはめる
+
+    同じ系列に対する結果はキャッシュされるため、Streamlitの再実行や
+    グラフ・テーブル・シミュレーションから何度呼んでも回帰は1度しか計算されない。
+
+    Args:
+        years (array-like): 観測年
+        ndvi_values (array-like): NDVIの実測値
+        lst_values (array-like): LSTの実測値
+
+    Returns:
+        ChainedForecast: 当てはめた予測モデル
+    """
+    return _fit_forecast_cached(
+        tuple(np.asarray(years, dtype=np.float64).ravel().tolist()),
+        tuple(np.asarray(ndvi_values, dtype=np.float64).ravel().tolist()),
+        tuple(np.asarray(lst_values, dtype=np.float64).ravel().tolist()),
+    )
+
+
+@functools.lru_cache(maxsize=128)
+@timed("model.bootstrap")
+def _forecast_intervals_cached(years, ndvi_values, lst_values, target_years, n_samples, level, seed):
+    years = np.array(years)
+    ndvi = np.array(ndvi_values)
+    lst = np.array(lst_values)
+    target_years = np.array(target_years)
+    n = len(years)
+    if n < 3:
+        nan = np.full(len(target_years), np.nan)
+        return nan, nan, nan, nan
+
+    forecast = _fit_forecast_cached(tuple(years.tolist()), tuple(ndvi.tolist()), tuple(lst.tolist()))
+    ndvi_fit = forecast.predict_ndvi(years)
+    lst_fit = forecast.predict_lst(ndvi)
+    # 残差は自由度で補正して膨らませる（当てはめた直線に引き寄せられている分）
+    inflate = np.sqrt(n / (n - 2))
+    ndvi_resid = (ndvi - ndvi_fit) * inflate
+    lst_resid = (lst - lst_fit) * inflate
+
+    # 全標本の残差の再標本化を (観測数, 標本数) の添字でまとめて作り、列ごとの回帰を一括で解く
+    # （同じ年のNDVI・LSTの残差は組のまま引いて、2つの残差の相関を保つ）
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, size=(n, n_samples))
+    ndvi_star = ndvi_fit[:, None] + ndvi_resid[idx]
+    lst_star = lst_fit[:, None] + lst_resid[idx]
+    ndvi_slope, ndvi_intercept, _ = batched_linregress(years[:, None], ndvi_star)
+    lst_slope, lst_intercept, _ = batched_linregress(ndvi[:, None], lst_star)
+
+    # 予測値にも観測のばらつき（残差）を加えて予測区間にする
+    noise = rng.integers(0, n, size=(len(target_years), n_samples))
+    ndvi_pred = ndvi_slope * target_years[:, None] + ndvi_intercept + ndvi_resid[noise]
+    lst_pred = lst_slope * ndvi_pred + lst_intercept + lst_resid[noise]
+
+    quantiles = [(1 - level) / 2, (1 + level) / 2]
+    ndvi_low, ndvi_high = np.nanquantile(ndvi_pred, quantiles, axis=1)
+    lst_low, lst_high = np.nanquantile(lst_pred, quantiles, axis=1)
+    return ndvi_low, ndvi_high, lst_low, lst_high
+
+
+def forecast_intervals(years, ndvi_values, lst_values, target_years,
+                       n_samples=DEFAULT_BOOTSTRAP_SAMPLES, level=DEFAULT_INTERVAL_LEVEL, seed=0):
+    """
+    NDVI～年 と LST～NDVI の2段階の回帰の残差ブートストラップによる予測区間
+
+    全ての標本の回帰をbatched_linregressで1回にまとめて解くため、2000標本でも数ミリ秒で終わる。
+    乱数の種を固定しているので同じ系列には毎回同じ区間を返し、結果はキャッシュされる。
+
+    Args:
+        years (array-like): 観測年
+        ndvi_values (array-like): NDVIの実測値
+        lst_values (array-like): LSTの実測値
+        target_years (array-like): 予測する年
+        n_samples (int): ブートストラップ標本数
+        level (float): 信頼水準（0.9 = 90%区間）
+        seed (int): 乱数の種
+
+    Returns:
+        tuple: (NDVI下限, NDVI上限, LST下限, LST上限) の (予測年,) 配列（観測が3年未満ならNaN）
+    """
+    def as_tuple(values):
+        return tuple(np.asarray(values, dtype=np.float64).ravel().tolist())
+
+    return _forecast_intervals_cached(
+        as_tuple(years), as_tuple(ndvi_values), as_tuple(lst_values), as_tuple(target_years),
+        int(n_samples), float(level), int(seed),
+    )
+
+
+@timed("render.forecast_graph")
+def create_future_prediction_graph(years, ndvi_values, lst_values, start_year=2002, predict_years=20,
+                                   interval_level=DEFAULT_INTERVAL_LEVEL):
     """
     LSTとNDVIの実測値から未来予測グラフを作成
     
@@ -12,6 +173,7 @@ def create_future_prediction_graph(years, ndvi_values, lst_values, start_year=20
         lst_values (list): LSTの実測値リスト
         start_year (int): 開始年
         predict_years (int): 予測する年数
+        interval_level (float): 予測区間の信頼水準（Noneなら区間を描かない）
     
     Returns:
         matplotlib.figure.Figure: 生成されたグラフのfigureオブジェクト
@@ -22,29 +184,36 @@ def create_future_prediction_graph(years, ndvi_values, lst_values, start_year=20
     lst_obs = np.array(lst_values)
     
     # 未来予測用の年の配列を作成
-    last_year = years[-1]
-    years_future = np.array(range(last_year + 1, last_year + 1 + predict_years)).reshape(-1, 1)
-    
-    # NDVI予測モデル (Year -> NDVI)
-    model_ndvi = LinearRegression().fit(years_obs, ndvi_obs)
-    ndvi_future = model_ndvi.predict(years_future)
+    last_year = int(years[-1])
+    years_future = np.arange(last_year + 1, last_year + 1 + predict_years).reshape(-1, 1)
     
-    # LST予測モデル (NDVI -> LST)
-    model_lst = LinearRegression().fit(ndvi_obs.reshape(-1, 1), lst_obs)
-    lst_future = model_lst.predict(ndvi_future.reshape(-1, 1))
+    # NDVI予測 (Year -> NDVI) と LST予測 (NDVI -> LST) を一括計算
+    forecast = fit_forecast(years, ndvi_values, lst_values)
+    ndvi_future, lst_future = forecast.predict(years_future.ravel())
+    if interval_level is not None:
+        ndvi_low, ndvi_high, lst_low, lst_high = forecast_intervals(
+            years, ndvi_values, lst_values, years_future.ravel(), level=interval_level
+        )
     
     # 全期間データの結合
     years_all = np.concatenate([years_obs.flatten(), years_future.flatten()])
     ndvi_all = np.concatenate([ndvi_obs, ndvi_future])
     lst_all = np.concatenate([lst_obs, lst_future])
     
-    # グラフ作成
+    # グラフ作成（matplotlibは描画するときに初めて読み込む）
+    import matplotlib.pyplot as plt
+
     fig, ax1 = plt.subplots(figsize=(12, 6))
     
     # NDVIのプロット（左軸）
     obs_len = len(years_obs)
     ax1.plot(years_all[:obs_len], ndvi_all[:obs_len], color='green', marker='o', linewidth=2, markersize=8, label='NDVI (実測値)')
     ax1.plot(years_all[obs_len-1:], ndvi_all[obs_len-1:], color='green', linestyle='--', linewidth=2, marker='o', markersize=6, alpha=0.7, label='NDVI (予測値)')
+    if interval_level is not None:
+        # 区間は最後の観測点（幅0）から広がるように描く
+        band_years = years_all[obs_len-1:]
+        ax1.fill_between(band_years, np.r_[ndvi_obs[-1], ndvi_low], np.r_[ndvi_obs[-1], ndvi_high],
+                         color='green', alpha=0.15, label=f'NDVI {interval_level:.0%}予測区間')
     ax1.set_xlabel('年', fontsize=12)
     ax1.set_ylabel('NDVI（植生指数）', color='green', fontsize=12)
     ax1.tick_params(axis='y', labelcolor='green')
@@ -54,6 +223,9 @@ def create_future_prediction_graph(years, ndvi_values, lst_values, start_year=20
     ax2 = ax1.twinx()
     ax2.plot(years_all[:obs_len], lst_all[:obs_len], color='orangered', marker='s', linewidth=2, markersize=8, label='LST (実測値)')
     ax2.plot(years_all[obs_len-1:], lst_all[obs_len-1:], color='orangered', linestyle='--', linewidth=2, marker='s', markersize=6, alpha=0.7, label='LST (予測値)')
+    if interval_level is not None:
+        ax2.fill_between(band_years, np.r_[lst_obs[-1], lst_low], np.r_[lst_obs[-1], lst_high],
+                         color='orangered', alpha=0.12, label=f'LST {interval_level:.0%}予測区間')
     ax2.set_ylabel('LST 地表面温度 (℃)', color='orangered', fontsize=12)
     ax2.tick_params(axis='y', labelcolor='orangered')
     
@@ -70,6 +242,7 @@ def create_future_prediction_graph(years, ndvi_values, lst_values, start_year=20
     
     return fig
 
+@timed("model.greening_effect")
 def simulate_greening_effect(years, ndvi_values, lst_values, target_year, increase_rate=0.01):
     """
     来年のNDVIが想定よりX%上昇した場合のLST抑制効果をシミュレーションする
@@ -81,17 +254,11 @@ def simulate_greening_effect(years, ndvi_values, lst_values, target_year, increa
     
     この公式により、NDVI増加で温度が低下する効果を表現
     """
-    # 1. モデルの準備（NDVI予測用）
-    years_obs = np.array(years).reshape(-1, 1)
-    ndvi_obs = np.array(ndvi_values).reshape(-1, 1)
-    lst_obs = np.array(lst_values).reshape(-1, 1)
-
-    model_ndvi = LinearRegression().fit(years_obs, ndvi_obs)
-    model_lst = LinearRegression().fit(ndvi_obs, lst_obs)
+    # 1. モデルの準備（キャッシュ済みなら再計算しない）
+    forecast = fit_forecast(years, ndvi_values, lst_values)
 
     # 2. 通常の予測（ベースライン）
-    base_ndvi = model_ndvi.predict([[target_year]])[0][0]
-    base_lst = model_lst.predict([[base_ndvi]])[0][0]
+    base_ndvi, base_lst = (float(v) for v in forecast.predict(target_year))
 
     # 3. 緑化シミュレーション（NDVIを指定%増加）
     sim_ndvi = base_ndvi * (1 + increase_rate)
@@ -99,7 +266,7 @@ def simulate_greening_effect(years, ndvi_values, lst_values, target_year, increa
     # 緑化による温度抑制効果の公式（符号反転版）
     # 元の温度感度: -32.35 × NDVI + 46.10
     # 緑化効果: -(温度感度) = 32.35 × NDVI - 46.10
-    base_sensitivity = -32.3515 * base_ndvi + 46.1069
+    base_sensitivity = GREENING_SENSITIVITY_SLOPE * base_ndvi + GREENING_SENSITIVITY_INTERCEPT
     greening_effect = -base_sensitivity  # 符号を反転
     
     # NDVI増加量
@@ -107,7 +274,7 @@ def simulate_greening_effect(years, ndvi_values, lst_values, target_year, increa
     
     # 温度変化を計算（緑化効果 × NDVI増加量）
     # 負の値 = 温度低下
-    temp_change_by_formula = greening_effect * delta_ndvi
+    temp_change_by_formula = greening_temperature_change(base_ndvi, increase_rate)
     
     # シミュレーション後の温度
     sim_lst = base_lst + temp_change_by_formula
@@ -116,12 +283,367 @@ def simulate_greening_effect(years, ndvi_values, lst_values, target_year, increa
     lst_change_val = sim_lst - base_lst
     lst_change_percent = (lst_change_val / base_lst) * 100
 
-    print(f"--- {target_year}年 緑化シミュレーション ---")
-    print(f"想定NDVI: {base_ndvi:.4f} → シミュレーションNDVI: {sim_ndvi:.4f} (+{increase_rate*100}%)")
-    print(f"NDVI増加量: {delta_ndvi:.4f}")
-    print(f"元の温度感度: {base_sensitivity:.4f}℃/NDVI")
-    print(f"緑化効果係数: {greening_effect:.4f}℃/NDVI（公式: 32.35 × {base_ndvi:.4f} - 46.10）")
-    print(f"想定温度: {base_lst:.2f}℃ → シミュレーション温度: {sim_lst:.2f}℃")
-    print(f"温度変化: {lst_change_val:.2f}℃ ({lst_change_percent:.2f}%)")
-    
+    log_event(
+        "greening.simulation", target_year=int(target_year), increase_rate=increase_rate,
+        base_ndvi=base_ndvi, sim_ndvi=sim_ndvi, delta_ndvi=delta_ndvi,
+        base_sensitivity=base_sensitivity, greening_effect=greening_effect,
+        base_lst=base_lst, sim_lst=sim_lst, lst_change=lst_change_val, lst_change_percent=lst_change_percent
+    )
     return sim_lst
+
+
+def greening_temperature_change(base_ndvi, increase_rate):
+    """
+    NDVIを(1 + increase_rate)倍にしたときの温度変化を公式から計算
+
+    ΔT = -(温度感度) × ΔNDVI、ΔNDVI = NDVI × 向上率。
+    引数は配列でもよく、ブロードキャストして一括計算する。
+
+    Returns:
+        numpy.ndarray: 温度変化（℃、負の値 = 温度低下）
+    """
+    base_ndvi = np.asarray(base_ndvi, dtype=np.float64)
+    greening_effect = -(GREENING_SENSITIVITY_SLOPE * base_ndvi + GREENING_SENSITIVITY_INTERCEPT)
+    return greening_effect * (base_ndvi * np.asarray(increase_rate, dtype=np.float64))
+
+
+@timed("model.greening_grid")
+def simulate_greening_grid(years, ndvi_values, lst_values, target_years, increase_rates):
+    """
+    対象年 × NDVI向上率 の全シナリオの温度低減量を一括計算
+
+    simulate_greening_effectと同じ公式を配列演算でまとめて適用する。
+
+    Args:
+        years (array-like): 観測年
+        ndvi_values (array-like): NDVIの実測値
+        lst_values (array-like): LSTの実測値
+        target_years (array-like): 対象年のリスト
+        increase_rates (array-like): NDVI向上率のリスト（0.05 = 5%）
+
+    Returns:
+        numpy.ndarray: (対象年, 向上率) の温度低減量（℃、正の値 = 温度低下）
+    """
+    forecast = fit_forecast(years, ndvi_values, lst_values)
+    base_ndvi = forecast.predict_ndvi(np.asarray(target_years, dtype=np.float64))
+    rates = np.asarray(increase_rates, dtype=np.float64)
+    return -greening_temperature_change(base_ndvi[:, None], rates[None, :])
+
+
+@timed("render.greening_heatmap")
+def create_greening_heatmap(target_years, increase_rates, lst_reduction):
+    """
+    simulate_greening_gridの結果をヒートマップで表示
+
+    Args:
+        target_years (array-like): 対象年のリスト
+        increase_rates (array-like): NDVI向上率のリスト（0.05 = 5%）
+        lst_reduction (numpy.ndarray): (対象年, 向上率) の温度低減量
+
+    Returns:
+        matplotlib.figure.Figure: 生成されたグラフのfigureオブジェクト
+    """
+    target_years = np.asarray(target_years)
+    rates_percent = np.asarray(increase_rates) * 100
+
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(12, 6))
+    im = ax.imshow(
+        lst_reduction, aspect='auto', origin='lower', cmap='YlGnBu',
+        extent=[rates_percent[0] - 0.5, rates_percent[-1] + 0.5, target_years[0] - 0.5, target_years[-1] + 0.5]
+    )
+    cbar = plt.colorbar(im, ax=ax)
+    cbar.set_label('LST低減量 (℃)', rotation=270, labelpad=20)
+    ax.set_xlabel('NDVI向上率 (%)', fontsize=12)
+    ax.set_ylabel('対象年', fontsize=12)
+    ax.set_title('緑化シナリオ別の地表面温度低減効果', fontsize=14, fontweight='bold')
+    plt.tight_layout()
+
+    return fig
+
+
+def batched_linregress(x, y):
+    """
+    多数の系列の単回帰 y = a × x + b を最小二乗法でまとめて解く
+
+    NaNを含む観測は系列ごとに除外する。有効な観測が2点未満、
+    またはxが一定の系列は傾き・切片ともNaNになる。
+
+    Args:
+        x (numpy.ndarray): (観測数, 系列数) または (観測数, 1) の説明変数
+        y (numpy.ndarray): (観測数, 系列数) の目的変数
+
+    Returns:
+        tuple: (傾き, 切片, 有効観測数) の (系列数,) 配列
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.broadcast_to(np.asarray(x, dtype=np.float64), y.shape)
+    mask = np.isfinite(x) & np.isfinite(y)
+    n = mask.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(mask, x, 0).sum(axis=0) / n
+        y_mean = np.where(mask, y, 0).sum(axis=0) / n
+        # 年（2000前後）のような大きな値でも桁落ちしないよう中心化してから積和を取る
+        dx = np.where(mask, x - x_mean, 0)
+        dy = np.where(mask, y - y_mean, 0)
+        sxx = (dx * dx).sum(axis=0)
+        sxy = (dx * dy).sum(axis=0)
+        slope = sxy / sxx
+
+    ok = (n >= 2) & (sxx > 0)
+    slope = np.where(ok, slope, np.nan)
+    intercept = np.where(ok, y_mean - slope * x_mean, np.nan)
+    return slope, intercept, n
+
+
+class PixelTrends:
+    """
+    ピクセルごとに独立に当てはめた NDVI～年 と LST～NDVI の回帰係数マップ
+
+    各マップは (緯度, 経度) の配列で、回帰できなかったピクセルはNaN。
+    """
+    def __init__(self, ndvi_slope, ndvi_intercept, lst_slope, lst_intercept, n_obs, bbox):
+        self.ndvi_slope = ndvi_slope
+        self.ndvi_intercept = ndvi_intercept
+        self.lst_slope = lst_slope
+        self.lst_intercept = lst_intercept
+        self.n_obs = n_obs
+        self.bbox = bbox
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ndvi_slope, self.ndvi_intercept, self.lst_slope, self.lst_intercept, self.n_obs))
+
+    def forecast(self, target_year):
+        """
+        指定年のNDVI・LSTの予測マップ
+
+        Args:
+            target_year (int): 予測する年
+
+        Returns:
+            tuple: (NDVI予測マップ, LST予測マップ)
+        """
+        ndvi_map = self.ndvi_slope * target_year + self.ndvi_intercept
+        lst_map = self.lst_slope * ndvi_map + self.lst_intercept
+        return ndvi_map, lst_map
+
+
+@timed("model.pixel_trends")
+def fit_pixel_trends(ndvi_cube, lst_cube):
+    """
+    全ピクセルの NDVI～年 と LST～NDVI の回帰を1回の一括計算で当てはめる
+
+    Args:
+        ndvi_cube (RasterCube): NDVIのキューブ
+        lst_cube (RasterCube): LST（摂氏）のキューブ（ndvi_cubeと同じ時刻・格子）
+
+    Returns:
+        PixelTrends: ピクセルごとの回帰係数マップ
+    """
+    joint = ndvi_cube.time_mask & lst_cube.time_mask
+    _, height, width = ndvi_cube.shape
+    years = ndvi_cube.years[joint].astype(np.float64)
+    ndvi = ndvi_cube.data[joint].reshape(len(years), -1)
+    lst = lst_cube.data[joint].reshape(len(years), -1)
+
+    ndvi_slope, ndvi_intercept, n_obs = batched_linregress(years[:, None], ndvi)
+    lst_slope, lst_intercept, _ = batched_linregress(ndvi, lst)
+
+    # 係数マップはセッションごとに保持されるため、表示に十分なfloat32で持つ
+    shape = (height, width)
+    maps = [a.reshape(shape).astype(np.float32) for a in (ndvi_slope, ndvi_intercept, lst_slope, lst_intercept)]
+    return PixelTrends(*maps, n_obs.reshape(shape).astype(np.int16), ndvi_cube.bbox)
+
+
+@timed("model.greening_map")
+def simulate_greening_map(pixel_trends, target_year, increase_rate, mask=None):
+    """
+    ピクセルごとの予測NDVIに緑化シミュレーションの公式を適用した温度低減マップ
+
+    Args:
+        pixel_trends (PixelTrends): fit_pixel_trendsの結果
+        target_year (int): 対象年
+        increase_rate (float): NDVI向上率（0.05 = 5%）
+        mask (numpy.ndarray): 緑化するピクセルを示す (緯度, 経度) のbool配列（省略時は全ピクセル）
+
+    Returns:
+        numpy.ndarray: (緯度, 経度) の温度低減量（℃、正の値 = 温度低下、緑化しないピクセルは0、予測できないピクセルはNaN）
+    """
+    base_ndvi = pixel_trends.ndvi_slope * target_year + pixel_trends.ndvi_intercept
+    cooling = -greening_temperature_change(base_ndvi, increase_rate)
+    if mask is not None:
+        cooling = np.where(np.asarray(mask, dtype=bool) | np.isnan(cooling), cooling, 0.0)
+    return cooling
+
+
+class RegressionStats:
+    """
+    多数の系列の単回帰 y = a × x + b の十分統計量（観測数・和・平方和・積和）
+
+    観測を1つ加えるのは系列あたりO(1)で、過去の観測を持たなくても回帰係数を求め直せる。
+    xは桁落ちを避けるためx_offsetを引いてから積算する（年なら2000など）。
+    """
+    FIELDS = ("n", "sx", "sy", "sxx", "sxy")
+
+    def __init__(self, n, sx, sy, sxx, sxy, x_offset=0.0):
+        self.n = np.asarray(n, dtype=np.float64)
+        self.sx = np.asarray(sx, dtype=np.float64)
+        self.sy = np.asarray(sy, dtype=np.float64)
+        self.sxx = np.asarray(sxx, dtype=np.float64)
+        self.sxy = np.asarray(sxy, dtype=np.float64)
+        self.x_offset = float(x_offset)
+
+    @classmethod
+    def zeros(cls, shape=(), x_offset=0.0):
+        """観測0件の統計量"""
+        return cls(*(np.zeros(shape) for _ in cls.FIELDS), x_offset=x_offset)
+
+    @property
+    def shape(self):
+        return self.n.shape
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, field).nbytes for field in self.FIELDS)
+
+    def add(self, x, y):
+        """
+        1時刻分の観測を加える（xまたはyがNaNの系列は数えない）
+
+        Args:
+            x: 説明変数（スカラーまたは系列と同じ形の配列）
+            y: 目的変数（系列と同じ形の配列）
+        """
+        y = np.asarray(y, dtype=np.float64)
+        x = np.broadcast_to(np.asarray(x, dtype=np.float64) - self.x_offset, y.shape)
+        mask = np.isfinite(x) & np.isfinite(y)
+        x = np.where(mask, x, 0.0)
+        y = np.where(mask, y, 0.0)
+        self.n = self.n + mask
+        self.sx = self.sx + x
+        self.sy = self.sy + y
+        self.sxx = self.sxx + x * x
+        self.sxy = self.sxy + x * y
+
+    def coefficients(self):
+        """
+        現在の統計量から求めた回帰係数
+
+        Returns:
+            tuple: (傾き, 切片, 観測数)（観測が2点未満、またはxが一定の系列はNaN）
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_mean = self.sx / self.n
+            y_mean = self.sy / self.n
+            sxx = self.sxx - self.sx * x_mean
+            sxy = self.sxy - self.sx * y_mean
+            slope = sxy / sxx
+        # 丸め誤差で0にならない一定のxも除外する
+        ok = (self.n >= 2) & (sxx > 1e-12 * np.maximum(self.sxx, 1e-300))
+        slope = np.where(ok, slope, np.nan)
+        intercept = np.where(ok, y_mean - slope * (x_mean + self.x_offset), np.nan)
+        return slope, intercept, self.n.astype(np.int64)
+
+    def state(self, prefix):
+        """保存用の配列の辞書"""
+        state = {f"{prefix}_{field}": getattr(self, field) for field in self.FIELDS}
+        state[f"{prefix}_x_offset"] = np.float64(self.x_offset)
+        return state
+
+    @classmethod
+    def from_state(cls, state, prefix):
+        return cls(*(state[f"{prefix}_{field}"] for field in cls.FIELDS), x_offset=float(state[f"{prefix}_x_offset"]))
+
+
+class ForecastStats:
+    """
+    2段階の回帰（NDVI～年、LST～NDVI）の十分統計量
+
+    エリア平均ならスカラー、ピクセルごとなら (緯度, 経度) の形で持つ。
+    新しい年の観測はadd_yearで系列あたりO(1)で反映でき、古い年のラスタには触れない。
+    """
+    YEAR_OFFSET = 2000.0
+
+    def __init__(self, ndvi_stats, lst_stats, last_year=None):
+        """
+        Args:
+            ndvi_stats (RegressionStats): NDVI～年 の統計量
+            lst_stats (RegressionStats): LST～NDVI の統計量
+            last_year (int): 反映済みの最後の年
+        """
+        self.ndvi_stats = ndvi_stats
+        self.lst_stats = lst_stats
+        self.last_year = last_year
+
+    @classmethod
+    def empty(cls, shape=()):
+        return cls(RegressionStats.zeros(shape, x_offset=cls.YEAR_OFFSET), RegressionStats.zeros(shape))
+
+    @classmethod
+    def from_series(cls, years, ndvi_values, lst_values):
+        """エリア平均の観測系列から作成"""
+        stats = cls.empty()
+        for year, ndvi, lst in zip(years, ndvi_values, lst_values):
+            stats.add_year(year, ndvi, lst)
+        return stats
+
+    @classmethod
+    def from_cubes(cls, ndvi_cube, lst_cube):
+        """NDVI・LST（摂氏）のキューブからピクセルごとの統計量を作成（両方が有効な時刻だけを使う）"""
+        stats = cls.empty(ndvi_cube.shape[1:])
+        joint = ndvi_cube.time_mask & lst_cube.time_mask
+        for i in np.flatnonzero(joint):
+            stats.add_year(int(ndvi_cube.years[i]), ndvi_cube.data[i], lst_cube.data[i])
+        return stats
+
+    @property
+    def nbytes(self):
+        return self.ndvi_stats.nbytes + self.lst_stats.nbytes
+
+    def add_year(self, year, ndvi, lst):
+        """
+        1年分の観測を加える
+
+        NDVI～年 はNDVIが有効な系列、LST～NDVI は両方が有効な系列だけに加える
+        （fit_pixel_trendsと同じ扱い）。
+
+        Args:
+            year (int): 観測年
+            ndvi: NDVI（スカラーまたはラスタ）
+            lst: LST（摂氏、スカラーまたはラスタ）
+        """
+        ndvi = np.asarray(ndvi, dtype=np.float64)
+        lst = np.asarray(lst, dtype=np.float64)
+        self.ndvi_stats.add(np.full(ndvi.shape, float(year)), ndvi)
+        self.lst_stats.add(ndvi, lst)
+        self.last_year = int(year) if self.last_year is None else max(self.last_year, int(year))
+
+    def forecast(self):
+        """エリア平均の統計量から予測モデルを作る"""
+        ndvi_slope, ndvi_intercept, _ = self.ndvi_stats.coefficients()
+        lst_slope, lst_intercept, _ = self.lst_stats.coefficients()
+        return ChainedForecast(float(ndvi_slope), float(ndvi_intercept), float(lst_slope), float(lst_intercept))
+
+    def pixel_trends(self, bbox):
+        """ピクセルごとの統計量から回帰係数マップを作る（fit_pixel_trendsと同じ結果）"""
+        ndvi_slope, ndvi_intercept, n_obs = self.ndvi_stats.coefficients()
+        lst_slope, lst_intercept, _ = self.lst_stats.coefficients()
+        maps = [a.astype(np.float32) for a in (ndvi_slope, ndvi_intercept, lst_slope, lst_intercept)]
+        return PixelTrends(*maps, n_obs.astype(np.int16), bbox)
+
+    def state(self, prefix):
+        """保存用の配列の辞書"""
+        state = {**self.ndvi_stats.state(f"{prefix}_ndvi"), **self.lst_stats.state(f"{prefix}_lst")}
+        state[f"{prefix}_last_year"] = np.int64(-1 if self.last_year is None else self.last_year)
+        return state
+
+    @classmethod
+    def from_state(cls, state, prefix):
+        last_year = int(state[f"{prefix}_last_year"])
+        return cls(
+            RegressionStats.from_state(state, f"{prefix}_ndvi"), RegressionStats.from_state(state, f"{prefix}_lst"),
+            None if last_year < 0 else last_year,
+        )
@@ -0,0 +1,184 @@
+"""
+処理段階ごとの計測と構造化ログ
+
+各段階はstage()で囲むと処理時間が集計され、1行1件のJSONログ（ロガー名"leafcast"）として出力される。
+集計結果はget_metrics()でプロセス全体から参照でき、アプリの診断パネルに表示する。
+"""
+import collections
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOGGER_NAME = "leafcast"
+MAX_RECENT_EVENTS = 200
+
+logger = logging.getLogger(LOGGER_NAME)
+
+
+class JsonFormatter(logging.Formatter):
+    """ログレコードを1行のJSONに変換するフォーマッタ"""
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(stream=None, level=None):
+    """
+    "leafcast"ロガーにJSON形式のハンドラを付ける（何度呼んでも1つだけ）
+
+    Args:
+        stream: 出力先（省略時は標準エラー出力）
+        level (str): ログレベル（省略時は環境変数LEAFCAST_LOG_LEVEL、なければINFO）
+    """
+    if level is None:
+        level = os.environ.get("LEAFCAST_LOG_LEVEL", "INFO")
+    logger.setLevel(level)
+    if not any(getattr(handler, "_leafcast_json", False) for handler in logger.handlers):
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        handler._leafcast_json = True
+        logger.addHandler(handler)
+    logger.propagate = False
+
+
+class Metrics:
+    """段階ごとの処理時間・カウンタ・最近のイベントを保持する集計"""
+    def __init__(self, max_events=MAX_RECENT_EVENTS):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = collections.Counter()
+        self._events = collections.deque(maxlen=max_events)
+
+    def record(self, name, seconds, fields=None, error=None):
+        """段階の処理時間を1件集計"""
+        with self._lock:
+            stats = self._stages.setdefault(name, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            if error is not None:
+                stats["errors"] += 1
+            event = {"ts": time.time(), "stage": name, "ms": round(seconds * 1000, 3)}
+            event.update(fields or {})
+            if error is not None:
+                event["error"] = error
+            self._events.append(event)
+
+    def count(self, name, value=1):
+        """カウンタ（キャッシュヒット数・取得バイト数など）を加算"""
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self):
+        """
+        現在の集計
+
+        Returns:
+            dict: {'stages': {段階名: {'count', 'errors', 'total_ms', 'mean_ms', 'max_ms'}}, 'counters': {名前: 値}}
+        """
+        with self._lock:
+            stages = {
+                name: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "total_ms": stats["total"] * 1000,
+                    "mean_ms": stats["total"] * 1000 / stats["count"],
+                    "max_ms": stats["max"] * 1000,
+                }
+                for name, stats in self._stages.items()
+            }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def recent_events(self, limit=None):
+        """最近の段階イベント（新しい順）"""
+        with self._lock:
+            events = list(self._events)
+        events.reverse()
+        return events[:limit] if limit else events
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._events.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """プロセス全体の集計"""
+    return _metrics
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """構造化ログを1件出力"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def count(name, value=1):
+    """プロセス全体のカウンタを加算"""
+    _metrics.count(name, value)
+
+
+def record_stage(name, seconds, error=None, **fields):
+    """
+    計測済みの処理時間を1件集計してログに出力
+
+    Args:
+        name (str): 段階名
+        seconds (float): 処理時間（秒）
+        error (str): 失敗した場合のエラー内容
+        **fields: ログに含める値
+    """
+    _metrics.record(name, seconds, fields, error=error)
+    ms = round(seconds * 1000, 3)
+    if error is not None:
+        log_event(name, level=logging.ERROR, ms=ms, error=error, **fields)
+    else:
+        log_event(name, ms=ms, **fields)
+
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """
+    処理段階を計測するコンテキストマネージャ
+
+    ブロック内で返された辞書に値を追加すると、ログ・イベントに含まれる。
+    例外が起きた場合はエラーとして記録してから送出し直す。
+
+    Args:
+        name (str): 段階名（例: 'jaxa.request'）
+        **fields: ログに含める値
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    except Exception as e:
+        record_stage(name, time.perf_counter() - start, error=repr(e), **fields)
+        raise
+    record_stage(name, time.perf_counter() - start, **fields)
+
+
+def timed(name):
+    """関数全体をstage(name)で計測するデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
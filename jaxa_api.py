@@ -1,106 +1,569 @@
-from jaxa.earth import je
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import io
-from PIL import Image
+import time
+import datetime
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from data_sources import default_data_source, month_range
+from instrumentation import count, log_event, stage
+from raster_cache import shared_cache
+from raster_render import RasterRenderer, auto_range
+from raster_cube import RasterCube
+from tile_grid import DEFAULT_TILE_PIXELS, tile_layout, tile_size_for_ppu, mosaic_tiles, split_tiles, crop_to_bbox
+
+LST_COLLECTION = 'NASA.EOSDIS_Terra.MODIS_MOD11C3-LST.daytime.v061_global_monthly'
+NDVI_COLLECTION = 'JAXA.JASMES_Terra.MODIS-Aqua.MODIS_ndvi.v811_global_monthly'
+DEFAULT_PPU = 20
+# 選択できる解像度（1度あたりのピクセル数）
+PPU_LEVELS = (1, 2, 5, 10, 20, 40)
+DEFAULT_MAX_PIXELS = 40000
+DEFAULT_PREVIEW_PIXELS = 1000
+# 期間指定の取得で1回のfilter_dateにまとめる月数
+DEFAULT_MONTHS_PER_REQUEST = 12
+COLLECTION_BANDS = {
+    LST_COLLECTION: 'LST',
+    NDVI_COLLECTION: 'ndvi',
+}
+
+
+def choose_ppu(bbox, max_pixels, levels=PPU_LEVELS):
+    """
+    bboxのピクセル数がmax_pixels以下に収まる最も細かい解像度を選ぶ
+
+    Args:
+        bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+        max_pixels (int): 1枚のラスタのピクセル数の上限
+        levels (tuple): 選択できる解像度（1度あたりのピクセル数）
+
+    Returns:
+        int: 選んだ解像度（上限に収まるものが無ければ最も粗い解像度）
+    """
+    area = max(bbox[2] - bbox[0], 0) * max(bbox[3] - bbox[1], 0)
+    levels = sorted(levels)
+    for ppu in reversed(levels):
+        if area * ppu * ppu <= max_pixels:
+            return ppu
+    return levels[0]
 
 
 class JaxaDataProvider:
-    """JAXA衛星データ取得クラス"""
-    def get_data_array(self, bbox, coll, band , start_year, num_years=5):
+    """
+    JAXA衛星データ取得クラス
+
+    ラスタの取得自体はデータソース（data_sources.py）に任せ、このクラスは並列化・タイル分割・
+    キャッシュ・解像度の選択を受け持つ。
+    """
+    def __init__(self, max_workers=8, request_timeout=120, cache=None, ppu=None,
+                 tile_pixels=DEFAULT_TILE_PIXELS, max_pixels=DEFAULT_MAX_PIXELS,
+                 preview_pixels=DEFAULT_PREVIEW_PIXELS, ppu_levels=PPU_LEVELS, source=None):
+        """
+        Args:
+            max_workers (int): このプロバイダ経由で同時に実行するAPIリクエストの上限（全ての取得で共有、1以下で逐次取得）
+            request_timeout (float): 1リクエストを投入してから結果を待つ時間の上限（秒、Noneで無制限。逐次取得では適用しない）
+            cache (RasterDiskCache): ラスタのディスクキャッシュ（省略時は取得元がローカルでなければ既定の場所のものをプロセス内で共有、Falseで無効）
+            ppu (int): 取得解像度（1度あたりのピクセル数、Noneでbboxの広さから自動選択）
+            tile_pixels (int): 取得タイル一辺のピクセル数の目安（タイルの一辺の度数は解像度から決める、Noneでタイル分割しない）
+            max_pixels (int): 解像度を自動選択するときの1枚あたりのピクセル数の上限
+            preview_pixels (int): 速報用の低解像度取得のピクセル数の上限
+            ppu_levels (tuple): 自動選択で使う解像度の候補
+            source (DataSource): ラスタの取得元（省略時は環境変数LEAFCAST_LOCAL_DATAがあればローカル、無ければJAXA API）
+        """
+        self.source = default_data_source() if source is None else source
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self.request_timeout = request_timeout
+        if cache is None:
+            cache = shared_cache() if self.source.cacheable else False
+        self.cache = cache or None
+        self.ppu = ppu
+        self.tile_pixels = tile_pixels
+        self.max_pixels = max_pixels
+        self.preview_pixels = preview_pixels
+        self.ppu_levels = ppu_levels
+        self.renderer = RasterRenderer()
+
+    def resolve_ppu(self, bbox):
+        """bboxの取得解像度（固定されていなければピクセル数の上限から選ぶ）"""
+        if self.ppu is not None:
+            return self.ppu
+        return choose_ppu(bbox, self.max_pixels, self.ppu_levels)
+
+    def preview_ppu(self, bbox):
+        """
+        速報用の低解像度
+
+        Returns:
+            int: 解像度（本取得より粗くならない場合はNone）
+        """
+        ppu = choose_ppu(bbox, self.preview_pixels, self.ppu_levels)
+        return ppu if ppu < self.resolve_ppu(bbox) else None
+
+    @property
+    def executor(self):
+        """
+        全ての取得で共有するワーカープール（初回に作成）
+
+        取得ごとにプールを作ると同時に走る取得（共有ストアの複数ジョブなど）の分だけ
+        同時リクエスト数が増えるため、プロバイダに1つだけ持ち、上限をmax_workersに保つ。
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="jaxa-fetch")
+            return self._executor
+
+    def _replace_executor(self, executor):
+        """
+        応答しないリクエストにワーカーを占有されたプールを手放し、以降の取得は新しいプールで行う
+
+        JAXA APIのクライアントには通信のタイムアウトが無く、戻らないリクエストのスレッドは止められない。
+        そのまま使い続けるとmax_workers回のタイムアウトで全ワーカーが埋まり、後続のリクエストが
+        始まらなくなるため、古いプールの待ち行列は取り消し（待っている取得では失敗になる）、スレッドの終了は待たない。
+        """
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def tile_layout(self, bbox, ppu):
+        """
+        bboxを解像度に応じた大きさの固定グリッドのタイルに分割
+
+        Returns:
+            tuple: (タイルの一辺（度）, tile_layoutの結果)（tile_pixelsがNoneでタイル分割しない場合はNone）
+        """
+        if self.tile_pixels is None:
+            return None
+        tile_size = tile_size_for_ppu(ppu, self.tile_pixels)
+        return tile_size, tile_layout(bbox, tile_size)
+
+    def _tile_grid(self, bbox, ppu):
+        """
+        取得に使うタイルの並び
+
+        Returns:
+            tuple: (タイル一辺のピクセル数, (タイルのbboxのリスト, 行数, 列数, グリッド全体のbbox))
+            （タイル分割しない場合はピクセル数がNoneで、bbox自体を1つのタイルとして扱う）
+        """
+        layout = self.tile_layout(bbox, ppu)
+        if layout is None:
+            return None, ([bbox], 1, 1, bbox)
+        tile_size, grid = layout
+        return int(round(tile_size * ppu)), grid
+
+    def _fetch_tiles(self, tiles, coll, band, months, ppu, n_cols, tile_pixels, request, label):
+        """
+        タイルごとのラスタをキャッシュから読み、足りないタイルはそれらを囲む範囲を1回で取得してタイルに分ける
+
+        キャッシュの単位は常にグリッドのタイルなので、bboxが1つのタイルに収まってもタイル境界をまたいでも、
+        地図を動かしたときに重なっているタイルを使い回せる。取得は足りないタイルの数によらず1回にまとめる。
+
+        Args:
+            tiles (list): tile_layoutと同じ順序のタイルのbbox（tile_pixelsがNoneなら要求範囲のbbox1つ）
+            coll (str): コレクション
+            band (str): バンド名
+            months (list): 取得する月（'YYYY-MM'）
+            ppu (int): 取得解像度
+            n_cols (int): タイルの列数
+            tile_pixels (int): タイル一辺のピクセル数（Noneならbboxをそのまま取得・キャッシュする）
+            request (callable): 範囲のbboxを受け取って {'YYYY-MM': ラスタ配列} を返す取得関数
+            label (str): 計測ログに出す取得期間
+
+        Returns:
+            list: タイルごとの {'YYYY-MM': ラスタ配列}（データが無い月は含まない）
+        """
+        results = [{} for _ in tiles]
+        missing = list(range(len(tiles)))
+        if self.cache is not None:
+            missing = []
+            for k, tile in enumerate(tiles):
+                cached = {month: self.cache.get(coll, band, tile, month, ppu) for month in months}
+                if all(array is not None for array in cached.values()):
+                    results[k] = cached
+                else:
+                    missing.append(k)
+            if len(missing) < len(tiles):
+                count("cache.hit", (len(tiles) - len(missing)) * len(months))
+            if missing:
+                count("cache.miss", len(missing) * len(months))
+        if not missing:
+            return results
+
+        # 足りないタイルを囲むタイル単位の範囲（キャッシュ済みのタイルを一部含むことがある）
+        row0, row1 = min(k // n_cols for k in missing), max(k // n_cols for k in missing) + 1
+        col0, col1 = min(k % n_cols for k in missing), max(k % n_cols for k in missing) + 1
+        south_west, north_east = tiles[(row1 - 1) * n_cols + col0], tiles[row0 * n_cols + col1 - 1]
+        block_bbox = [south_west[0], south_west[1], north_east[2], north_east[3]]
+        block = [row * n_cols + col for row in range(row0, row1) for col in range(col0, col1)]
+
+        with stage("jaxa.request", coll=coll, band=band, month=label, ppu=ppu, tiles=len(block)) as fields:
+            rasters = request(block_bbox)
+            fields["pixels"] = sum(int(raster_data.size) for raster_data in rasters.values())
+            fields["bytes"] = sum(int(raster_data.nbytes) for raster_data in rasters.values())
+        count("jaxa.requests")
+        count("jaxa.bytes", fields["bytes"])
+        count("jaxa.pixels", fields["pixels"])
+
+        fetched = {k: {} for k in block}
+        for month, raster_data in rasters.items():
+            if tile_pixels is None:
+                parts = [raster_data]
+            else:
+                parts = split_tiles(raster_data, row1 - row0, col1 - col0, tile_pixels)
+            for k, part in zip(block, parts):
+                fetched[k][month] = part
+
+        for k in missing:
+            results[k] = fetched[k]
+            # 確定済みの過去の月次合成だけをキャッシュする
+            final = {month: array for month, array in fetched[k].items() if self._is_final(month)}
+            if self.cache is not None and final:
+                self.cache.put_many(coll, band, tiles[k], ppu, final)
+        return results
+
+    def _fetch_raster(self, tiles, coll, band, target_year, ppu, n_cols=1, tile_pixels=None):
+        """
+        1年分のラスタをタイルごとに取得（ディスクキャッシュにあるタイルはAPIを呼ばない）
+
+        キャッシュは解像度ごとに別のエントリになる。
+
+        Returns:
+            list: タイルごとのラスタ配列（データが無い場合はNone）
+        """
+        date = f"{target_year}-04"
+
+        def request(bbox):
+            raster_data = self._request_raster(bbox, coll, band, target_year, ppu)
+            return {} if raster_data is None else {date: raster_data}
+
+        rasters = self._fetch_tiles(tiles, coll, band, [date], ppu, n_cols, tile_pixels, request, date)
+        return [tile_rasters.get(date) for tile_rasters in rasters]
+
+    def _request_raster(self, bbox, coll, band, target_year, ppu):
+        """
+        1年分のラスタをデータソースから取得
+
+        Returns:
+            numpy.ndarray: ラスタ配列（データが無い場合はNone）
+        """
+        return self.source.request_raster(bbox, coll, band, target_year, ppu)
+
+    def _is_final(self, month):
+        """確定済みの過去の月次合成かどうか（キャッシュしてよい月）"""
+        today = datetime.date.today()
+        return month < f"{today.year:04d}-{today.month:02d}"
+
+    def _fetch_range(self, tiles, coll, band, start_month, end_month, ppu, n_cols=1, tile_pixels=None):
+        """
+        連続した月のラスタをタイルごとに1回のfilter_dateでまとめて取得（全月がキャッシュにあるタイルはAPIを呼ばない）
+
+        各月はyear単位の取得と同じキーでキャッシュされるため、どちらの取得結果も使い回せる。
+
+        Returns:
+            list: タイルごとの {'YYYY-MM': ラスタ配列}（データが無い月は含まない）
+        """
+        def request(bbox):
+            return self._request_range(bbox, coll, band, start_month, end_month, ppu)
+
+        months = month_range(start_month, end_month)
+        return self._fetch_tiles(
+            tiles, coll, band, months, ppu, n_cols, tile_pixels, request, f"{start_month}/{end_month}"
+        )
+
+    def _request_range(self, bbox, coll, band, start_month, end_month, ppu):
+        """
+        期間内の全ての月次ラスタをデータソースから1回の問い合わせで取得
+
+        Returns:
+            dict: {'YYYY-MM': ラスタ配列}（データが無い月は含まない）
+        """
+        return self.source.request_range(bbox, coll, band, start_month, end_month, ppu)
+
+    def fetch_rasters(self, requests, ppu=None):
+        """
+        複数の取得リクエストをワーカープールで並列実行
+
+        tile_pixelsが設定されている場合は各bboxを解像度に応じた大きさの固定グリッドのタイルに分割して
+        タイル単位でキャッシュし、結合してから要求範囲に切り出す。キャッシュに無いタイルは
+        まとめて1回で取得するため、リクエスト数はタイル数によらずbbox・年ごとに最大1回になる。
+
+        Args:
+            requests (list): (bbox, coll, band, target_year) のタプルのリスト
+            ppu (int): 取得解像度（省略時は各bboxからresolve_ppuで決める）
+
+        Returns:
+            list: requestsと同じ順序のラスタ配列のリスト（失敗・タイムアウト時はNone）
+        """
+        results = [None] * len(requests)
+        for i, raster_data in self.iter_fetch(requests, ppu=ppu):
+            results[i] = raster_data
+        return results
+
+    def iter_fetch(self, requests, cancel_event=None, ppu=None):
+        """
+        fetch_rastersと同じ取得を行い、リクエストが完了した順に結果を返すジェネレータ
+
+        途中でジェネレータを閉じるかcancel_eventがセットされると、
+        まだ始まっていないリクエストは取り消される。
+
+        Args:
+            requests (list): (bbox, coll, band, target_year) のタプルのリスト
+            cancel_event (threading.Event): 取り消し用のイベント
+            ppu (int): 取得解像度（省略時は各bboxからresolve_ppuで決める）
+
+        Yields:
+            tuple: (requests内の番号, ラスタ配列（失敗・タイムアウト時はNone）)
+        """
+        tile_requests = []
+        layouts = []
+        for bbox, coll, band, target_year in requests:
+            req_ppu = self.resolve_ppu(bbox) if ppu is None else ppu
+            tile_pixels, (tiles, n_rows, n_cols, grid_bbox) = self._tile_grid(bbox, req_ppu)
+            layouts.append((n_rows, n_cols, grid_bbox, req_ppu, tile_pixels))
+            tile_requests.append((tiles, coll, band, target_year, req_ppu, n_cols, tile_pixels))
+
+        for i, tile_arrays in self._iter_requests(tile_requests, cancel_event):
+            n_rows, n_cols, grid_bbox, req_ppu, tile_pixels = layouts[i]
+            if tile_arrays is None or tile_pixels is None:
+                yield i, None if tile_arrays is None else tile_arrays[0]
+                continue
+            mosaic = mosaic_tiles(tile_arrays, n_rows, n_cols, tile_pixels)
+            yield i, None if mosaic is None else crop_to_bbox(mosaic, grid_bbox, requests[i][0], req_ppu)
+
+    def _iter_requests(self, requests, cancel_event=None, fetch=None):
+        """
+        取得リクエストをそのままワーカープールで実行し、完了した順に結果を返す
+
+        この取得から同時に投入するのはmax_workers件までで、request_timeoutは投入した時点から数える
+        （待ち行列で始まらないままのリクエストも打ち切る）。実行中のまま打ち切ったリクエストがあれば
+        プールを作り直す（_replace_executor）。逐次取得（max_workersが1以下）ではrequest_timeoutを適用しない。
+        cancel_eventがセットされたら残りのリクエストを待たずに終了する。
+
+        Args:
+            requests (list): fetchの引数のタプルのリスト
+            cancel_event (threading.Event): 取り消し用のイベント
+            fetch (callable): 1リクエストを実行する関数（省略時は_fetch_raster）
+
+        Yields:
+            tuple: (requests内の番号, 取得結果（失敗・タイムアウト時はNone）)
+        """
+        fetch = fetch or self._fetch_raster
+        # 逐次取得モード
+        if self.max_workers is None or self.max_workers <= 1:
+            for i, req in enumerate(requests):
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                try:
+                    raster_data = fetch(*req)
+                except Exception as e:
+                    log_event("jaxa.error", level=logging.ERROR, request=str(req[3]), error=repr(e))
+                    raster_data = None
+                yield i, raster_data
+            return
+
+        futures = {}
+        deadlines = {}
+        next_index = 0
+        try:
+            while next_index < len(requests) or futures:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                while next_index < len(requests) and len(futures) < self.max_workers:
+                    executor = self.executor
+                    future = executor.submit(fetch, *requests[next_index])
+                    futures[future] = (next_index, executor)
+                    if self.request_timeout is not None:
+                        deadlines[future] = time.monotonic() + self.request_timeout
+                    next_index += 1
+
+                done, _ = wait(futures, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, _ = futures.pop(future)
+                    deadlines.pop(future, None)
+                    try:
+                        raster_data = future.result()
+                    except Exception as e:
+                        log_event("jaxa.error", level=logging.ERROR, request=str(requests[i][3]), error=repr(e))
+                        raster_data = None
+                    yield i, raster_data
+
+                # 作り直したプールの待ち行列にあって取り消されたリクエストは失敗として返す
+                for future in [future for future in futures if future.cancelled()]:
+                    i, _ = futures.pop(future)
+                    deadlines.pop(future, None)
+                    log_event("jaxa.error", level=logging.ERROR, request=str(requests[i][3]), error="cancelled")
+                    yield i, None
+
+                # 投入からrequest_timeoutを超えたリクエストは待たずに打ち切る
+                now = time.monotonic()
+                for future in [future for future, deadline in deadlines.items() if now >= deadline]:
+                    i, executor = futures.pop(future)
+                    del deadlines[future]
+                    if not future.cancel():
+                        # 実行中のまま戻らないリクエストがワーカーを占有し続けないよう、プールを作り直す
+                        self._replace_executor(executor)
+                    log_event(
+                        "jaxa.timeout", level=logging.ERROR, request=str(requests[i][3]), timeout=self.request_timeout
+                    )
+                    count("jaxa.timeouts")
+                    yield i, None
+        finally:
+            # 中断時はまだ始まっていないリクエストを取り消す（実行中・タイムアウトしたものの終了は待たない）
+            for future in futures:
+                future.cancel()
+
+    @staticmethod
+    def display_range(band, rasters):
         """
-        指定範囲のNDVI画像を取得
-        
+        画像の色付け範囲を決める
+
+        Args:
+            band (str): バンド名
+            rasters (list): 表示用のラスタ配列のリスト（LSTは摂氏）
+
+        Returns:
+            tuple: (vmin, vmax)（LSTは全年共通の摂氏レンジ、それ以外は0～1）
+        """
+        if band == 'LST':
+            return auto_range(rasters)
+        return 0.0, 1.0
+
+    def render_image(self, raster, bbox, band, target_year, value_range):
+        """
+        1年分のラスタをプレビュー画像に描画
+
+        Args:
+            raster (numpy.ndarray): 表示用のラスタ（LSTは摂氏）
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+            band (str): バンド名
+            target_year (int): 対象年
+            value_range (tuple): display_rangeで求めた (vmin, vmax)
+
+        Returns:
+            PIL.Image: 描画した画像
+        """
+        label = 'Temperature (°C)' if band == 'LST' else band
+        with stage("render.image", band=band, year=target_year, pixels=int(raster.size)):
+            return self.renderer.render(raster, bbox, value_range[0], value_range[1], label, f'{band} - {target_year}')
+
+    def get_lst_ndvi_cubes(self, bbox, start_year, num_years=5):
+        """
+        LSTとNDVIの全年分の数値データだけを並列取得（画像は描画しない）
+
+        画像が必要になったらrender_imageで1年ずつ描画する。
+
+        Returns:
+            tuple: (LST摂氏のRasterCube, NDVIのRasterCube)
+        """
+        requests = [(bbox, LST_COLLECTION, 'LST', start_year + i) for i in range(num_years)]
+        requests += [(bbox, NDVI_COLLECTION, 'ndvi', start_year + i) for i in range(num_years)]
+        rasters = self.fetch_rasters(requests)
+
+        lst_cube = RasterCube.from_yearly_arrays(rasters[:num_years], start_year, bbox)
+        lst_cube.data -= 273.15
+        ndvi_cube = RasterCube.from_yearly_arrays(rasters[num_years:], start_year, bbox)
+        return lst_cube, ndvi_cube
+
+    def iter_rasters(self, bbox, start_year, num_years=5, collections=(LST_COLLECTION, NDVI_COLLECTION),
+                     cancel_event=None, ppu=None):
+        """
+        全年・全コレクションのラスタを並列取得し、取得できたものから順に返すジェネレータ
+
         Args:
             bbox (list): [西経度, 南緯度, 東経度, 北緯度]
             start_year (int): 開始年
             num_years (int): 取得年数
-        
+            collections (tuple): 取得するコレクション（COLLECTION_BANDSのキー）
+            cancel_event (threading.Event): セットされると残りのリクエストを取り消して終了する
+            ppu (int): 取得解像度（省略時はresolve_ppuで決める）
+
+        Yields:
+            tuple: (年, コレクション, ラスタ配列（LSTはケルビンのまま、取得失敗時はNone）)
+        """
+        requests = [
+            (bbox, coll, COLLECTION_BANDS[coll], start_year + i)
+            for coll in collections for i in range(num_years)
+        ]
+        for i, raster_data in self.iter_fetch(requests, cancel_event, ppu=ppu):
+            _, coll, _, target_year = requests[i]
+            yield target_year, coll, raster_data
+
+    def iter_rasters_progressive(self, bbox, start_year, num_years=5,
+                                 collections=(LST_COLLECTION, NDVI_COLLECTION), cancel_event=None):
+        """
+        低解像度の速報を先に取得してから、本来の解像度で取得し直すジェネレータ
+
+        速報は解像度が粗く1リクエストあたりのピクセル数が少ないため、すぐに揃う。
+        各解像度のラスタはそれぞれのタイルグリッドで別にキャッシュされる。
+
+        Yields:
+            tuple: (解像度, 年, コレクション, ラスタ配列（LSTはケルビンのまま、取得失敗時はNone）)
+        """
+        preview_ppu = self.preview_ppu(bbox)
+        if preview_ppu is not None:
+            for target_year, coll, raster_data in self.iter_rasters(
+                    bbox, start_year, num_years, collections, cancel_event, ppu=preview_ppu):
+                yield preview_ppu, target_year, coll, raster_data
+            if cancel_event is not None and cancel_event.is_set():
+                return
+
+        ppu = self.resolve_ppu(bbox)
+        for target_year, coll, raster_data in self.iter_rasters(
+                bbox, start_year, num_years, collections, cancel_event, ppu=ppu):
+            yield ppu, target_year, coll, raster_data
+
+    def get_monthly_cube(self, bbox, coll, start_month, end_month, ppu=None,
+                         months_per_request=DEFAULT_MONTHS_PER_REQUEST, cancel_event=None):
+        """
+        期間内の全ての月次ラスタを (月, 緯度, 経度) のキューブとして取得
+
+        年ごとに1回ずつ問い合わせる代わりに、months_per_requestか月分を1回のfilter_dateで
+        まとめて取得する（23年 × 12か月でも23回）。まとめた各期間はワーカープールで並列に取得する。
+
+        Args:
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+            coll (str): コレクション（COLLECTION_BANDSのキー）
+            start_month (str): 開始月（'YYYY-MM'）
+            end_month (str): 終了月（'YYYY-MM'、この月を含む）
+            ppu (int): 取得解像度（省略時はresolve_ppuで決める）
+            months_per_request (int): 1回の問い合わせにまとめる月数
+            cancel_event (threading.Event): セットされると残りのリクエストを取り消して終了する
+
         Returns:
-            list: PIL.Imageのリスト（取得失敗時はNone）
-        """
-        images = []
-        number_datas = []
-        
-        for i in range(num_years):
-            target_year = start_year + i
-            
-            try:
-                # JAXA APIでデータ取得
-                data = je.ImageCollection(
-                    collection=coll,
-                    ssl_verify=True
-                ).filter_date(
-                    dlim=[f"{target_year}-04-01T00:00:00", f"{target_year}-04-01T00:00:00"]
-                ).filter_resolution(
-                    ppu=20
-                ).filter_bounds(
-                    bbox=bbox
-                ).select(
-                    band=band
-                ).get_images()
-                
-                if data:
-                    # 数値データを保存
-                    raster_data = data.raster.img[0]
-                    number_datas.append(raster_data)
-                    
-                    # 直接imshowで画像を生成
-                    fig, ax = plt.subplots(figsize=(8, 6))
-                    
-                    # 緯度経度の範囲を取得
-                    extent = [bbox[0], bbox[2], bbox[1], bbox[3]]  # [west, east, south, north]
-                    
-                    # LSTの場合は摂氏変換して表示範囲を設定
-                    if band == 'LST':
-                        # ケルビンから摂氏に変換
-                        raster_data_celsius = raster_data - 273.15
-                        im = ax.imshow(raster_data_celsius, extent=extent, aspect='auto', origin='upper', cmap='jet')
-                        cbar = plt.colorbar(im, ax=ax)
-                        cbar.set_label('Temperature (°C)', rotation=270, labelpad=20)
-                    else:
-                        im = ax.imshow(raster_data, extent=extent, aspect='auto', origin='upper', vmin=0, vmax=1, cmap='jet')
-                        cbar = plt.colorbar(im, ax=ax)
-                        cbar.set_label(band, rotation=270, labelpad=20)
-                    
-                    ax.set_xlabel('Longitude (°E)')
-                    ax.set_ylabel('Latitude (°N)')
-                    ax.set_title(f'{band} - {target_year}')
-                    
-                    # PIL Imageに変換
-                    buf = io.BytesIO()
-                    fig.savefig(buf, format='png', bbox_inches='tight', dpi=150)
-                    buf.seek(0)
-                    pil_img = Image.open(buf).copy()
-                    images.append(pil_img)
-                    
-                    # メモリ解放
-                    plt.close(fig)
-                    buf.close()
-                else:
-                    images.append(None)
-                    number_datas.append(None)
-                    
-            except Exception as e:
-                print(f"Error {target_year}: {e}")
-                images.append(None)
-                number_datas.append(None)
-                plt.close('all')
-        
-        return images, number_datas
-    
-    def get_land_cover_images(self, bbox, start_year, num_years=5):
-        images, kelvin_array = self.get_data_array(bbox, coll='NASA.EOSDIS_Terra.MODIS_MOD11C3-LST.daytime.v061_global_monthly', band='LST', start_year=start_year, num_years=num_years)
-        celsius_datas = []
-
-        for kelvin_array in kelvin_array:
-            if kelvin_array is not None:
-                celsius_array = kelvin_array - 273.15
-                celsius_datas.append(celsius_array)
-            else:
-                celsius_datas.append(None)
-        
-        return images, celsius_datas
-    def get_ndvi_images(self, bbox, start_year, num_years=5):
-        return self.get_data_array(bbox, coll='JAXA.JASMES_Terra.MODIS-Aqua.MODIS_ndvi.v811_global_monthly', band='ndvi', start_year=start_year, num_years=num_years)
\ No newline at end of file
+            RasterCube: 月ごとのキューブ（値は元の単位のまま、データが無い月はtime_maskがFalse）
+        """
+        band = COLLECTION_BANDS[coll]
+        ppu = self.resolve_ppu(bbox) if ppu is None else ppu
+        months = month_range(start_month, end_month)
+        chunks = [months[i:i + months_per_request] for i in range(0, len(months), months_per_request)]
+
+        tile_pixels, (tiles, n_rows, n_cols, grid_bbox) = self._tile_grid(bbox, ppu)
+        requests = [(tiles, coll, band, chunk[0], chunk[-1], ppu, n_cols, tile_pixels) for chunk in chunks]
+        tile_rasters = [{} for _ in tiles]
+        for _, rasters in self._iter_requests(requests, cancel_event, fetch=self._fetch_range):
+            for merged, fetched in zip(tile_rasters, rasters or []):
+                merged.update(fetched)
+
+        arrays = []
+        for month in months:
+            month_tiles = [rasters.get(month) for rasters in tile_rasters]
+            if tile_pixels is None:
+                arrays.append(month_tiles[0])
+                continue
+            mosaic = mosaic_tiles(month_tiles, n_rows, n_cols, tile_pixels)
+            arrays.append(None if mosaic is None else crop_to_bbox(mosaic, grid_bbox, bbox, ppu))
+        return RasterCube.from_arrays(arrays, months, bbox)
+
+    def get_lst_ndvi_monthly_cubes(self, bbox, start_year, num_years=5, ppu=None, cancel_event=None):
+        """
+        LSTとNDVIの全ての月の数値データをまとめて取得
+
+        季節ごとの集計はRasterCube.seasonal_meanで行う。
+
+        Returns:
+            tuple: (LST摂氏の月次RasterCube, NDVIの月次RasterCube)
+        """
+        start_month = f"{start_year:04d}-01"
+        end_month = f"{start_year + num_years - 1:04d}-12"
+        lst_cube = self.get_monthly_cube(bbox, LST_COLLECTION, start_month, end_month, ppu=ppu, cancel_event=cancel_event)
+        ndvi_cube = self.get_monthly_cube(bbox, NDVI_COLLECTION, start_month, end_month, ppu=ppu, cancel_event=cancel_event)
+        return lst_cube.with_data(lst_cube.data - 273.15), ndvi_cube
@@ -0,0 +1,240 @@
+import atexit
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windowsではプロセス間の排他を行わない
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "leafcast", "rasters")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+# index.jsonを書き出す最短の間隔（秒）。書き出し前に終了しても.npyは残り、次回のget時に取り込まれる
+INDEX_SAVE_INTERVAL = 2.0
+
+
+class RasterDiskCache:
+    """
+    取得済みラスタをローカルディスクに保存するキャッシュ
+
+    ラスタはfloat32の.npyファイルとして保存し、読み出し時はメモリマップで開く。
+    メタデータはindex.jsonにまとめて保持し、合計サイズがmax_bytesを超えたら
+    最終アクセスが古いものから削除する（LRU）。
+
+    同じディレクトリを複数のプロセス（batch_forecast.pyのワーカーなど）が使うため、index.jsonの書き出しと
+    削除はロックファイルで排他し、そのたびにディスク上のインデックスとディレクトリの実体を取り込んで
+    合計サイズを数え直す。同じプロセス内ではshared_cache()でディレクトリごとに1つを共有する。
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        """
+        Args:
+            cache_dir (str): 保存先ディレクトリ（省略時は環境変数LEAFCAST_CACHE_DIR、なければ~/.cache/leafcast/rasters）
+            max_bytes (int): キャッシュ全体の上限バイト数（省略時は環境変数LEAFCAST_CACHE_MAX_BYTES、なければ2GiB）
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get("LEAFCAST_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("LEAFCAST_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._total = sum(entry["nbytes"] for entry in self._index.values())
+        self._last_save = time.monotonic()
+        atexit.register(self._flush_at_exit)
+
+    @staticmethod
+    def make_key(coll, band, bbox, date, ppu):
+        """キャッシュキー（ファイル名）を生成"""
+        bbox_str = ",".join(f"{v:.6f}" for v in bbox)
+        raw = f"{coll}|{band}|{bbox_str}|{date}|{ppu}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _load_index(self):
+        path = os.path.join(self.cache_dir, INDEX_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        # 実体が消えているエントリは捨てる
+        return {k: v for k, v in index.items() if os.path.exists(self._path(k))}
+
+    @contextlib.contextmanager
+    def _dir_lock(self):
+        """同じディレクトリを使う他のプロセスとインデックスの更新・削除を排他する"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.cache_dir, LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _merge_from_disk(self):
+        """
+        他のプロセスの書き込み・削除をインデックスに取り込み、合計サイズをディレクトリの実体から数え直す
+        （呼び出し元で_lockと_dir_lockを取る）
+        """
+        index = self._load_index()
+        for key, entry in self._index.items():
+            if key in index:
+                index[key]["last_access"] = max(index[key].get("last_access", 0), entry.get("last_access", 0))
+            elif os.path.exists(self._path(key)):
+                index[key] = entry
+        # どのインデックスにも無いファイル（書き出し前に終了したプロセスの分など）も数える
+        with os.scandir(self.cache_dir) as it:
+            for item in it:
+                key, ext = os.path.splitext(item.name)
+                if ext == ".npy" and key not in index:
+                    stat = item.stat()
+                    index[key] = {"nbytes": stat.st_size, "last_access": stat.st_mtime}
+        self._index = index
+        self._total = sum(entry["nbytes"] for entry in index.values())
+
+    def _sync(self):
+        """ディスク上の状態を取り込み、上限を超えた分を削除してindex.jsonを書き出す（呼び出し元で_lockを取る）"""
+        with self._dir_lock():
+            self._merge_from_disk()
+            self._evict()
+            self._save_index()
+
+    def _save_index(self):
+        path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, path)
+        self._last_save = time.monotonic()
+
+    def get(self, coll, band, bbox, date, ppu):
+        """
+        キャッシュからラスタを読み出す
+
+        Returns:
+            numpy.ndarray: 読み取り専用のメモリマップ配列（未キャッシュ時はNone）
+        """
+        key = self.make_key(coll, band, bbox, date, ppu)
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                # 別プロセスが書き込んだファイルはここでインデックスに取り込む
+                entry = self._index[key] = {
+                    "coll": coll, "band": band, "bbox": list(bbox), "date": date, "ppu": ppu,
+                    "shape": list(array.shape), "nbytes": os.path.getsize(path),
+                }
+                self._total += entry["nbytes"]
+            entry["last_access"] = time.time()
+        return array
+
+    def put(self, coll, band, bbox, date, ppu, array):
+        """ラスタをfloat32で保存し、上限を超えた分を古い順に削除"""
+        self.put_many(coll, band, bbox, ppu, {date: array})
+
+    def put_many(self, coll, band, bbox, ppu, arrays):
+        """
+        同じ範囲の複数の日付のラスタをまとめて保存
+
+        index.jsonの書き出し（他のプロセスの分を取り込んだ合計サイズでの削除を含む）は
+        INDEX_SAVE_INTERVAL秒に1回までにまとめる（大量のタイルを保存しても保存のたびにインデックス全体を書き直さない）。
+        このプロセスの分だけで上限を超えた場合はすぐに行う。
+
+        Args:
+            arrays (dict): {日付: ラスタ配列}
+        """
+        entries = {}
+        for date, array in arrays.items():
+            key = self.make_key(coll, band, bbox, date, ppu)
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, np.asarray(array, dtype=np.float32))
+            os.replace(tmp, path)
+            entries[key] = {
+                "coll": coll, "band": band, "bbox": list(bbox), "date": date, "ppu": ppu,
+                "shape": list(np.shape(array)), "nbytes": os.path.getsize(path),
+                "last_access": time.time(),
+            }
+
+        with self._lock:
+            for key, entry in entries.items():
+                if key in self._index:
+                    self._total -= self._index[key]["nbytes"]
+                self._index[key] = entry
+                self._total += entry["nbytes"]
+            if self._total > self.max_bytes or time.monotonic() - self._last_save >= INDEX_SAVE_INTERVAL:
+                self._sync()
+
+    def _evict(self):
+        """合計サイズが上限を超えていれば最終アクセスが古いものから削除（呼び出し元で_lockと_dir_lockを取る）"""
+        if self._total <= self.max_bytes:
+            return
+
+        for key in sorted(self._index, key=lambda k: self._index[k].get("last_access", 0)):
+            if self._total <= self.max_bytes:
+                break
+            self._total -= self._index.pop(key)["nbytes"]
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def total_bytes(self):
+        """キャッシュ中のラスタの合計バイト数"""
+        with self._lock:
+            return self._total
+
+    def flush(self):
+        """最終アクセス時刻を含むインデックスを、他のプロセスの分と合わせてディスクに書き出す"""
+        with self._lock:
+            self._sync()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache(cache_dir=None, max_bytes=None):
+    """
+    ディレクトリごとに1つのRasterDiskCache（同じプロセス内の全てのプロバイダで共有）
+
+    Args:
+        cache_dir (str): 保存先ディレクトリ（省略時はRasterDiskCacheと同じ既定値）
+        max_bytes (int): 初回に作成するときの上限バイト数
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get("LEAFCAST_CACHE_DIR", DEFAULT_CACHE_DIR)
+    key = os.path.realpath(cache_dir)
+    with _shared_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = _shared_caches[key] = RasterDiskCache(cache_dir, max_bytes)
+        return cache
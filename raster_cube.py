@@ -0,0 +1,158 @@
+import numpy as np
+
+
+def _fit_shape(array, shape):
+    """端のずれを切り詰め・NaN埋めで吸収して形状を揃える"""
+    if array.shape == shape:
+        return array
+    fitted = np.full(shape, np.nan, dtype=np.float32)
+    rows = min(array.shape[0], shape[0])
+    cols = min(array.shape[1], shape[1])
+    fitted[:rows, :cols] = array[:rows, :cols]
+    return fitted
+
+
+class RasterCube:
+    """
+    時間 × 緯度 × 経度 のラスタをまとめたデータ構造
+
+    欠損した時刻はtime_maskがFalseになり、dataはNaNで埋まる。
+    緯度は北から南、経度は西から東の順に並ぶ（ラスタの行・列と同じ向き）。
+    """
+    def __init__(self, data, times, time_mask, bbox):
+        """
+        Args:
+            data (numpy.ndarray): (時刻, 緯度, 経度) のfloat32配列
+            times (numpy.ndarray): 各時刻のdatetime64[M]配列
+            time_mask (numpy.ndarray): 各時刻のデータが有効かどうかのbool配列
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+        """
+        self.data = np.asarray(data, dtype=np.float32)
+        self.times = np.asarray(times, dtype='datetime64[M]')
+        self.time_mask = np.asarray(time_mask, dtype=bool)
+        self.bbox = list(bbox)
+
+    @classmethod
+    def from_arrays(cls, arrays, times, bbox):
+        """
+        時刻ごとのラスタ配列のリスト（欠損はNone）からキューブを作成
+
+        Args:
+            arrays (list): 2次元ラスタ配列のリスト（欠損はNone）
+            times (list): 各ラスタの時刻（datetime64[M]に変換できる値）
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+
+        Returns:
+            RasterCube: 作成したキューブ（全時刻欠損時は0×0ピクセル）
+        """
+        shapes = [np.shape(a) for a in arrays if a is not None]
+        shape = shapes[0] if shapes else (0, 0)
+
+        data = np.full((len(arrays),) + shape, np.nan, dtype=np.float32)
+        time_mask = np.zeros(len(arrays), dtype=bool)
+        for i, array in enumerate(arrays):
+            if array is not None:
+                data[i] = _fit_shape(np.asarray(array, dtype=np.float32), shape)
+                time_mask[i] = True
+        return cls(data, times, time_mask, bbox)
+
+    @classmethod
+    def from_yearly_arrays(cls, arrays, start_year, bbox, month=4):
+        """毎年同じ月の観測を並べたラスタのリストからキューブを作成"""
+        times = [np.datetime64(f"{start_year + i:04d}-{month:02d}", 'M') for i in range(len(arrays))]
+        return cls.from_arrays(arrays, times, bbox)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def years(self):
+        """各時刻の西暦年"""
+        return self.times.astype('datetime64[Y]').astype(int) + 1970
+
+    @property
+    def months(self):
+        """各時刻の月（1～12）"""
+        return self.times.astype(int) % 12 + 1
+
+    @property
+    def lats(self):
+        """各行の中心緯度（北→南）"""
+        step = (self.bbox[3] - self.bbox[1]) / max(self.data.shape[1], 1)
+        return self.bbox[3] - step * (np.arange(self.data.shape[1]) + 0.5)
+
+    @property
+    def lons(self):
+        """各列の中心経度（西→東）"""
+        step = (self.bbox[2] - self.bbox[0]) / max(self.data.shape[2], 1)
+        return self.bbox[0] + step * (np.arange(self.data.shape[2]) + 0.5)
+
+    def read_only(self):
+        """配列を書き込み禁止にして返す（セッション間で共有するキューブ用）"""
+        self.data.flags.writeable = False
+        self.time_mask.flags.writeable = False
+        return self
+
+    def with_data(self, data):
+        """時刻軸・範囲はそのままに値だけを入れ替えたキューブ"""
+        return RasterCube(data, self.times, self.time_mask, self.bbox)
+
+    def select(self, mask):
+        """maskがTrueの時刻だけを取り出したキューブ"""
+        mask = np.asarray(mask, dtype=bool)
+        return RasterCube(self.data[mask], self.times[mask], self.time_mask[mask], self.bbox)
+
+    def frame(self, index):
+        """index番目の時刻のラスタ（欠損時はNone）"""
+        return self.data[index] if self.time_mask[index] else None
+
+    def seasonal_mean(self, months):
+        """
+        年ごとに指定した月の平均をまとめて計算（例: months=(7, 8) で7～8月平均）
+
+        季節は暦年ごとに区切る（12～2月のように年をまたぐ季節は、同じ暦年の1・2・12月の平均になる）。
+
+        Args:
+            months (tuple): 平均する月（1～12）
+
+        Returns:
+            RasterCube: (年, 緯度, 経度) のキューブ（時刻は各年の最初の指定月、該当月が全て欠損の年はtime_maskがFalse）
+        """
+        selected = np.isin(self.months, months) & self.time_mask
+        years = self.years
+        all_years = np.unique(years)
+        # 年 × 時刻 の対応行列で、年ごとの合計と有効数を1回の行列積で求める
+        groups = (all_years[:, None] == years[None, :]) & selected[None, :]
+
+        flat = self.data.reshape(len(self.data), -1)
+        valid = ~np.isnan(flat)
+        total = groups.astype(np.float64) @ np.where(valid, flat, 0).astype(np.float64)
+        count = groups.astype(np.float64) @ valid.astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (total / count).astype(np.float32)
+
+        first_month = min(months)
+        times = [np.datetime64(f"{year:04d}-{first_month:02d}", 'M') for year in all_years]
+        data = mean.reshape((len(all_years),) + self.data.shape[1:])
+        return RasterCube(data, times, groups.any(axis=1), self.bbox)
+
+    def spatial_mean(self):
+        """
+        全時刻の領域平均をまとめて計算（NaNピクセルは除外）
+
+        Returns:
+            numpy.ndarray: (時刻,) の配列（欠損時刻・全ピクセルNaNの時刻はNaN）
+        """
+        flat = self.data.reshape(len(self.data), -1)
+        valid = ~np.isnan(flat)
+        count = valid.sum(axis=1)
+        total = np.where(valid, flat, 0).sum(axis=1, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+        mean[(count == 0) | ~self.time_mask] = np.nan
+        return mean
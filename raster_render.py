@@ -0,0 +1,230 @@
+import io
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# matplotlibの'jet'と同じ区分線形データ
+_JET_DATA = {
+    'red': ((0., 0.), (0.35, 0.), (0.66, 1.), (0.89, 1.), (1., 0.5)),
+    'green': ((0., 0.), (0.125, 0.), (0.375, 1.), (0.64, 1.), (0.91, 0.), (1., 0.)),
+    'blue': ((0., 0.5), (0.11, 1.), (0.34, 1.), (0.65, 0.), (1., 0.)),
+}
+LUT_SIZE = 256
+NAN_COLOR = (255, 255, 255)
+
+
+def jet_lut(n=LUT_SIZE):
+    """
+    matplotlibの'jet'カラーマップと同じ色のルックアップテーブルを作成
+
+    Returns:
+        numpy.ndarray: (n, 3) のuint8配列
+    """
+    x = np.linspace(0, 1, n)
+    lut = np.empty((n, 3))
+    for i, channel in enumerate(('red', 'green', 'blue')):
+        points = np.array(_JET_DATA[channel])
+        lut[:, i] = np.interp(x, points[:, 0], points[:, 1])
+    return (lut * 255).astype(np.uint8)
+
+
+JET_LUT = jet_lut()
+
+
+def colorize(raster, vmin, vmax, lut=JET_LUT):
+    """
+    ラスタをルックアップテーブルで直接RGB配列に変換
+
+    Args:
+        raster (numpy.ndarray): 2次元のラスタ
+        vmin (float): カラーマップの下限
+        vmax (float): カラーマップの上限
+        lut (numpy.ndarray): (n, 3) のuint8ルックアップテーブル
+
+    Returns:
+        numpy.ndarray: (高さ, 幅, 3) のuint8配列（NaNは白）
+    """
+    raster = np.asarray(raster, dtype=np.float32)
+    n = len(lut)
+    scale = n / (vmax - vmin) if vmax > vmin else 0.0
+    with np.errstate(invalid='ignore'):
+        idx = np.clip((raster - vmin) * scale, 0, n - 1)
+    nan_mask = np.isnan(idx)
+    idx[nan_mask] = 0
+    rgb = lut[idx.astype(np.intp)]
+    rgb[nan_mask] = NAN_COLOR
+    return rgb
+
+
+def auto_range(rasters, step=1.0):
+    """
+    複数のラスタをまとめた表示範囲を求める（オーバーレイを使い回せるようstep単位に丸める）
+
+    Returns:
+        tuple: (vmin, vmax)（有効値が無い場合は (0, 1)）
+    """
+    lows = [np.nanmin(r) for r in rasters if r is not None and np.isfinite(r).any()]
+    highs = [np.nanmax(r) for r in rasters if r is not None and np.isfinite(r).any()]
+    if not lows:
+        return 0.0, 1.0
+    vmin = math.floor(min(lows) / step) * step
+    vmax = math.ceil(max(highs) / step) * step
+    if vmax <= vmin:
+        vmax = vmin + step
+    return float(vmin), float(vmax)
+
+
+class RasterRenderer:
+    """
+    ラスタのプレビュー画像を高速に描画するクラス
+
+    軸・目盛り・カラーバーはmatplotlibで条件ごとに1度だけ描いてオーバーレイとして保持し、
+    各年の画像はルックアップテーブルで色付けしたラスタを軸の中に貼り付けるだけで作る。
+    """
+    def __init__(self, figsize=(8, 6), dpi=100, max_overlays=32):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.max_overlays = max_overlays
+        self._overlays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build_overlay(self, extent, vmin, vmax, label):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.colors import Normalize
+        from PIL import Image
+
+        fig, ax = plt.subplots(figsize=self.figsize, dpi=self.dpi)
+        try:
+            ax.set_xlim(extent[0], extent[1])
+            ax.set_ylim(extent[2], extent[3])
+            cbar = plt.colorbar(ScalarMappable(norm=Normalize(vmin, vmax), cmap='jet'), ax=ax)
+            cbar.set_label(label, rotation=270, labelpad=20)
+            ax.set_xlabel('Longitude (°E)')
+            ax.set_ylabel('Latitude (°N)')
+            # タイトルは年ごとに描くので場所だけ確保する
+            ax.set_title(' ')
+            fig.tight_layout()
+            fig.canvas.draw()
+
+            width, height = fig.canvas.get_width_height()
+            base = Image.fromarray(np.asarray(fig.canvas.buffer_rgba())[..., :3].copy())
+            box = ax.get_window_extent()
+            # 枠線を残すため内側に1ピクセル寄せる
+            axes_box = (
+                int(math.ceil(box.x0)) + 1,
+                int(math.ceil(height - box.y1)) + 1,
+                int(math.floor(box.x1)) - 1,
+                int(math.floor(height - box.y0)) - 1,
+            )
+        finally:
+            plt.close(fig)
+        return base, axes_box
+
+    def _overlay(self, extent, vmin, vmax, label):
+        key = (tuple(extent), vmin, vmax, label)
+        with self._lock:
+            if key not in self._overlays:
+                self._overlays[key] = self._build_overlay(extent, vmin, vmax, label)
+                while len(self._overlays) > self.max_overlays:
+                    self._overlays.popitem(last=False)
+            self._overlays.move_to_end(key)
+            return self._overlays[key]
+
+    @staticmethod
+    def _font(size):
+        from PIL import ImageFont
+
+        try:
+            return ImageFont.load_default(size=size)
+        except TypeError:
+            return ImageFont.load_default()
+
+    def render(self, raster, bbox, vmin, vmax, label, title):
+        """
+        ラスタのプレビュー画像を描画
+
+        Args:
+            raster (numpy.ndarray): 2次元のラスタ
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+            vmin (float): カラーマップの下限
+            vmax (float): カラーマップの上限
+            label (str): カラーバーのラベル
+            title (str): 画像のタイトル
+
+        Returns:
+            PIL.Image: 描画した画像
+        """
+        from PIL import Image, ImageDraw
+
+        extent = [bbox[0], bbox[2], bbox[1], bbox[3]]  # [west, east, south, north]
+        base, (x0, y0, x1, y1) = self._overlay(extent, vmin, vmax, label)
+
+        rgb = Image.fromarray(colorize(raster, vmin, vmax))
+        frame = base.copy()
+        frame.paste(rgb.resize((x1 - x0, y1 - y0), Image.NEAREST), (x0, y0))
+
+        draw = ImageDraw.Draw(frame)
+        font = self._font(int(self.dpi * 0.17))
+        draw.text(((x0 + x1) / 2, y0 - 6), title, fill=(0, 0, 0), font=font, anchor='ms')
+        return frame
+
+
+class FrameCache:
+    """
+    描画済み画像をPNGのバイト列で保持する上限付きのLRUキャッシュ
+
+    展開済みの画像ではなく圧縮したPNGを持つため、1枚あたりのメモリは数分の1になり、
+    st.imageに渡すときの再エンコードも要らない。
+    """
+    def __init__(self, maxsize=16, max_bytes=None):
+        """
+        Args:
+            maxsize (int): 保持する画像の最大枚数
+            max_bytes (int): 保持するPNGの合計バイト数の上限（省略時は枚数だけで制限）
+        """
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        """
+        キャッシュ済みの画像を返し、無ければrender()で描画してPNGとして保持する
+
+        Args:
+            key (tuple): 画像を識別するキー
+            render (callable): 画像（PIL.Image）を描画する引数なしの関数
+
+        Returns:
+            bytes: 描画済み画像のPNG
+        """
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return self._frames[key]
+
+        buffer = io.BytesIO()
+        render().save(buffer, format="PNG")
+        frame = buffer.getvalue()
+
+        with self._lock:
+            if key in self._frames:
+                self.nbytes -= len(self._frames[key])
+            self._frames[key] = frame
+            self._frames.move_to_end(key)
+            self.nbytes += len(frame)
+            while len(self._frames) > 1 and (
+                len(self._frames) > self.maxsize or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+            ):
+                _, dropped = self._frames.popitem(last=False)
+                self.nbytes -= len(dropped)
+        return frame
+
+    def __len__(self):
+        return len(self._frames)
@@ -0,0 +1,226 @@
+"""
+よく使われるエリアの年ごとの領域平均を事前集計するインデックス
+
+使い方:
+    python region_index.py data/region_index.npz --bbox 129,31,132,34 --bbox 139,35,140,36
+    python region_index.py data/region_index.npz --regions regions.csv
+
+経緯度1度のセルごとに、各年のLST（摂氏）・NDVIの平均と有効ピクセル数を列ごとの配列として
+1つの.npzに保存する。セルの境界に揃ったbboxであれば、含まれるセルの値を有効ピクセル数で
+重み付け平均するだけで領域平均が求まるため、ラスタを取得せずに（ネットワークなしで）答えられる。
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from tile_grid import tile_layout
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "region_index.npz")
+CELL_SIZE = 1.0
+
+
+class RegionIndex:
+    """
+    セル × 年 の領域平均を列ごとの配列で保持するインデックス
+
+    各列は (セル数, 年数) の配列で、欠損はNaN（有効ピクセル数は0）になる。
+    """
+    def __init__(self, cell_west, cell_south, years, lst_mean, lst_count, ndvi_mean, ndvi_count,
+                 ppu, cell_size=CELL_SIZE):
+        """
+        Args:
+            cell_west (numpy.ndarray): 各セルの西端経度
+            cell_south (numpy.ndarray): 各セルの南端緯度
+            years (numpy.ndarray): 各列の西暦年
+            lst_mean (numpy.ndarray): (セル, 年) のLST平均（摂氏）
+            lst_count (numpy.ndarray): (セル, 年) のLSTの有効ピクセル数
+            ndvi_mean (numpy.ndarray): (セル, 年) のNDVI平均
+            ndvi_count (numpy.ndarray): (セル, 年) のNDVIの有効ピクセル数
+            ppu (int): 集計に使った解像度
+            cell_size (float): セルの一辺（度）
+        """
+        self.cell_west = np.asarray(cell_west, dtype=np.float64)
+        self.cell_south = np.asarray(cell_south, dtype=np.float64)
+        self.years = np.asarray(years, dtype=np.int64)
+        self.lst_mean = np.asarray(lst_mean, dtype=np.float32)
+        self.lst_count = np.asarray(lst_count, dtype=np.int32)
+        self.ndvi_mean = np.asarray(ndvi_mean, dtype=np.float32)
+        self.ndvi_count = np.asarray(ndvi_count, dtype=np.int32)
+        self.ppu = int(ppu)
+        self.cell_size = float(cell_size)
+        self._rows = {
+            self._cell_key(west, south): i for i, (west, south) in enumerate(zip(self.cell_west, self.cell_south))
+        }
+
+    def _cell_key(self, west, south):
+        return (int(round(west / self.cell_size)), int(round(south / self.cell_size)))
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        インデックスを読み込む
+
+        Args:
+            path (str): .npzのパス（省略時は環境変数LEAFCAST_REGION_INDEX、なければdata/region_index.npz）
+
+        Returns:
+            RegionIndex: 読み込んだインデックス（ファイルが無い場合はNone）
+        """
+        if path is None:
+            path = os.environ.get("LEAFCAST_REGION_INDEX", DEFAULT_INDEX_PATH)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(
+                data["cell_west"], data["cell_south"], data["years"],
+                data["lst_mean"], data["lst_count"], data["ndvi_mean"], data["ndvi_count"],
+                ppu=data["ppu"], cell_size=data["cell_size"],
+            )
+
+    def save(self, path):
+        """インデックスを圧縮した.npzとして保存"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp, cell_west=self.cell_west, cell_south=self.cell_south, years=self.years,
+            lst_mean=self.lst_mean, lst_count=self.lst_count,
+            ndvi_mean=self.ndvi_mean, ndvi_count=self.ndvi_count,
+            ppu=self.ppu, cell_size=self.cell_size,
+        )
+        os.replace(tmp, path)
+
+    def __len__(self):
+        return len(self.cell_west)
+
+    def _cell_rows(self, bbox):
+        """bboxを覆うセルの行番号（セル境界に揃っていない、または未集計のセルがあればNone）"""
+        cells, _, _, grid_bbox = tile_layout(bbox, self.cell_size)
+        if not np.allclose(grid_bbox, bbox) or bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+            return None
+        rows = [self._rows.get(self._cell_key(cell[0], cell[1])) for cell in cells]
+        if any(row is None for row in rows):
+            return None
+        return np.array(rows)
+
+    def covers(self, bbox):
+        """bboxの領域平均をインデックスだけで求められるかどうか"""
+        return self._cell_rows(bbox) is not None
+
+    def lookup(self, bbox, years):
+        """
+        bboxの年ごとの領域平均をセルの値から求める
+
+        Args:
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]（セル境界に揃っていること）
+            years (numpy.ndarray): 求める西暦年
+
+        Returns:
+            tuple: (LST平均の配列, NDVI平均の配列)（インデックスに無い年はNaN、bboxを答えられない場合はNone）
+        """
+        rows = self._cell_rows(bbox)
+        if rows is None:
+            return None
+
+        years = np.asarray(years)
+        cols = np.searchsorted(self.years, years)
+        found = (cols < len(self.years)) & (self.years[np.minimum(cols, len(self.years) - 1)] == years)
+        cols = np.minimum(cols, len(self.years) - 1)
+
+        def weighted_mean(mean, count):
+            mean = mean[np.ix_(rows, cols)].astype(np.float64)
+            count = count[np.ix_(rows, cols)].astype(np.float64)
+            total = np.where(count > 0, mean * count, 0).sum(axis=0)
+            n = count.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = total / n
+            result[(n == 0) | ~found] = np.nan
+            return result
+
+        return weighted_mean(self.lst_mean, self.lst_count), weighted_mean(self.ndvi_mean, self.ndvi_count)
+
+
+def _cell_stats(raster):
+    """1セル分のラスタの平均と有効ピクセル数"""
+    if raster is None:
+        return np.nan, 0
+    valid = np.isfinite(raster)
+    count = int(valid.sum())
+    if count == 0:
+        return np.nan, 0
+    return float(np.asarray(raster, dtype=np.float64)[valid].mean()), count
+
+
+def build_region_index(provider, bboxes, start_year, num_years, ppu, cell_size=CELL_SIZE):
+    """
+    bboxの集まりを覆う全てのセルについて、各年のLST・NDVIの平均を集計する
+
+    Args:
+        provider (JaxaDataProvider): データ取得クラス（既存のコレクション・キャッシュを使う）
+        bboxes (list): 集計するbboxのリスト（それぞれを覆うセルの和集合を集計する）
+        start_year (int): 開始年
+        num_years (int): 年数
+        ppu (int): 集計に使う解像度
+        cell_size (float): セルの一辺（度）
+
+    Returns:
+        RegionIndex: 作成したインデックス
+    """
+    from jaxa_api import COLLECTION_BANDS, LST_COLLECTION, NDVI_COLLECTION
+
+    cells = {}
+    for bbox in bboxes:
+        for cell in tile_layout(bbox, cell_size)[0]:
+            cells.setdefault((round(cell[0] / cell_size), round(cell[1] / cell_size)), cell)
+    cells = [cells[key] for key in sorted(cells)]
+    years = np.arange(start_year, start_year + num_years)
+
+    stats = {}
+    for coll in (LST_COLLECTION, NDVI_COLLECTION):
+        mean = np.full((len(cells), num_years), np.nan, dtype=np.float32)
+        count = np.zeros((len(cells), num_years), dtype=np.int32)
+        requests = [(cell, coll, COLLECTION_BANDS[coll], int(year)) for cell in cells for year in years]
+        for i, raster in provider.iter_fetch(requests, ppu=ppu):
+            if raster is not None and coll == LST_COLLECTION:
+                raster = raster - 273.15
+            row, col = divmod(i, num_years)
+            mean[row, col], count[row, col] = _cell_stats(raster)
+        stats[coll] = (mean, count)
+        print(f"{coll}: {len(requests)} cell-years", file=sys.stderr)
+
+    return RegionIndex(
+        [cell[0] for cell in cells], [cell[1] for cell in cells], years,
+        *stats[LST_COLLECTION], *stats[NDVI_COLLECTION], ppu=ppu, cell_size=cell_size,
+    )
+
+
+def main(argv=None):
+    from batch_forecast import NUM_YEARS, START_YEAR, load_regions
+    from jaxa_api import DEFAULT_PPU, JaxaDataProvider
+
+    parser = argparse.ArgumentParser(description="よく使われるエリアの年ごとのLST・NDVI平均を事前集計")
+    parser.add_argument("output", nargs="?", default=DEFAULT_INDEX_PATH, help="出力する.npzのパス")
+    parser.add_argument("--bbox", action="append", default=[], help="集計範囲 west,south,east,north（複数指定可）")
+    parser.add_argument("--regions", help="集計するエリア定義ファイル（batch_forecast.pyと同じ形式）")
+    parser.add_argument("--start-year", type=int, default=START_YEAR)
+    parser.add_argument("--num-years", type=int, default=NUM_YEARS)
+    parser.add_argument("--ppu", type=int, default=DEFAULT_PPU, help="集計に使う解像度（1度あたりのピクセル数）")
+    parser.add_argument("--workers", type=int, default=8, help="同時APIリクエスト数")
+    args = parser.parse_args(argv)
+
+    bboxes = [[float(v) for v in bbox.split(",")] for bbox in args.bbox]
+    if args.regions:
+        bboxes += [region["bbox"] for region in load_regions(args.regions)]
+    if not bboxes:
+        parser.error("--bbox または --regions を指定してください")
+
+    provider = JaxaDataProvider(max_workers=args.workers)
+    index = build_region_index(provider, bboxes, args.start_year, args.num_years, args.ppu)
+    index.save(args.output)
+    print(f"saved {len(index)} cells x {len(index.years)} years to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
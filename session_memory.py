@@ -0,0 +1,259 @@
+"""
+セッションごとのメモリ管理
+
+ブラウザのタブ（Streamlitのセッション）ごとに、そのセッションだけが使うデータ（ピクセル単位の回帰結果など）を
+セッションの外でまとめて保持し、サイズを数える。1セッションの上限を超えたらそのセッションの古いデータから捨て、
+全セッションの合計（共有ジョブは参照しているセッションの数によらず1回だけ数える）が上限を超えたら
+最後に使われたのが古いセッションからデータを捨てて共有ジョブの参照も外す。
+捨てられたセッションは次の再実行で必要なものを取り直す。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from instrumentation import log_event
+
+DEFAULT_MAX_SESSION_BYTES = 64 * 1024 ** 2
+DEFAULT_MAX_TOTAL_BYTES = 512 * 1024 ** 2
+# これより長く使われていないセッションは上限に関係なく捨てる（閉じたタブの分）
+SESSION_EXPIRE_SECONDS = 3600
+
+
+def value_nbytes(value):
+    """配列・bytes・nbytesを持つオブジェクト（とそれらのタプル）のおおよそのバイト数"""
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(value_nbytes(v) for v in value)
+    return int(getattr(value, "nbytes", 0))
+
+
+class _Session:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.owned = 0
+        self.shared = None
+        self.on_evict = None
+        self.last_used = time.time()
+        self.evicted = False
+
+    def shared_object(self):
+        """参照している共有データ（無ければNone）"""
+        return self.shared() if self.shared is not None else None
+
+    @property
+    def shared_bytes(self):
+        return value_nbytes(self.shared_object())
+
+
+class SessionMemoryManager:
+    """
+    全セッションのデータを上限付きで保持するマネージャ（プロセスに1つ）
+
+    各セッションは毎回の実行の始めにtouch()を呼ぶ。セッションのデータはput()/get()で出し入れし、
+    共有ジョブなど他のセッションと共有するデータの参照はtouch()のsharedで知らせる。
+    1セッションの上限はそのセッションのデータだけに適用し、共有データは全体の合計に1つにつき1回だけ数える。
+    """
+    def __init__(self, max_session_bytes=None, max_total_bytes=None, expire_seconds=SESSION_EXPIRE_SECONDS):
+        """
+        Args:
+            max_session_bytes (int): 1セッションが持てるデータの上限（省略時は環境変数LEAFCAST_SESSION_MAX_BYTES、なければ64MiB）
+            max_total_bytes (int): 全セッションの合計の上限（省略時は環境変数LEAFCAST_SESSIONS_MAX_BYTES、なければ512MiB）
+            expire_seconds (float): この秒数より長く使われていないセッションは捨てる
+        """
+        if max_session_bytes is None:
+            max_session_bytes = int(os.environ.get("LEAFCAST_SESSION_MAX_BYTES", DEFAULT_MAX_SESSION_BYTES))
+        if max_total_bytes is None:
+            max_total_bytes = int(os.environ.get("LEAFCAST_SESSIONS_MAX_BYTES", DEFAULT_MAX_TOTAL_BYTES))
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.expire_seconds = expire_seconds
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, session_id, shared=None, on_evict=None):
+        """
+        セッションを最近使ったものとして記録
+
+        Args:
+            session_id (str): セッションの識別子
+            shared (callable): セッションが参照している共有データ（nbytesを持つオブジェクト、無ければNone）を返す関数
+            on_evict (callable): セッションのデータを捨てるときに呼ぶ関数（共有ジョブの参照を外すなど）
+
+        Returns:
+            bool: 前回のtouch()以降にデータが捨てられていたかどうか
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.time()
+            session.shared = shared
+            session.on_evict = on_evict
+            evicted, session.evicted = session.evicted, False
+            callbacks = self._evict_sessions(keep=session_id)
+        self._run_callbacks(callbacks)
+        return evicted
+
+    def get(self, session_id, name, default=None):
+        """セッションのデータを取り出す（捨てられていればdefault）"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or name not in session.entries:
+                return default
+            session.entries.move_to_end(name)
+            return session.entries[name][0]
+
+    def put(self, session_id, name, value, nbytes=None):
+        """
+        セッションのデータを保持する
+
+        1セッションの上限を超えた場合はそのセッションの古いデータから、全体の上限を超えた場合は
+        最後に使われたのが古い他のセッションから捨てる。
+
+        Args:
+            session_id (str): セッションの識別子
+            name (str): データの名前
+            value: 保持する値
+            nbytes (int): 値のバイト数（省略時はvalue_nbytesで数える）
+        """
+        nbytes = value_nbytes(value) if nbytes is None else int(nbytes)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+            self._sessions.move_to_end(session_id)
+            if name in session.entries:
+                session.owned -= session.entries.pop(name)[1]
+            session.entries[name] = (value, nbytes)
+            session.owned += nbytes
+
+            # 1セッションの上限（今入れたデータは残す）
+            while session.owned > self.max_session_bytes and len(session.entries) > 1:
+                _, (_, dropped) = session.entries.popitem(last=False)
+                session.owned -= dropped
+            callbacks = self._evict_sessions(keep=session_id)
+        self._run_callbacks(callbacks)
+
+    def drop(self, session_id, name):
+        """セッションのデータを捨てる"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and name in session.entries:
+                session.owned -= session.entries.pop(name)[1]
+
+    def _shared_refs(self):
+        """共有データごとの (バイト数, 参照しているセッション数)（呼び出し元でロックを取る）"""
+        refs = {}
+        for session in self._sessions.values():
+            shared = session.shared_object()
+            if shared is not None:
+                nbytes, n_refs = refs.get(id(shared), (value_nbytes(shared), 0))
+                refs[id(shared)] = (nbytes, n_refs + 1)
+        return refs
+
+    def _total_bytes(self, refs):
+        return sum(session.owned for session in self._sessions.values()) + sum(nbytes for nbytes, _ in refs.values())
+
+    @staticmethod
+    def _releasable(session, refs):
+        """セッションを捨てたときに減る合計バイト数（他のセッションも参照している共有データは減らない）"""
+        shared = session.shared_object()
+        if shared is None:
+            return session.owned
+        nbytes, n_refs = refs[id(shared)]
+        return session.owned + (nbytes if n_refs == 1 else 0)
+
+    @staticmethod
+    def _drop_ref(session, refs):
+        """捨てたセッションの共有データの参照を数から外す"""
+        shared = session.shared_object()
+        if shared is not None:
+            nbytes, n_refs = refs[id(shared)]
+            refs[id(shared)] = (nbytes, n_refs - 1)
+
+    def _evict_sessions(self, keep):
+        """全体の上限を超えている間、古いセッションのデータを捨てる（呼び出し元でロックを取る）"""
+        callbacks = []
+        now = time.time()
+        refs = self._shared_refs()
+        total = self._total_bytes(refs)
+        for session_id in list(self._sessions):
+            session = self._sessions[session_id]
+            if session_id == keep:
+                continue
+            if now - session.last_used > self.expire_seconds:
+                # 長く使われていないセッションは記録ごと消す
+                total -= self._releasable(session, refs)
+                self._drop_ref(session, refs)
+                callbacks += self._clear(session_id, session)
+                del self._sessions[session_id]
+                continue
+            if total <= self.max_total_bytes:
+                # 残りは全て期限内で、使われた順に並んでいる
+                break
+            released = self._releasable(session, refs)
+            if released == 0:
+                # 捨てても何も減らないセッション（他と同じジョブだけを参照）はそのままにする
+                continue
+            total -= released
+            self._drop_ref(session, refs)
+            callbacks += self._clear(session_id, session)
+        return callbacks
+
+    def _clear(self, session_id, session):
+        """セッションのデータを捨て、呼ぶべき後始末の関数を返す"""
+        callbacks = [session.on_evict] if session.on_evict is not None else []
+        nbytes = session.owned + session.shared_bytes
+        session.entries.clear()
+        session.owned = 0
+        session.evicted = True
+        session.shared = None
+        session.on_evict = None
+        if nbytes > 0:
+            self.evictions += 1
+            log_event("session.evicted", session=session_id[:8], bytes=nbytes)
+        return callbacks
+
+    @staticmethod
+    def _run_callbacks(callbacks):
+        # 他のセッションのジョブの参照を外す処理はロックの外で行う
+        for callback in callbacks:
+            callback()
+
+    def usage(self):
+        """
+        現在のメモリ使用量
+
+        Returns:
+            dict: {'sessions': [{'session', 'owned_bytes', 'shared_bytes', 'entries', 'idle_seconds'}],
+                   'total_bytes'（共有データは1回だけ数える）, 'max_session_bytes', 'max_total_bytes', 'evictions'}
+        """
+        now = time.time()
+        with self._lock:
+            sessions = [
+                {
+                    "session": session_id[:8],
+                    "owned_bytes": session.owned,
+                    "shared_bytes": session.shared_bytes,
+                    "entries": len(session.entries),
+                    "idle_seconds": round(now - session.last_used, 1),
+                }
+                for session_id, session in reversed(self._sessions.items())
+            ]
+            total = self._total_bytes(self._shared_refs())
+        return {
+            "sessions": sessions,
+            "total_bytes": total,
+            "max_session_bytes": self.max_session_bytes,
+            "max_total_bytes": self.max_total_bytes,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._sessions)
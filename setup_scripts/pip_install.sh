@@ -1,3 +1,3 @@
 pip install --upgrade pip
-pip install streamlit folium streamlit-folium matplotlib leafmap pandas scikit-learn
+pip install streamlit folium streamlit-folium matplotlib leafmap pandas
 pip install ./jaxaearth/jaxa-earth-0.1.3.zip
\ No newline at end of file
@@ -0,0 +1,116 @@
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+from fetch_jobs import DEFAULT_DEBOUNCE, FetchJob
+
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+class SharedResultStore:
+    """
+    プロセス全体で取得ジョブと結果のキューブを共有するストア
+
+    同じ条件の取得は1つのジョブにまとめられ（single-flight）、後から来たセッションは
+    実行中のジョブの途中経過をそのまま参照する。完了したキューブは読み取り専用で共有し、
+    どのセッションからも参照されていない結果は、合計サイズがmax_bytesを超えたら
+    最後に使われたのが古いものから破棄する（LRU）。
+    """
+    def __init__(self, provider, max_bytes=None, debounce=DEFAULT_DEBOUNCE, progressive=False):
+        """
+        Args:
+            provider (JaxaDataProvider): データ取得クラス
+            max_bytes (int): 保持する結果の上限バイト数（省略時は環境変数LEAFCAST_SHARED_MAX_BYTES、なければ512MiB）
+            debounce (float): ジョブが取得を始めるまでの待ち時間（秒）
+            progressive (bool): 低解像度の速報を先に取得してから本来の解像度で取得するかどうか
+        """
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("LEAFCAST_SHARED_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+        self.provider = provider
+        self.max_bytes = max_bytes
+        self.debounce = debounce
+        self.progressive = progressive
+        self._jobs = OrderedDict()
+        self._holders = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _store_key(key, start_year, num_years):
+        return (key, start_year, num_years)
+
+    def acquire(self, holder, key, bbox, start_year, num_years):
+        """
+        条件に合うジョブを取得する（実行中・完了済みのものがあれば共有し、無ければ開始する）
+
+        Args:
+            holder (object): ジョブを参照する側（セッションのジョブ管理など）。参照は弱参照で保持する
+            key (str): bboxを識別するキー
+            bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+            start_year (int): 開始年
+            num_years (int): 取得する年数
+
+        Returns:
+            FetchJob: 共有されたジョブ
+        """
+        store_key = self._store_key(key, start_year, num_years)
+        with self._lock:
+            job = self._jobs.get(store_key)
+            if job is None or job.cancel_requested or job.status == FetchJob.FAILED:
+                job = FetchJob(key, bbox, start_year, num_years, progressive=self.progressive)
+                self._jobs[store_key] = job
+                self._holders[store_key] = weakref.WeakSet()
+                threading.Thread(target=self._run, args=(store_key, job), daemon=True).start()
+            self._jobs.move_to_end(store_key)
+            self._holders[store_key].add(holder)
+            return job
+
+    def release(self, holder, job):
+        """
+        ジョブの参照をやめる（誰も参照していない未完了のジョブは取り消す）
+
+        Args:
+            holder (object): acquire()に渡したのと同じ参照元
+            job (FetchJob): 参照をやめるジョブ
+        """
+        store_key = self._store_key(job.key, job.start_year, job.num_years)
+        with self._lock:
+            if self._jobs.get(store_key) is not job:
+                return
+            holders = self._holders[store_key]
+            holders.discard(holder)
+            if not holders and not job.finished:
+                job.cancel()
+            self._evict()
+
+    def _run(self, store_key, job):
+        job.run(self.provider, self.debounce)
+        with self._lock:
+            if job.status != FetchJob.DONE and self._jobs.get(store_key) is job:
+                del self._jobs[store_key]
+                del self._holders[store_key]
+            self._evict()
+
+    def _evict(self):
+        """参照されていない完了済みの結果を、上限に収まるまで古いものから破棄"""
+        total = self._total_bytes()
+        for store_key in list(self._jobs):
+            if total <= self.max_bytes:
+                break
+            job = self._jobs[store_key]
+            if job.finished and not self._holders[store_key]:
+                total -= job.nbytes
+                del self._jobs[store_key]
+                del self._holders[store_key]
+
+    def _total_bytes(self):
+        return sum(job.nbytes for job in self._jobs.values())
+
+    def total_bytes(self):
+        """保持している結果の合計バイト数"""
+        with self._lock:
+            return self._total_bytes()
+
+    def __len__(self):
+        return len(self._jobs)
@@ -0,0 +1,135 @@
+import math
+
+import numpy as np
+
+DEFAULT_TILE_SIZE = 1.0
+# API取得のタイル一辺のピクセル数の目安と、タイルの一辺（度）の上限
+# （隣り合う足りないタイルはまとめて1回で取得するため、タイルを小さくしてもリクエスト数は増えない）
+DEFAULT_TILE_PIXELS = 64
+MAX_TILE_SIZE = 32.0
+
+
+def tile_size_for_ppu(ppu, tile_pixels=DEFAULT_TILE_PIXELS):
+    """
+    解像度に応じたタイルの一辺（度）
+
+    一辺がtile_pixelsピクセル以下になる最大の2の冪（1～MAX_TILE_SIZE度）を選ぶ。
+    解像度が粗いほどタイルが広くなり、1リクエストあたりのピクセル数が解像度によらずほぼ一定になる。
+
+    Args:
+        ppu (float): 1度あたりのピクセル数
+        tile_pixels (int): タイル一辺のピクセル数の上限
+
+    Returns:
+        float: タイルの一辺（度）
+    """
+    exponent = int(math.floor(math.log2(max(tile_pixels / ppu, 1.0))))
+    return min(float(2 ** exponent), MAX_TILE_SIZE)
+
+
+def tile_layout(bbox, tile_size=DEFAULT_TILE_SIZE):
+    """
+    bboxを覆う固定グリッドのタイルを求める
+
+    タイルの境界はtile_sizeの整数倍に揃えるため、地図を少し動かしても
+    重なっている部分のタイルは同じbboxになりキャッシュを再利用できる。
+
+    Args:
+        bbox (list): [西経度, 南緯度, 東経度, 北緯度]
+        tile_size (float): タイルの一辺（度）
+
+    Returns:
+        tuple: (タイルbboxのリスト（北→南、西→東の順）, 行数, 列数, グリッド全体のbbox)
+    """
+    west = math.floor(bbox[0] / tile_size) * tile_size
+    south = math.floor(bbox[1] / tile_size) * tile_size
+    east = math.ceil(bbox[2] / tile_size) * tile_size
+    north = math.ceil(bbox[3] / tile_size) * tile_size
+
+    n_cols = max(int(round((east - west) / tile_size)), 1)
+    n_rows = max(int(round((north - south) / tile_size)), 1)
+
+    tiles = []
+    for row in range(n_rows):
+        tile_north = north - row * tile_size
+        for col in range(n_cols):
+            tile_west = west + col * tile_size
+            tiles.append([tile_west, tile_north - tile_size, tile_west + tile_size, tile_north])
+
+    grid_bbox = [west, north - n_rows * tile_size, west + n_cols * tile_size, north]
+    return tiles, n_rows, n_cols, grid_bbox
+
+
+def _fit_shape(array, height, width):
+    """APIが返すラスタの端の1ピクセル程度のずれを切り詰め・NaN埋めで吸収"""
+    fitted = np.full((height, width), np.nan, dtype=np.float32)
+    rows = min(array.shape[0], height)
+    cols = min(array.shape[1], width)
+    fitted[:rows, :cols] = array[:rows, :cols]
+    return fitted
+
+
+def mosaic_tiles(tile_arrays, n_rows, n_cols, tile_pixels):
+    """
+    タイル配列を1枚のラスタに結合
+
+    Args:
+        tile_arrays (list): tile_layoutと同じ順序のタイル配列（欠損はNone）
+        n_rows (int): 行数
+        n_cols (int): 列数
+        tile_pixels (int): タイル一辺のピクセル数
+
+    Returns:
+        numpy.ndarray: 結合したラスタ（全タイル欠損時はNone）
+    """
+    if all(tile is None for tile in tile_arrays):
+        return None
+
+    mosaic = np.full((n_rows * tile_pixels, n_cols * tile_pixels), np.nan, dtype=np.float32)
+    for i, tile in enumerate(tile_arrays):
+        if tile is None:
+            continue
+        row, col = divmod(i, n_cols)
+        mosaic[row * tile_pixels:(row + 1) * tile_pixels,
+               col * tile_pixels:(col + 1) * tile_pixels] = _fit_shape(tile, tile_pixels, tile_pixels)
+    return mosaic
+
+
+def split_tiles(raster, n_rows, n_cols, tile_pixels):
+    """
+    複数タイル分の範囲をまとめて取得したラスタをタイルごとに分ける（mosaic_tilesの逆）
+
+    Args:
+        raster (numpy.ndarray): n_rows × n_cols タイル分の範囲のラスタ
+        n_rows (int): 行数
+        n_cols (int): 列数
+        tile_pixels (int): タイル一辺のピクセル数
+
+    Returns:
+        list: tile_layoutと同じ順序（北→南、西→東）のタイル配列
+    """
+    fitted = _fit_shape(raster, n_rows * tile_pixels, n_cols * tile_pixels)
+    return [
+        fitted[row * tile_pixels:(row + 1) * tile_pixels, col * tile_pixels:(col + 1) * tile_pixels].copy()
+        for row in range(n_rows) for col in range(n_cols)
+    ]
+
+
+def crop_to_bbox(mosaic, grid_bbox, bbox, ppu):
+    """
+    グリッド全体のラスタから要求範囲を切り出す
+
+    Args:
+        mosaic (numpy.ndarray): mosaic_tilesの結果
+        grid_bbox (list): モザイク全体のbbox
+        bbox (list): 切り出す範囲
+        ppu (float): 1度あたりのピクセル数
+
+    Returns:
+        numpy.ndarray: 切り出したラスタ
+    """
+    col0 = int(round((bbox[0] - grid_bbox[0]) * ppu))
+    col1 = int(round((bbox[2] - grid_bbox[0]) * ppu))
+    row0 = int(round((grid_bbox[3] - bbox[3]) * ppu))
+    row1 = int(round((grid_bbox[3] - bbox[1]) * ppu))
+    return mosaic[row0:max(row1, row0 + 1), col0:max(col1, col0 + 1)]
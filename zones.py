@@ -0,0 +1,279 @@
+"""
+任意の多角形（区・公園・緑化予定地など）ごとの集計
+
+GeoJSONの多角形を取得元の格子（キューブのbbox・形状）上のピクセルマスクにラスタ化する。
+マスクはゾーンの形と格子の組ごとにキャッシュして使い回し、1つでも多数でもゾーンの全年の平均は
+(時刻, ピクセル) × (ピクセル, ゾーン) の1回の行列積で求める。
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from future_prefiction import ChainedForecast, batched_linregress
+from instrumentation import count, stage
+
+DEFAULT_ZONE_NAME = "ゾーン"
+# ゾーン名として使うGeoJSONのプロパティ（先に見つかったもの）
+NAME_PROPERTIES = ("name", "NAME", "名称", "N03_004")
+DEFAULT_MASK_CACHE_BYTES = 64 * 1024 ** 2
+
+
+class Zone:
+    """
+    1つのゾーン（外周と穴の輪郭の集まり）
+
+    内外は偶奇規則で判定するため、MultiPolygonの各部分と穴は輪郭を並べるだけで表せる。
+    """
+    def __init__(self, name, rings):
+        """
+        Args:
+            name (str): ゾーン名
+            rings (list): 輪郭ごとの (頂点数, 2) の [経度, 緯度] 配列
+        """
+        self.name = name
+        self.rings = [np.asarray(ring, dtype=np.float64).reshape(-1, 2) for ring in rings]
+
+    @property
+    def key(self):
+        """形だけから決まる識別子（名前を変えても同じマスクを使い回す）"""
+        digest = hashlib.sha1()
+        for ring in self.rings:
+            digest.update(np.ascontiguousarray(ring).tobytes())
+            digest.update(b"|")
+        return digest.hexdigest()
+
+    @property
+    def bounds(self):
+        """[西経度, 南緯度, 東経度, 北緯度]"""
+        points = np.concatenate(self.rings)
+        return [*points.min(axis=0), *points.max(axis=0)]
+
+
+def _polygon_rings(geometry):
+    """GeoJSONのジオメトリの全ての輪郭（多角形以外は空）"""
+    if not geometry:
+        return []
+    kind = geometry.get("type")
+    if kind == "Polygon":
+        return [ring for ring in geometry.get("coordinates", []) if len(ring) >= 3]
+    if kind == "MultiPolygon":
+        return [ring for polygon in geometry.get("coordinates", []) for ring in polygon if len(ring) >= 3]
+    if kind == "GeometryCollection":
+        return [ring for part in geometry.get("geometries", []) for ring in _polygon_rings(part)]
+    return []
+
+
+def zones_from_geojson(data, default_name=DEFAULT_ZONE_NAME):
+    """
+    GeoJSON（FeatureCollection・Feature・ジオメトリ、またはそれらのリスト）からゾーンを作成
+
+    多角形を含まない地物は飛ばす。座標は経度・緯度（WGS84）とみなす。
+
+    Args:
+        data: GeoJSONの文字列・バイト列、または読み込み済みの辞書・リスト
+        default_name (str): 名前のプロパティが無い地物の名前（通し番号を付ける）
+
+    Returns:
+        list: Zoneのリスト
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8-sig")
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid GeoJSON: {e}") from e
+
+    if isinstance(data, list):
+        features = data
+    elif isinstance(data, dict) and data.get("type") == "FeatureCollection":
+        features = data.get("features", [])
+    else:
+        features = [data]
+
+    zones = []
+    for feature in features:
+        if not isinstance(feature, dict):
+            continue
+        if feature.get("type") == "Feature":
+            geometry, properties = feature.get("geometry"), feature.get("properties") or {}
+        else:
+            geometry, properties = feature, {}
+        rings = _polygon_rings(geometry)
+        if not rings:
+            continue
+        name = next((str(properties[p]) for p in NAME_PROPERTIES if properties.get(p)), None)
+        zones.append(Zone(name or f"{default_name}{len(zones) + 1}", rings))
+    return zones
+
+
+def rasterize_zone(zone, bbox, shape):
+    """
+    ゾーンを格子上のピクセルマスクに変換（ピクセル中心が内側にあればTrue）
+
+    行ごとに各辺との交点を求め、交点の右側のピクセルの内外を反転させる走査線法を、
+    全ての行・辺について配列演算でまとめて行う。
+    どのピクセル中心も含まない小さなゾーン（公園など）は、重心を含むピクセルだけをTrueにする。
+
+    Args:
+        zone (Zone): ゾーン
+        bbox (list): 格子の範囲 [西経度, 南緯度, 東経度, 北緯度]
+        shape (tuple): 格子の (行数, 列数)（行は北から南、列は西から東）
+
+    Returns:
+        numpy.ndarray: (行数, 列数) のbool配列
+    """
+    height, width = shape
+    mask = np.zeros((height, width), dtype=bool)
+    if height == 0 or width == 0 or not zone.rings:
+        return mask
+
+    west, south, east, north = bbox
+    lat_step = (north - south) / height
+    lon_step = (east - west) / width
+    lats = north - lat_step * (np.arange(height) + 0.5)
+    lons = west + lon_step * (np.arange(width) + 0.5)
+
+    # 閉じた輪郭の全ての辺 (始点, 終点)
+    starts = np.concatenate(zone.rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in zone.rings])
+    x0, y0, x1, y1 = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+    # (行, 辺) ごとに、行の中心緯度を辺がまたぐかどうかと交点の経度
+    crosses = (y0[None, :] <= lats[:, None]) != (y1[None, :] <= lats[:, None])
+    rows, edges = np.nonzero(crosses)
+    if len(rows):
+        t = (lats[rows] - y0[edges]) / (y1[edges] - y0[edges])
+        x = x0[edges] + t * (x1[edges] - x0[edges])
+        cols = np.searchsorted(lons, x, side="right")
+        toggles = np.zeros((height, width + 1), dtype=np.int32)
+        np.add.at(toggles, (rows, cols), 1)
+        mask = (np.cumsum(toggles[:, :width], axis=1) % 2).astype(bool)
+
+    if not mask.any():
+        lon, lat = np.concatenate(zone.rings).mean(axis=0)
+        row, col = int((north - lat) // lat_step), int((lon - west) // lon_step)
+        if 0 <= row < height and 0 <= col < width:
+            mask[row, col] = True
+    return mask
+
+
+class ZoneMaskCache:
+    """
+    ゾーンのピクセルマスクを (ゾーンの形, 格子) ごとに保持する上限付きのLRUキャッシュ
+
+    格子は取得元のbboxと形状で決まるため、同じエリアの速報（低解像度）と本来の解像度は別々に保持する。
+    """
+    def __init__(self, max_bytes=DEFAULT_MASK_CACHE_BYTES):
+        """
+        Args:
+            max_bytes (int): 保持するマスクの合計バイト数の上限
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mask(self, zone, bbox, shape):
+        """ゾーンのマスク（読み取り専用、無ければラスタ化して保持）"""
+        key = (zone.key, tuple(round(float(v), 6) for v in bbox), tuple(shape))
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                count("zones.mask_hit")
+                return self._masks[key]
+
+        count("zones.mask_miss")
+        with stage("zones.rasterize", pixels=int(np.prod(shape)), vertices=sum(len(r) for r in zone.rings)):
+            mask = rasterize_zone(zone, bbox, shape)
+        mask.flags.writeable = False
+
+        with self._lock:
+            if key not in self._masks:
+                self.nbytes += mask.nbytes
+            self._masks[key] = mask
+            self._masks.move_to_end(key)
+            while len(self._masks) > 1 and self.nbytes > self.max_bytes:
+                _, dropped = self._masks.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+        return mask
+
+    def masks(self, zones, bbox, shape):
+        """
+        複数ゾーンのマスクをまとめて取得
+
+        Returns:
+            numpy.ndarray: (ゾーン, 行, 列) のbool配列
+        """
+        if not zones:
+            return np.zeros((0,) + tuple(shape), dtype=bool)
+        return np.stack([self.mask(zone, bbox, shape) for zone in zones])
+
+    def __len__(self):
+        return len(self._masks)
+
+
+def zonal_means(cube, masks):
+    """
+    全時刻・全ゾーンの平均をまとめて計算（NaNピクセルは除外）
+
+    どれかのゾーンに含まれるピクセルだけを取り出し、(時刻, ピクセル) × (ピクセル, ゾーン) の行列積で
+    ゾーンごとの合計と有効ピクセル数を1回で求める。
+
+    Args:
+        cube (RasterCube): 集計するキューブ
+        masks (numpy.ndarray): cubeと同じ格子の (ゾーン, 行, 列) のbool配列
+
+    Returns:
+        numpy.ndarray: (時刻, ゾーン) の配列（欠損時刻・有効ピクセルが無いゾーンはNaN）
+    """
+    n_zones = len(masks)
+    flat_masks = masks.reshape(n_zones, int(np.prod(masks.shape[1:])))
+    with stage("zones.reduce", zones=n_zones, times=len(cube.data)):
+        pixels = np.flatnonzero(flat_masks.any(axis=0))
+        values = cube.data.reshape(len(cube.data), -1)[:, pixels].astype(np.float64)
+        valid = ~np.isnan(values)
+        weights = flat_masks[:, pixels].T.astype(np.float64)
+        total = np.where(valid, values, 0) @ weights
+        counts = valid.astype(np.float64) @ weights
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = total / counts
+    means[counts == 0] = np.nan
+    means[~cube.time_mask] = np.nan
+    return means
+
+
+def fit_zone_forecasts(years, ndvi_means, lst_means):
+    """
+    ゾーンごとの NDVI～年 / LST～NDVI の予測モデルをまとめて当てはめる
+
+    Args:
+        years (array-like): (時刻,) の観測年
+        ndvi_means (numpy.ndarray): (時刻, ゾーン) のNDVI平均（欠損はNaN）
+        lst_means (numpy.ndarray): (時刻, ゾーン) のLST平均（欠損はNaN）
+
+    Returns:
+        list: ゾーンごとのChainedForecast（両方揃った観測が2年未満のゾーンはNone）
+    """
+    years = np.asarray(years, dtype=np.float64)
+    ndvi = np.asarray(ndvi_means, dtype=np.float64)
+    lst = np.asarray(lst_means, dtype=np.float64)
+    # fit_forecastと同じく、NDVI・LSTの両方が揃った年だけを使う
+    joint = np.isfinite(ndvi) & np.isfinite(lst)
+    ndvi = np.where(joint, ndvi, np.nan)
+    lst = np.where(joint, lst, np.nan)
+
+    ndvi_slope, ndvi_intercept, n_obs = batched_linregress(years[:, None], ndvi)
+    lst_slope, lst_intercept, _ = batched_linregress(ndvi, lst)
+    forecasts = []
+    for i in range(ndvi.shape[1]):
+        if n_obs[i] < 2 or not np.isfinite([ndvi_slope[i], lst_slope[i]]).all():
+            forecasts.append(None)
+        else:
+            forecasts.append(ChainedForecast(
+                float(ndvi_slope[i]), float(ndvi_intercept[i]), float(lst_slope[i]), float(lst_intercept[i])
+            ))
+    return forecasts